@@ -3,388 +3,648 @@
 # Aidan Buchanan
 
 import os
-import json
-from openai import OpenAI
+import logging
+import threading
 import numpy as np
-from scipy.spatial.distance import cosine
+from embed_store import EmbedStore, migrate_json
+from similarity import SimilarityEngine
+from embeddings import EmbeddingCache, EmbeddingBatcher, OpenAIEmbedder
+from storage import open_log, save_atomic
+from jsonstream import iter_records
+from uids import UidAllocator
+from demographics import DemoIndex, SCORE_KEYS, DEMOGRAPHICS
+from vector_index import make_index, top_k, IVFIndex
+from references import ReferenceScores
+from database import SurveyDatabase
+from cohorts import CohortIndex
+from generation import Generator, OpenAIChat, make_job, job_key, CHAT_MODEL
+import survey
+import stats
+import profiling
 
-client = OpenAI()
-RESPONSES = "Data\\responses.json"
-EMBEDS = "Data\embeds.json"
-COMPARED = "Data\compared.json"
-CUSTOMQS = "Data\customsqs.json"
+log = logging.getLogger(__name__)
+
+# The Data folder next to this file, no matter where the program is started from.
+# Setting ANALYSIS_DATA points everything at another folder instead.
+DATA_DIR = os.environ.get("ANALYSIS_DATA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data"))
+# Responses, compared scores and custom questions are append only logs, see storage.py
+RESPONSES = os.path.join(DATA_DIR, "responses.jsonl")
+COMPARED = os.path.join(DATA_DIR, "compared.jsonl")
+CUSTOMQS = os.path.join(DATA_DIR, "customsqs.jsonl")
+# Every LLM answer generated so far, so generating the same thing again costs nothing
+GENERATIONS = os.path.join(DATA_DIR, "generations.jsonl")
+# Legacy embeddings file. Only read once to migrate it into the columnar store below.
+EMBEDS = os.path.join(DATA_DIR, "embeds.json")
+EMBED_STORE = os.path.join(DATA_DIR, "embeds")
+# Format a new embedding store is made in, like "float32" (exact), "float16", "int8" or "int8:512".
+# An existing store keeps its format, python compact.py convert makes a copy in another one.
+EMBED_MODE = os.environ.get("ANALYSIS_EMBED_MODE", "float32")
+EMBED_CACHE = os.path.join(DATA_DIR, "embed_cache.sqlite")
+EMBED_CACHE_SIZE = 200000
+UID_COUNTER = os.path.join(DATA_DIR, "uid_counter.txt")
+# Registry of reference responses and everybody's scores against each of them, see references.py
+REFERENCE_DIR = os.path.join(DATA_DIR, "references")
+# The reference compared.jsonl and the demographic charts are scored against
+CHATGPT_UID = 1
+# Optional SQLite copy of all of the above with indexed demographic columns for cohort queries, see
+# database.py. ANALYSIS_BACKEND=sqlite keeps it up to date as data comes in.
+DATABASE = os.path.join(DATA_DIR, "survey.sqlite")
+USE_DATABASE = os.environ.get("ANALYSIS_BACKEND", "").lower() == "sqlite"
+# The .json files older versions rewrote on every save. They get copied into the logs the first
+# time a log is opened.
+LEGACY_FILES = {
+    RESPONSES: os.path.join(DATA_DIR, "responses.json"),
+    COMPARED: os.path.join(DATA_DIR, "compared.json"),
+    CUSTOMQS: os.path.join(DATA_DIR, "customsqs.json")
+}
+LOG_KEYS = {RESPONSES: "uid", COMPARED: "uid"}
 LOWBAR = 0
+# Nearest neighbour indexes kept in memory at once, see get_vector_index. Each one holds a float32 copy
+# of one question's vectors, respondents x dimensions x 4 bytes (about 600 MB for 100k respondents
+# at 1536 dimensions), whatever format the embedding store is in.
+MAX_VECTOR_INDEXES = 2
+# Rows decoded at a time while filling an index
+INDEX_BLOCK = 8192
+
+_store = None
+_engine = None
+_cache = None
+_logs = {}
+_allocator = None
+_demo_index = None
+_vector_indexes = {}
+_references = None
+_llm = None
+_database = None
+_cohorts = None
+# (data_version, rc, resamples) -> bootstrap intervals, the last few that were asked for
+_intervals = {}
+# The GUI reads the demographic index on the main thread while a background task may be adding to it
+_index_lock = threading.RLock()
+
+# Record log for one of the datasets above, opened once per run
+def get_log(filename):
+    if filename not in _logs:
+        _logs[filename] = open_log(filename, LEGACY_FILES.get(filename), LOG_KEYS.get(filename))
+    return _logs[filename]
 
-# json loader method
-def load_json(filename):
+# json loader method. Works for the record logs as well as plain .json files.
+# fields keeps only those keys of every record. Plain .json files are streamed, so asking for a few
+# fields of a big file never holds the rest of it in memory.
+@profiling.timed()
+def load_json(filename, fields=None):
+    if filename.endswith(".jsonl"):
+        records = get_log(filename).load()
+        if fields is not None:
+            records = [{field: record[field] for field in fields if field in record} for record in records]
+        return records
     if not os.path.exists(filename):
         return []
-    with open(filename, "r") as file:
-        return json.load(file)
+    return list(iter_records(filename, fields))
 
-# json saver method :)
+# json saver method :) Replaces the whole file without ever leaving a half written one behind.
+# New records should be added with get_log(filename).append instead, which doesn't rewrite anything.
+@profiling.timed()
 def save_json(user, filename):
-    with open(filename, "w") as file:
-        json.dump(user, file, indent=4)
+    if filename.endswith(".jsonl"):
+        get_log(filename).rewrite(user)
+    else:
+        save_atomic(user, filename)
+
+# Opens the embedding store once per run. If the store is empty but an old embeds.json is around,
+# that file gets migrated into it first.
+def get_store():
+    global _store
+    if _store is None:
+        store = EmbedStore(EMBED_STORE, survey.EMBED_KEYS, EMBED_MODE)
+        if len(store) and store.questions != survey.EMBED_KEYS:
+            raise ValueError(f"The embedding store in {DATA_DIR} was made for a survey with {len(store.questions)} "
+                             f"questions, this survey has {len(survey.EMBED_KEYS)}. Use another ANALYSIS_DATA folder.")
+        if len(store) == 0 and os.path.exists(EMBEDS):
+            migrate_json(EMBEDS, store)
+        _store = store
+    return _store
+
+# The SQLite database, caught up with the logs and the embedding store the first time it is opened
+# in a run if it is missing anything
+def get_database():
+    global _database
+    if _database is None:
+        database = SurveyDatabase(DATABASE)
+        if database.embedded() != len(get_store()) or len(database) != len(get_demo_index()):
+            database.sync(get_log(RESPONSES), get_log(COMPARED), get_store(), get_log(CUSTOMQS))
+        _database = database
+    return _database
+
+# Respondents matching filters, a dict of demographic -> value or list of values, for example
+# cohort({"gender": "Female", "age": "25-34", "education": "Bachelor's Degree"}, "r5c").
+# Values can be group labels, form options or, for age, a number. Returns (uids, scores) for the score
+# column rc, leaving out scores at or below LOWBAR. Answered by SQLite from the indexes.
+def cohort(filters, rc="rtc"):
+    return get_database().cohort_scores(filters, rc, LOWBAR)
+
+# Shared similarity engine. It is built once and picks up any rows added since the last call.
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = SimilarityEngine(get_store())
+    else:
+        _engine.refresh()
+    return _engine
 
-# This function will search all responses for this question q to see if they are the same as the response inputted
-# If a response matches perfectly, the embedding for it will be fetched
+# Embedding cache shared by everything that needs an embedding. A brand new cache is filled with the
+# answers we already have embeddings for, so nothing already embedded gets sent again.
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(EMBED_CACHE, OpenAIEmbedder(), max_entries=EMBED_CACHE_SIZE)
+        if len(_cache) == 0:
+            seed_cache(_cache)
+    return _cache
+
+# Swaps the embedding backend, for example to embeddings.HashEmbedder for offline runs.
+# The cache is keyed by model name so vectors from different backends never mix.
+def use_embedder(embedder):
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = EmbeddingCache(EMBED_CACHE, embedder, max_entries=EMBED_CACHE_SIZE)
+
+# Fills cache with the stored embedding of every stored answer. Compact stores don't hold the exact
+# embeddings, so nothing is copied from those.
+def seed_cache(cache):
+    store = get_store()
+    if store.lossy:
+        return
+    texts = []
+    vectors = []
+    for response in load_json(RESPONSES):
+        uid = response.get("uid")
+        if uid not in store:
+            continue
+        for i, key in enumerate(store.questions):
+            text = response.get(key[:-1])
+            if text:
+                texts.append(text)
+                vectors.append(store.row(uid)[i])
+    if texts:
+        cache.put_many(texts, vectors)
+
+# Returns the embedding for a response. If the same answer (ignoring case) was seen before, the cached
+# embedding is used instead of asking the API again.
 def has_embedding(users_response, question_number):
-    responses = load_json(RESPONSES)
-    embeds = load_json(EMBEDS)
-    low_input = users_response.lower()
-    for response in responses:
-        if response[question_number].lower() == low_input:
-            print("Cheaper route found: ")
-            cheaper_uid = response.get("uid")
-            for entry in embeds:
-                if entry["uid"] == cheaper_uid:
-                    return entry[question_number + "e"]
     return get_embedding(users_response)
 
-# Gets the next uid from uid_counter.txt (an external file that saves what count we are at)
-def get_next_uid():
+# Shared uid allocator. On first use it moves past every uid already in the responses, the embedding
+# store and the old uid_counter.txt that used to live in the working directory.
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        _allocator = UidAllocator(UID_COUNTER, floor=highest_uid)
+    return _allocator
+
+def highest_uid():
+    highest = max(get_store().uids, default=0)
+    for response in get_log(RESPONSES):
+        highest = max(highest, response.get("uid", 0))
     try:
-        # Open in append+read mode to create the file if it doesn’t exist
-        with open("uid_counter.txt", "a+") as file:
-            file.seek(0)  # Move cursor to the beginning of the file
-            content = file.read()
-
-            # If the file is empty, start at 0
-            uid = int(content) if content else 0
-    except ValueError:
-        # If content is invalid, reset to 0
-        uid = 0
-    # Write the incremented UID back to the file
-    with open("uid_counter.txt", "w") as file:
-        file.write(str(uid + 1))
-    return uid + 1
-
-
-# Main actual comparer. Grabs the two embeddings of the given questions and sends em through calculate simularity
+        with open("uid_counter.txt", "r") as file:
+            highest = max(highest, int(file.read().strip() or 0))
+    except (OSError, ValueError):
+        pass
+    return highest
+
+# Gets the next uid. Safe to call from several processes at once.
+def get_next_uid():
+    return get_allocator().next()
+
+
+# Main actual comparer. Similarity between the two embeddings uid1 and uid2 have for question q
+@profiling.timed()
 def compare(uid1, uid2, q):
-    responses = load_json("Data\embeds.json")
-    for response in responses:
-        if response.get("uid") == uid1:
-            r1e = np.array(response.get(q))
-        if response.get("uid") == uid2:
-            r2e = np.array(response.get(q))
-    return calculate_similarity(r1e, r2e) 
+    engine = get_engine()
+    return float(engine.pair(uid1, uid2)[engine.questions.index(q)])
+
+# Similarities for every question plus the overall average, all from one engine lookup
+@profiling.timed()
+def compare_scores(uid1, uid2):
+    sims = [float(sim) for sim in get_engine().pair(uid1, uid2)]
+    return sims + [sum(sims) / len(sims)]
+
+# Compares uid against every stored response at once. Returns {uid: [q1sim, q2sim, ..., qtsim]}
+@profiling.timed()
+def compare_to_everyone(uid):
+    engine = get_engine()
+    scores = engine.against(uid)
+    totals = scores.mean(axis=1)
+    return {other: scores[row].tolist() + [float(totals[row])] for row, other in enumerate(engine.uids)}
+
+# Nearest neighbour index over every stored answer to question q (like "q3e"), built on first use.
+# Small surveys get an exact index, large ones an approximate one. The vectors always come from the
+# similarity engine's decoded codes, a block of rows at a time, and every call adds the rows stored
+# since the last one the same way, so an index holds one representation and only its own copy of
+# the vectors. Only the last MAX_VECTOR_INDEXES questions used keep their index.
+def get_vector_index(q):
+    engine = get_engine()
+    column = engine.questions.index(q)
+    index = _vector_indexes.pop(q, None)
+    if index is None:
+        index = make_index(engine.store.dim or 0, len(engine.uids))
+        if isinstance(index, IVFIndex):
+            sample = np.random.default_rng(0).choice(len(engine.uids), min(index.sample_size, len(engine.uids)), replace=False)
+            index.train(engine.question(column, np.sort(sample)))
+    for start in range(len(index), len(engine.uids), INDEX_BLOCK):
+        end = min(start + INDEX_BLOCK, len(engine.uids))
+        index.add(engine.uids[start:end], engine.question(column, slice(start, end)))
+    if len(index):
+        _vector_indexes[q] = index
+    while len(_vector_indexes) > MAX_VECTOR_INDEXES:
+        del _vector_indexes[next(iter(_vector_indexes))]
+    return index
+
+# Finds the k responses most similar to a uid's answer or to a free text answer, for question q.
+# Leaving q out with a uid ranks everyone by their average similarity over all questions instead.
+# Returns a list of (uid, similarity), most similar first. The uid itself is never in the results.
+@profiling.timed()
+def find_similar(uid=None, text=None, q=None, k=10):
+    if text is not None:
+        if q is None:
+            raise ValueError("A question is needed to search with a free text answer")
+        uids, scores = get_vector_index(q).search(get_store().prepare(get_embedding(text)), k)
+    elif uid is None:
+        raise ValueError("Give either a uid or a text to search with")
+    elif q is None:
+        engine = get_engine()
+        totals = engine.against(uid).mean(axis=1)
+        totals[engine.rows[uid]] = -np.inf
+        best = top_k(totals, k)
+        best = best[np.isfinite(totals[best])]
+        uids = [engine.uids[row] for row in best]
+        scores = totals[best]
+    else:
+        uids, scores = get_vector_index(q).search(get_store().get(uid, q), k, exclude=uid)
+    return [(int(found), float(score)) for found, score in zip(uids, scores)]
+
+# Registered reference responses. Until a registry has been saved, ChatGPT's response (uid 1) is
+# registered as soon as it exists so there is always something to compare against.
+def get_references():
+    global _references
+    if _references is None:
+        _references = ReferenceScores(REFERENCE_DIR, get_store().questions)
+    if not os.path.exists(_references.registry_path) and CHATGPT_UID in get_store():
+        _references.add(CHATGPT_UID, "ChatGPT", get_engine())
+    return _references
+
+# Registers uid (already added with add_user/add_users) as a reference, for example another model or
+# the same model at another temperature. Only the new reference gets scored against everybody.
+def add_reference(uid, label):
+    get_references().add(uid, label, get_engine())
+
+def remove_reference(uid):
+    get_references().remove(uid)
+
+# Scores respondents added since the last call against every reference. Returns how many scores were computed.
+def update_references():
+    return get_references().update(get_engine())
+
+# Everybody against every reference. Returns (uids, labels, scores) where scores is shaped
+# (len(uids), len(labels), questions) and uids follows the embedding store order.
+def reference_scores():
+    references = get_references()
+    references.update(get_engine())
+    scores = references.scores()
+    return get_store().uids[:len(scores)], references.labels, scores
+
+# Per question and overall similarity of one uid to every reference, keyed by reference label
+def compare_to_references(uid):
+    engine = get_engine()
+    references = get_references()
+    rows = [engine.rows[ref] for ref in references.uids]
+    scores = np.einsum("qd,rqd->rq", engine.vectors(engine.rows[uid]), engine.vectors(rows))
+    return {label: row.tolist() + [float(row.mean())] for label, row in zip(references.labels, scores)}
 
 # Compares the responses from uid1 and uid2. If stored is true, it will store the responses under uid2.
 def compare_all(uid1, uid2, stored):
-    q1sim = compare(uid1, uid2, "q1e")
-    q2sim = compare(uid1, uid2, "q2e")
-    q3sim = compare(uid1, uid2, "q3e")
-    q4sim = compare(uid1, uid2, "q4e")
-    q5sim = compare(uid1, uid2, "q5e")
-    q6sim = compare(uid1, uid2, "q6e")
-    q7sim = compare(uid1, uid2, "q7e")
-    q8sim = compare(uid1, uid2, "q8e")
-    qtsim = (q1sim + q2sim + q3sim + q4sim + q5sim + q6sim + q7sim +q8sim)/8
+    sims = compare_scores(uid1, uid2)
     if stored == True:
-        compared = load_json(COMPARED)
-        new_compared = {
-            "uid": uid2,
-            "r1c": q1sim, 
-            "r2c": q2sim,
-            "r3c": q3sim,
-            "r4c": q4sim,
-            "r5c": q5sim,
-            "r6c": q6sim,
-            "r7c": q7sim,
-            "r8c": q8sim,
-            "rtc": qtsim
-        }
-        compared.append(new_compared)
-        save_json(compared, COMPARED)
+        new_compared = {"uid": uid2}
+        new_compared.update(zip(SCORE_KEYS, sims))
+        get_log(COMPARED).append(new_compared)
+        if USE_DATABASE:
+            get_database().set_compared([new_compared])
+        with _index_lock:
+            if _demo_index is not None:
+                _demo_index.set_scores(new_compared)
     else:
-        print(f"\nQuestion one has a similarity of {q1sim:.3f}")
-        print(f"\nQuestion two has a similarity of {q2sim:.3f}")
-        print(f"\nQuestion three has a similarity of {q3sim:.3f}")
-        print(f"\nQuestion four has a similarity of {q4sim:.3f}")
-        print(f"\nQuestion five has a similarity of {q5sim:.3f}")
-        print(f"\nQuestion six has a similarity of {q6sim:.3f}")
-        print(f"\nQuestion seven has a similarity of {q7sim:.3f}")
-        print(f"\nQuestion eight has a similarity of {q8sim:.3f}")
-        print(f"\nOverall similarity is given a score of {qtsim:.4f}")
+        for q, sim in enumerate(sims[:-1]):
+            print(f"\nQuestion {q + 1} has a similarity of {sim:.3f}")
+        print(f"\nOverall similarity is given a score of {sims[-1]:.4f}")
 
 def compare_every(uid1, uid2):
-    print(f"Comparing {uid1} and {uid2}, on q1 embeddings")
-    q1sim = compare(uid1, uid2, "q1e")
-    q2sim = compare(uid1, uid2, "q2e")
-    q3sim = compare(uid1, uid2, "q3e")
-    q4sim = compare(uid1, uid2, "q4e")
-    q5sim = compare(uid1, uid2, "q5e")
-    q6sim = compare(uid1, uid2, "q6e")
-    q7sim = compare(uid1, uid2, "q7e")
-    q8sim = compare(uid1, uid2, "q8e")
-    qtsim = (q1sim + q2sim + q3sim + q4sim + q5sim + q6sim + q7sim +q8sim)/8
-    return q1sim, q2sim, q3sim, q4sim, q5sim, q6sim, q7sim, q8sim, qtsim
+    log.info("Comparing %s and %s", uid1, uid2)
+    return tuple(compare_scores(uid1, uid2))
 
 # This is the core function that will take the users input and store it as a json while converting responses to embeddings
-# Once embeddings are collected
-def add_user(name, age, gender_identity, ethnicity, education, income, q1, q2, q3, q4, q5, q6, q7, q8):
-    responses = load_json(RESPONSES)
-    embeds = load_json(EMBEDS)
-
-    q1e = has_embedding(q1, "q1")
-    q2e = has_embedding(q2, "q2")
-    q3e = has_embedding(q3, "q3")
-    q4e = has_embedding(q4, "q4")
-    q5e = has_embedding(q5, "q5")
-    q6e = has_embedding(q6, "q6")
-    q7e = has_embedding(q7, "q7")
-    q8e = has_embedding(q8, "q8")
-
-    uid = get_next_uid()
-
-    new_user = {
-        "uid": uid,
-        "name": name,
-        "age": age,
-        "gender": gender_identity,
-        "ethnicity": ethnicity,
-        "education": education,
-        "income": income,
-        "q1": q1,
-        "q2": q2,
-        "q3": q3,
-        "q4": q4,
-        "q5": q5,
-        "q6": q6,
-        "q7": q7,
-        "q8": q8
-        }
-    responses.append(new_user)
-    save_json(responses, RESPONSES)
-    new_embedding = {
-        "uid": uid,
-        "q1e": q1e,
-        "q2e": q2e,
-        "q3e": q3e,
-        "q4e": q4e,
-        "q5e": q5e,
-        "q6e": q6e,
-        "q7e": q7e,
-        "q8e": q8e
-    }
-    embeds.append(new_embedding)
-    save_json(embeds, EMBEDS)
-    # Since we are adding a user, we will also calculate their similarity to ChatGPT
-    compare_all(1, uid, True)
+# Once embeddings are collected. fields go in survey.FIELDS order: name, the demographics, then one
+# answer per question (name, age, gender, ethnicity, education, income, q1 ... q8 for the built in survey).
+def add_user(*fields):
+    return add_users([fields])[0]
+
+# Adds a group of users, each given as a tuple in the same order as add_user's arguments or as a dict
+# keyed by survey.FIELDS. All of their answers go through one batcher, so the whole group costs a few
+# embedding requests instead of one per answer. Returns the new uids. With compare=False the similarity
+# scores are left for the caller to store later, which the bulk importer does once at the very end.
+# uids are the uids to store them under when they were reserved beforehand with get_allocator().reserve,
+# otherwise a new block is reserved.
+@profiling.timed()
+def add_users(users, compare=True, uids=None):
+    responses = [survey.as_response(user) for user in users]
+    batcher = EmbeddingBatcher(get_cache())
+    for i, response in enumerate(responses):
+        for field in survey.QUESTION_FIELDS:
+            batcher.add((i, field + "e"), response[field])
+    vectors = batcher.flush()
+
+    store = get_store()
+    new_users = []
+    uids = list(get_allocator().reserve(len(users)) if uids is None else uids)
+    if len(uids) != len(users):
+        raise ValueError(f"Got {len(uids)} uids for {len(users)} users")
+    for response, uid in zip(responses, uids):
+        new_user = {"uid": uid}
+        new_user.update(response)
+        new_users.append(new_user)
+    get_log(RESPONSES).extend(new_users)
+    with _index_lock:
+        if _demo_index is not None:
+            for new_user in new_users:
+                _demo_index.add(new_user)
+    block = np.array([[vectors[(i, key)] for key in store.questions] for i in range(len(users))], dtype=np.float32)
+    store.append_many(uids, block)
+    if USE_DATABASE:
+        database = get_database()
+        database.add_responses(new_users)
+        # The database holds the vectors as the store keeps them, the same thing sync copies in
+        database.add_embeddings(uids, np.stack([store.row(uid) for uid in uids]))
+    # Since we are adding users, we will also calculate their similarity to ChatGPT and every other reference
+    if compare:
+        store_comparisons(CHATGPT_UID, uids)
+        update_references()
+    return uids
+
+# Stores the similarity of every uid in uids to uid1 in the compared log, with one write for the whole group.
+# Only the rows from the first of uids on are scored. New users are always the last rows of the store,
+# so adding a few costs the same however many responses there already are.
+@profiling.timed()
+def store_comparisons(uid1, uids):
+    if not uids:
+        return
+    engine = get_engine()
+    rows = [engine.rows[uid] for uid in uids]
+    start = min(rows)
+    scores = engine.against_vectors(engine.vectors([engine.rows[uid1]]), start)[:, 0]
+    compared = []
+    for uid, row in zip(uids, rows):
+        sims = [float(sim) for sim in scores[row - start]]
+        new_compared = {"uid": uid}
+        new_compared.update(zip(SCORE_KEYS, sims + [sum(sims) / len(sims)]))
+        compared.append(new_compared)
+    get_log(COMPARED).extend(compared)
+    if USE_DATABASE:
+        get_database().set_compared(compared)
+    with _index_lock:
+        if _demo_index is not None:
+            for new_compared in compared:
+                _demo_index.set_scores(new_compared)
+
+# Rewrites the logs without records that were superseded later on (for example a uid compared twice)
+def compact_logs():
+    for filename in LOG_KEYS:
+        get_log(filename).compact()
+
+# uids that have embeddings but no stored comparison yet. References are never compared to ChatGPT.
+def uncompared_uids():
+    done = {r["uid"] for r in load_json(COMPARED, ["uid"])} | set(get_references().uids)
+    return [uid for uid in get_store().uids if uid not in done]
     
 
 def manual_ask():
-    n = input("What's your name? ").strip()
-    a = str(input("What is your age? "))
-    g = str(input("What is your gender identity? "))
-    eth = str(input("What is your ethnic background? "))
-    edu = str(input("What is the highest level of education you have completed? "))
-    inc = str(input("How much total gross income did all members of your household earn in this past fiscal year? "))
-    
-    question1 = input("What does the phrase: \"Actions speak louder than words\" mean? ").strip()
-    question2 = input("What makes someone a good leader? ")
-    question3 = input("What are some red flags that idicate someone is untrustworthy? ")
-    question4 = input("What does it mean to be successful? ")
-    question5 = input("What does it mean to be happy? ")
-    question6 = input("Imagine you lost something valuable to you. What would you do? ")
-    question7 = input("Complete the prompt: The electrician was... ")
-    question8 = input("Billy walked into his kitchen and saw a broken glass on the floor. What do you think happened? ")
-    add_user(n, a, g, eth, edu, inc, question1, question2, question3, question4, question5, question6, question7, question8)
-
-# Actual embedding grabber
+    fields = [input(f"{survey.NAME_PROMPT} ").strip()]
+    for demographic in survey.DEMOGRAPHICS:
+        fields.append(str(input(f"{demographic['prompt']} ")))
+    for question in survey.QUESTIONS:
+        fields.append(input(f"{question} ").strip())
+    add_user(*fields)
+
+# Actual embedding grabber. Goes through the cache so the API only sees text it hasn't embedded yet
+@profiling.timed()
 def get_embedding(text):
-    # Grabs text embed for the given phrases
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return response.data[0].embedding
+    return get_cache().get(text)
 
 # Main similarity function
 def calculate_similarity(text1, text2):
     # Finds cosine similarity between two texts
     # Compute cosine similarity
-    similarity = 1 - cosine(text1, text2)  # 1 - cosine distance
+    text1 = np.asarray(text1, dtype=np.float64)
+    text2 = np.asarray(text2, dtype=np.float64)
+    similarity = float(np.dot(text1, text2) / (np.linalg.norm(text1) * np.linalg.norm(text2)))
     return similarity
 
+# Chat backend used by ask_gpt and generate_answers, see generation.py
+def get_llm():
+    global _llm
+    if _llm is None:
+        _llm = OpenAIChat()
+    return _llm
+
+# Swaps the chat backend, for example to generation.FakeLLM or OpenAIChat(base_url=...) for a local server
+def use_llm(backend):
+    global _llm
+    _llm = backend
+
 # For custom questions, we need to be able to ask ChatGPT the new questions.
 # Adding token count as an input later on would be good. That way I could change the amount of sentences the user wants generated.
+@profiling.timed("api.chat", histogram=True)
 def ask_gpt(question):
-    client = OpenAI()
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {"role": "developer", "content": "You are a helpful assistant."},
-            {
-                "role": "user",
-                "content": question
-            }
-        ],
-        temperature=0,
-        max_tokens=100
-    )
-
-    return completion.choices[0].message.content
+    return get_llm().complete(question, model=CHAT_MODEL, temperature=0, max_tokens=100)
+
+# Answers every question with every config at once. A config is a dict with a "label" and optionally
+# "model", "temperature", "seed" and "max_tokens". Returns (answers, failed) where answers maps each
+# label to its list of answers in question order and failed lists the labels that didn't get all of them.
+@profiling.timed()
+def generate_answers(questions, configs, workers=8, progress=None):
+    jobs = {}
+    for config in configs:
+        options = {key: config[key] for key in ("model", "temperature", "seed", "max_tokens") if key in config}
+        jobs[config["label"]] = [make_job(question, **options) for question in questions]
+    generator = Generator(get_llm(), workers=workers, log=get_log(GENERATIONS))
+    done, failures = generator.run([job for label_jobs in jobs.values() for job in label_jobs], progress)
+    answers = {}
+    failed = []
+    for label, label_jobs in jobs.items():
+        keys = [job_key(job) for job in label_jobs]
+        if all(key in done for key in keys):
+            answers[label] = [done[key] for key in keys]
+        else:
+            failed.append(label)
+    for key, error in failures.items():
+        log.warning("Could not generate an answer with %s at temperature %s: %s", key[0], key[1], error)
+    return answers, failed
+
+# Generates every config's answers to the survey questions and stores each set as a new response
+# registered as a reference, the same way ChatGPT's answers are uid 1. Returns {label: uid}.
+def generate_references(configs, workers=8, progress=None):
+    answers, failed = generate_answers(survey.QUESTIONS, configs, workers, progress)
+    labels = [config["label"] for config in configs if config["label"] in answers]
+    if not labels:
+        return {}
+    uids = add_users([dict(zip(survey.QUESTION_FIELDS, answers[label]), name=label) for label in labels], compare=False)
+    for label, uid in zip(labels, uids):
+        add_reference(uid, label)
+    return dict(zip(labels, uids))
 
 # For asking ChatGPT questions not listed in the survey and comparing the response to the question poser's response
 # When adding token count as an input to ask_gpt() method, also add it as an input here.
 def bonus_questions(question, human_response):
     chatgpt_response = str(ask_gpt(question))
-    chatgpt_embedding = get_embedding(chatgpt_response)
-    human_embedding = get_embedding(human_response)
+    # Both texts go out in a single embeddings request
+    batcher = EmbeddingBatcher(get_cache())
+    batcher.add("chatgpt", chatgpt_response)
+    batcher.add("human", human_response)
+    vectors = batcher.flush()
+    chatgpt_embedding = vectors["chatgpt"]
+    human_embedding = vectors["human"]
     similarity = calculate_similarity(chatgpt_embedding, human_embedding)
 
-    custom = load_json(CUSTOMQS)
     new_custom = {
         "Question": question,
         "Human Response": human_response,
         "ChatGPT Response": chatgpt_response,
         "Similarity": similarity
     }
-    custom.append(new_custom)
-    save_json(custom, CUSTOMQS)
+    get_log(CUSTOMQS).append(new_custom)
+    if USE_DATABASE:
+        get_database().add_custom(new_custom)
     return chatgpt_response, similarity
 
 
 
+# Demographic index over every response and its compared scores, built in one pass the first time
+# it is needed and kept up to date as users are added
+def get_demo_index():
+    global _demo_index
+    with _index_lock:
+        if _demo_index is None:
+            with profiling.timer("analysis.build_demo_index"):
+                _demo_index = DemoIndex.build(get_log(RESPONSES), get_log(COMPARED), LOWBAR)
+        return _demo_index
+
+# Groups uids by demographic. demos[d][b] is the list of uids in bucket b of demographic d.
+# Demographics follow survey.DEMOGRAPHICS and buckets survey.bucket_labels. For the built in survey:
+# First dimension is either 0 - age, 1 - gender, 2 - ethnicity, 3 - education, 4 - income
+# Age 0: 18-24, 1: 25-34, 2: 35-44, 3: 45-54, 4: 55-64, 5: 65+, 6: unlisted
+# Gender 0: Male, 1: Female, 2: Non-binary, 3: Prefer not to say/Other, 4: unlisted
+# Ethnicity 0: White/Caucasian, 1: Asian - Eastern, 2: Asian - Indian, 3: Hispanic, 4: Black, 5: Native American, 6: Prefer not to answer, 7: unlisted
+# Education 0: Highschool Diploma, 1: Bachelor's Degree, 2: Master's Degree, 3: Prefer not to answer, 4: Lower than highschool level education, 5: unlisted
+# Income 0: $0 - $4,999, 1: $5,000 - $7,499, 2: $7,500 - $9,999, 3: $10,000 - $12,499, 4: $12,500 - $14,999, 5: $15,000 - $19,999
+# 6: $20,000 - $24,999, 7: $25,000 - $29,999, 8: $30,000 - $34,999, 9: $35,000 - $39,999, 10: $40,000 - $49,999, 11: $50,000 - $59,999 
+# 12: $60,000 - $74,999, 13: $75,000 - $99,999, 14: $100,000 - $149,999, 15: $150,000+, 16: Prefer not to answer, 17: unlisted
 def create_graph_data():
-    responses = load_json(RESPONSES)
-    demos = [[[],[],[],[],[],[],[]],[[],[],[],[],[]],[[],[],[],[],[],[],[],[]],[[],[],[],[],[],[]],[[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]]]
-    # Three dimensions
-    # First dimension is either 0 - age, 1 - gender, 2 - ethnicity, 3 - education, 4 - income
-    for r in responses:
-        # Age 0: 18-24, 1: 25-34, 2: 35-44, 3: 45-54, 4: 55-64, 5: 65+, 6: unlisted
-        try:
-            int_age = int(r["age"])
-            if 18 <= int_age <= 24:
-                demos[0][0].append(r["uid"])
-            elif 25 <= int_age <= 34:
-                demos[0][1].append(r["uid"])
-            elif 35 <= int_age <= 44:
-                demos[0][2].append(r["uid"])
-            elif 45 <= int_age <= 54:
-                demos[0][3].append(r["uid"])
-            elif 55 <= int_age <= 64:
-                demos[0][4].append(r["uid"])
-            elif int_age >= 65:
-                demos[0][5].append(r["uid"])
-            else:
-                demos[0][6].append(r["uid"])
-                print(f"\nCorrect value type. Not in range of responses: {r['uid']}, age: {r['age']}")
-            print(f"Age as int is: {int_age}")
-        except (ValueError, TypeError):
-            demos[0][6].append(r["uid"])
-            print(f"\nUnlisted: {r['uid']}, age: {r['age']}")
-        
-        
-        # Gender 0: Male, 1: Female, 2: Non-binary, 3: Prefer not to say/Other, 4: unlisted
-        try:
-            if r["gender"] == "Male":
-                demos[1][0].append(r["uid"])
-            elif r["gender"] == "Female":
-                demos[1][1].append(r["uid"])
-            elif r["gender"] == "Non-binary":
-                demos[1][2].append(r["uid"])
-            elif r["gender"] == "Prefer not to say/Other":
-                demos[1][3].append(r["uid"])
-            else:
-                demos[1][4].append(r["uid"])
-                print(f"\nCorrect value type. Not in range of responses: {r['uid']}, gender: {r['gender']}")
-        except (ValueError, TypeError):
-            demos[1][4].append(r["uid"])
-            print(f"\nUnlisted: {r['uid']}, gender: {r['gender']}")
-                
-        # Ethnicity 0: White/Caucasian, 1: Asian - Eastern, 2: Asian - Indian, 3: Hispanic, 4: Black, 5: Native American, 6: Prefer not to answer, 7: unlisted
-        try:
-            if r["ethnicity"] == "White/Caucasian":
-                demos[2][0].append(r["uid"])
-            elif r["ethnicity"] == "Asian - Eastern":
-                demos[2][1].append(r["uid"])
-            elif r["ethnicity"] == "Asian - Indian":
-                demos[2][2].append(r["uid"])
-            elif r["ethnicity"] == "Hispanic":
-                demos[2][3].append(r["uid"])
-            elif r["ethnicity"] == "Black":
-                demos[2][4].append(r["uid"])
-            elif r["ethnicity"] == "Native American":
-                demos[2][5].append(r["uid"])
-            elif r["ethnicity"] == "Prefer not to answer":
-                demos[2][6].append(r["uid"])
-            else:
-                demos[2][7].append(r["uid"])
-                print(f"\nCorrect value type. Not in range of responses: {r['uid']}, ethnicity: {r['ethnicity']}")
-        except (ValueError, TypeError):
-            demos[2][7].append(r["uid"])
-            print(f"\nUnlisted: {r['uid']}, ethnicity: {r['ethnicity']}")
-        # Education 0: Highschool Diploma, 1: Bachelor's Degree, 2: Master's Degree, 3: Prefer not to answer, 4: Lower than highschool level education, 5: unlisted
-        try:
-            if r["education"] == "Highschool Diploma":
-                demos[3][0].append(r["uid"])
-            elif r["education"] == "Bachelor's Degree":
-                demos[3][1].append(r["uid"])
-            elif r["education"] == "Master's Degree":
-                demos[3][2].append(r["uid"])
-            elif r["education"] == "Prefer not to answer":
-                demos[3][3].append(r["uid"])
-            elif r["education"] == "Lower than highschool level education":
-                demos[3][4].append(r["uid"])
-            else:
-                demos[3][5].append(r["uid"])
-                print(f"\nCorrect value type. Not in range of responses: {r['uid']}, income: {r['education']}")
-        except (ValueError, TypeError):
-            demos[3][5].append(r["uid"])
-            print(f"\nUnlisted: {r['uid']}, education: {r['education']}")
-        # Income 0: $0 - $4,999, 1: $5,000 - $7,499, 2: $7,500 - $9,999, 3: $10,000 - $12,499, 4: $12,500 - $14,999, 5: $15,000 - $19,999
-        # 6: $20,000 - $24,999, 7: $25,000 - $29,999, 8: $30,000 - $34,999, 9: $35,000 - $39,999, 10: $40,000 - $49,999, 11: $50,000 - $59,999 
-        # 12: $60,000 - $74,999, 13: $75,000 - $99,999, 14: $100,000 - $149,999, 15: $150,000+, 16: Prefer not to answer, 17: unlisted
-        try:
-            if r["income"] == "$0 - $4,999":
-                demos[4][0].append(r["uid"])
-            elif r["income"] == "$5,000 - $7,499":
-                demos[4][1].append(r["uid"])
-            elif r["income"] == "$7,500 - $9,999":
-                demos[4][2].append(r["uid"])
-            elif r["income"] == "$10,000 - $12,499":
-                demos[4][3].append(r["uid"])
-            elif r["income"] == "$12,500 - $14,999":
-                demos[4][4].append(r["uid"])
-            elif r["income"] == "$15,000 - $19,999":
-                demos[4][5].append(r["uid"])
-            elif r["income"] == "$20,000 - $24,999":
-                demos[4][6].append(r["uid"])
-            elif r["income"] == "$25,000 - $29,999":
-                demos[4][7].append(r["uid"])
-            elif r["income"] == "$30,000 - $34,999":
-                demos[4][8].append(r["uid"])
-            elif r["income"] == "$35,000 - $39,999":
-                demos[4][9].append(r["uid"])
-            elif r["income"] == "$40,000 - $49,999":
-                demos[4][10].append(r["uid"])
-            elif r["income"] == "$50,000 - $59,999":
-                demos[4][11].append(r["uid"])
-            elif r["income"] == "$60,000 - $74,999":
-                demos[4][12].append(r["uid"])
-            elif r["income"] == "$75,000 - $99,999":
-                demos[4][13].append(r["uid"])
-            elif r["income"] == "$100,000 - $149,999":
-                demos[4][14].append(r["uid"])
-            elif r["income"] == "$150,000+":
-                demos[4][15].append(r["uid"])
-            elif r["income"] == "Prefer not to answer":
-                demos[4][16].append(r["uid"])
-            else:
-                demos[4][17].append(r["uid"])
-                print(f"\nCorrect value type. Not in range of responses: {r['uid']}, income: {r['income']}")
-        except (ValueError, TypeError):
-            demos[4][17].append(r["uid"])
-            print(f"\nUnlisted: {r['uid']}, income: {r['income']}")
-    return demos
+    return get_demo_index().uid_lists()
+
+# Average rc for every demographic bucket at once, indexed the same way as create_graph_data.
+# means[d][b] is the average for bucket b of demographic d, 0 for empty buckets.
+# This reads the running aggregates, so it costs the same however many responses there are.
+def demographic_means(rc):
+    with _index_lock:
+        means, _ = get_demo_index().group_means(LOWBAR)
+    return means[:, :, SCORE_KEYS.index(rc)]
+
+# Changes whenever anything demographic_means depends on changes, so charts can skip redrawing
+def data_version():
+    with _index_lock:
+        return (get_demo_index().version, LOWBAR)
+
+# Every average and count for every question at once, straight from the running aggregates.
+# Returns a dict with "scores" (the score columns, SCORE_KEYS), "means" and "counts". Both are shaped
+# (score columns, demographics, buckets), so means[k] has the layout of demographic_means(scores[k]).
+@profiling.timed()
+def question_breakdown():
+    with _index_lock:
+        aggregates = demographic_aggregates()
+        return {
+            "scores": list(SCORE_KEYS),
+            "means": aggregates.means().transpose(2, 0, 1),
+            "counts": aggregates.counts.transpose(2, 0, 1).copy()
+        }
+
+# Running totals behind demographic_means, with counts and variances as well
+def demographic_aggregates():
+    with _index_lock:
+        index = get_demo_index()
+        if index.aggregates.lowbar != LOWBAR:
+            index.rebuild(LOWBAR)
+        return index.aggregates
+
+# Copies of the index arrays, so the slow statistics below don't hold the lock while they run
+def _index_arrays(rc):
+    with _index_lock:
+        index = get_demo_index()
+        count = len(index)
+        return index.codes[:count].copy(), index.scores[:count, [SCORE_KEYS.index(rc)]].copy(), data_version()
+
+# Bootstrap confidence interval of every average from demographic_means. Returns a dict with "low",
+# "high" and "stderr", each indexed [d][b] like demographic_means and NaN for buckets with fewer
+# than two scores. Results are kept until the data changes.
+@profiling.timed()
+def demographic_intervals(rc="rtc", resamples=stats.RESAMPLES):
+    codes, scores, version = _index_arrays(rc)
+    key = (version, rc, resamples)
+    if key not in _intervals:
+        if len(_intervals) > 16:
+            _intervals.clear()
+        intervals = stats.bootstrap_intervals(codes, scores, LOWBAR, resamples)
+        _intervals[key] = {name: values[:, :, 0] for name, values in intervals.items()}
+    return _intervals[key]
+
+# Permutation test between two buckets of one demographic, for example
+# compare_groups("age", 0, 5) for 18-24 against 65+. Returns (difference in means, p value).
+def compare_groups(demographic, bucket_a, bucket_b, rc="rtc", resamples=stats.RESAMPLES):
+    codes, scores, _ = _index_arrays(rc)
+    groups = stats.bucket_values(codes[:, DEMOGRAPHICS.index(demographic)], scores[:, 0], LOWBAR)
+    return stats.permutation_test(groups[bucket_a], groups[bucket_b], resamples)
+
+# ANOVA and Kruskal-Wallis across the buckets of each demographic. Returns a dict of arrays with one
+# value per demographic, in DEMOGRAPHICS order.
+def demographic_tests(rc="rtc"):
+    codes, scores, _ = _index_arrays(rc)
+    return {name: values[:, 0] for name, values in stats.group_tests(codes, scores, LOWBAR).items()}
+
+# Boolean mask index over the demographic index, for filters and cross-tabs (see cohorts.py).
+# Rebuilt from the index arrays whenever the data has changed since the last call.
+def get_cohorts():
+    global _cohorts
+    with _index_lock:
+        version = data_version()
+        if _cohorts is None or _cohorts[0] != version:
+            _cohorts = (version, CohortIndex.from_index(get_demo_index(), LOWBAR))
+        return _cohorts[1]
+
+# Count and average rc of everybody matching filters, for example
+# cohort_summary({"gender": "Female", "age": "25-34", "education": "Bachelor's Degree"}, "r5c").
+# Returns (respondents, respondents with a score, mean).
+@profiling.timed()
+def cohort_summary(filters, rc="rtc"):
+    return get_cohorts().summary(filters, rc)
+
+# Average rc for every combination of two demographics, for example crosstab("gender", "education").
+# filters narrows it down first. See CohortIndex.crosstab for what comes back.
+@profiling.timed()
+def crosstab(rows, columns, rc="rtc", filters=None):
+    return get_cohorts().crosstab(rows, columns, rc, filters)
 
 def get_names_with_uids():
-    responses = load_json(RESPONSES)
+    responses = load_json(RESPONSES, ["uid", "name"])
     name_uid_pairs = []
     for r in responses:
         try:
@@ -392,27 +652,20 @@ def get_names_with_uids():
             name = str(r["name"])
             name_uid_pairs.append((uid, name))
         except (KeyError, ValueError, TypeError):
-            print(f"Error reading entry: {r}")
+            log.warning("Error reading entry: %s", r)
     return name_uid_pairs
 
 
 # Take the average rc (response compared) value of demos uid grouping
-# uids will be a passed in value like demos[4][16]
+# uids will be a passed in value like demos[4][16], or filters like {"gender": "Female", "age": "25-34"}
 # rc will be response compared choice. Input like "rtc" or "r1c"
+@profiling.timed()
 def average_dem(uids, rc):
-    compared = load_json(COMPARED)
-    rcs = []
     if uids == "":
         return 0
-    for r in compared:
-        if r["uid"] in uids:
-            if r[rc] > LOWBAR:
-                rcs.append(r[rc])
-    try:
-        avg = sum(rcs)/len(rcs)
-    except (ZeroDivisionError):
-        return 0
-    return avg
+    if isinstance(uids, dict):
+        return cohort_summary(uids, rc)[2]
+    return get_demo_index().mean_of(uids, rc, LOWBAR)
 
 def main():
     while True:
@@ -440,4 +693,5 @@ def main():
             print("\nInvalid choice. Try again.")
 
 if __name__ == "__main__":
+    profiling.setup()
     main()
\ No newline at end of file
@@ -0,0 +1,105 @@
+# Runs slow work (embeddings, GPT calls, comparisons) off the Tk main loop.
+# Tasks run one at a time on a worker thread, in the order they were submitted, so the data files
+# are never written by two tasks at once. Tk widgets must only be touched from the main thread, so
+# the worker puts finished tasks on a queue and the main loop picks them up with after() and runs
+# the callbacks there.
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# About one frame at 60 fps
+POLL_MS = 16
+
+
+class Task:
+    def __init__(self, label, on_done, on_error):
+        self.label = label
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+        self.future = None
+
+    # A queued task is dropped. A task that is already running finishes, but its callbacks never run.
+    def cancel(self):
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class TaskRunner:
+    # on_change(running_label, queued) is called on the main thread whenever the queue changes,
+    # running_label is None when nothing is running
+    def __init__(self, root, on_change=None, workers=1):
+        self.root = root
+        self.on_change = on_change
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._finished = queue.Queue()
+        self._tasks = []
+        self._running = None
+        self._polling = False
+
+    def submit(self, label, func, *args, on_done=None, on_error=None):
+        task = Task(label, on_done, on_error)
+        task.future = self._executor.submit(self._run, task, func, args)
+        self._tasks.append(task)
+        self._changed()
+        if not self._polling:
+            self._polling = True
+            self.root.after(POLL_MS, self._poll)
+        return task
+
+    # Runs on the worker thread
+    def _run(self, task, func, args):
+        if task.cancelled.is_set():
+            self._finished.put((task, None, None))
+            return
+        self._running = task
+        try:
+            self._finished.put((task, func(*args), None))
+        except Exception as error:
+            self._finished.put((task, None, error))
+        finally:
+            self._running = None
+
+    # Runs on the main thread
+    def _poll(self):
+        while True:
+            try:
+                task, result, error = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            self._tasks.remove(task)
+            if not task.cancelled.is_set():
+                if error is not None:
+                    if task.on_error:
+                        task.on_error(error)
+                elif task.on_done:
+                    task.on_done(result)
+        # Cancelled tasks that never started don't come through the queue
+        self._tasks = [task for task in self._tasks if not task.future.cancelled()]
+        self._changed()
+        if self._tasks:
+            self.root.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    def _changed(self):
+        if self.on_change:
+            running = self._running
+            queued = sum(1 for task in self._tasks if task is not running)
+            self.on_change(running.label if running is not None else None, queued)
+
+    def busy(self):
+        return bool(self._tasks)
+
+    # Drops everything waiting in the queue. The task that is running is cancelled too if running is True.
+    def cancel_all(self, running=False):
+        for task in self._tasks:
+            if running or task is not self._running:
+                task.cancel()
+        self._changed()
+
+    def shutdown(self):
+        self.cancel_all(running=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,73 @@
+# Recall and latency of exact vs approximate nearest neighbour search (vector_index.py).
+# Synthetic answers are drawn around a few hundred topics so they cluster the way real survey
+# answers to one question do. Every query is a held back answer, exact search gives the true
+# neighbours and the IVF index is scored on how many of them it finds (recall@k).
+#
+# Usage: python benchmarks/bench_ann.py [--count 100000] [--dim 1536] [--queries 200] [--k 10]
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_index import ExactIndex, IVFIndex
+
+
+# count unit vectors spread around topics random centres
+def clustered_vectors(count, dim, topics, spread=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 10000):
+        end = min(start + 10000, count)
+        noise = rng.standard_normal((end - start, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        vectors[start:end] = centres[rng.integers(0, topics, end - start)] + noise
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def timed_queries(index, queries, k, **options):
+    found = []
+    took = []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = index.search(query, k, **options)
+        took.append(time.perf_counter() - start)
+        found.append(ids)
+    return found, np.array(took) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exact and approximate nearest neighbour search")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--topics", type=int, default=500)
+    args = parser.parse_args()
+
+    vectors = clustered_vectors(args.count + args.queries, args.dim, args.topics)
+    data, queries = vectors[:args.count], vectors[args.count:]
+    ids = np.arange(args.count)
+
+    start = time.perf_counter()
+    exact = ExactIndex(args.dim)
+    exact.add(ids, data)
+    print(f"exact index built in {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    ivf = IVFIndex(args.dim, nlist=int(np.sqrt(args.count)))
+    ivf.train(data)
+    ivf.add(ids, data)
+    print(f"IVF index built in {time.perf_counter() - start:.2f} s ({ivf.nlist} clusters)")
+
+    truth, exact_ms = timed_queries(exact, queries, args.k)
+    print(f"exact      p50 {np.percentile(exact_ms, 50):7.2f} ms  p95 {np.percentile(exact_ms, 95):7.2f} ms  recall 1.000")
+    for nprobe in (4, 8, 16, 32):
+        found, ivf_ms = timed_queries(ivf, queries, args.k, nprobe=nprobe)
+        recall = np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(truth, found)])
+        print(f"IVF np={nprobe:<3} p50 {np.percentile(ivf_ms, 50):7.2f} ms  p95 {np.percentile(ivf_ms, 95):7.2f} ms  recall {recall:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Startup benchmark for the Tk app.
+# Every run starts a fresh Python process, imports main_app and (when there is a display) builds the
+# window and waits until the main menu has been drawn. It also checks that none of the slow
+# packages get imported on the way, and lists the slowest imports from python -X importtime.
+#
+# Usage: python benchmarks/bench_startup.py [--runs 5] [--limit 1.0] [--json startup.json]
+# Exits with 1 when the median time to the main menu is over the limit.
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages that should only be imported once something actually needs them.
+# numpy is left out on purpose: the embedding store, similarity engine, demographic index and every
+# other module analysis is built on work on numpy arrays, so it stays a plain import there. It is most
+# of what import main_app costs (about 130 of 150 ms) and that is still well under the limit.
+DEFERRED = ["openai", "scipy", "matplotlib"]
+
+CHILD = """
+import sys, time, json
+import tkinter as tk
+start = time.perf_counter()
+import main_app
+imported = time.perf_counter() - start
+menu = None
+# Without a display Tk can't make a window, only the import gets timed then. Anything else is a real
+# crash and fails the run.
+try:
+    app = main_app.App()
+except tk.TclError:
+    app = None
+if app is not None:
+    app.update()
+    menu = time.perf_counter() - start
+    app.close()
+print(json.dumps({"import": imported, "menu": menu, "loaded": [name for name in %r if name in sys.modules]}))
+""" % (DEFERRED,)
+
+
+def run_once():
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+# The slowest imports by cumulative time, in milliseconds
+def slowest_imports(count=10):
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main_app"], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative) / 1000, name.strip()))
+    return sorted(times, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how long the app takes to start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--limit", type=float, default=1.0, help="seconds allowed until the main menu is up")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    imports = [run["import"] for run in runs]
+    menus = [run["menu"] for run in runs if run["menu"] is not None]
+    results = {
+        "runs": args.runs,
+        "import_median": statistics.median(imports),
+        "menu_median": statistics.median(menus) if menus else None,
+        "deferred_but_loaded": sorted({name for run in runs for name in run["loaded"]}),
+        "slowest_imports_ms": slowest_imports()
+    }
+
+    print(f"import main_app: {results['import_median'] * 1000:.0f} ms (median of {args.runs})")
+    if results["menu_median"] is None:
+        print("main menu: not measured, no display available")
+    else:
+        print(f"main menu on screen: {results['menu_median'] * 1000:.0f} ms")
+    if results["deferred_but_loaded"]:
+        print(f"imported at startup but should be deferred: {', '.join(results['deferred_but_loaded'])}")
+    print("slowest imports:")
+    for took, name in results["slowest_imports_ms"]:
+        print(f"  {took:8.1f} ms  {name}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+    measured = results["menu_median"] if results["menu_median"] is not None else results["import_median"]
+    if measured > args.limit or results["deferred_but_loaded"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# End to end benchmark of the analysis pipeline on synthetic surveys, fully offline.
+# Respondents get demographics drawn from the options on the survey form (survey.py) and unique
+# answers, and the embedding backend hands out random unit vectors, so nothing talks to the API.
+# For every survey size a fresh process fills its own temporary data folder and times:
+#  - ingest: bulk add_users per respondent, and single add_user calls once the survey is full
+#  - compare_all and compare_every between ChatGPT (uid 1) and sampled respondents
+#  - create_graph_data (cold, which builds the demographic index, and warm) and average_dem over every group
+#  - chart data preparation: question_breakdown and the values of every chart for every question
+# Results can be saved as a baseline and later runs checked against it. A timing more than
+# --tolerance slower than the baseline counts as a regression and makes the run exit with 1.
+# Timings in FLAT should cost the same at every size. When more than one size is run, one that gets
+# more than --growth times slower from the smallest to the largest survey fails the run as well.
+#
+# Usage: python benchmarks/bench_suite.py [--sizes 1000 10000 100000] [--dim 1536]
+#                                         [--baseline benchmarks/baseline.json] [--save] [--tolerance 0.25]
+#                                         [--growth 2.0]
+# A 100000 respondent run needs about 10 GB of disk for the embedding store and cache.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+SIZES = [1000, 10000]
+DIM = 1536
+# Respondents added with bulk add_users per call, and how many single calls, comparisons and so on are timed
+CHUNK = 1000
+SAMPLES = 50
+# Share of respondents that leave a demographic blank, like on the form
+BLANK = 0.05
+# Timings that shouldn't grow with the number of respondents already stored
+FLAT = ["add_user"]
+
+
+# Stub embedding backend. Every text gets a fresh random unit vector, so a survey of unique answers
+# costs no more than generating the numbers.
+class RandomEmbedder:
+    def __init__(self, dim=DIM, seed=0, model="random-embedder"):
+        self.dim = dim
+        self.model = model
+        self.rng = np.random.default_rng(seed)
+
+    def embed(self, texts):
+        vectors = self.rng.standard_normal((len(texts), self.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return list(vectors)
+
+
+# One synthetic response in survey.FIELDS order. Choices come from the form's options and range
+# demographics get a whole number somewhere in their ranges, now and then left blank.
+def synthetic_user(index, rng):
+    import survey
+    fields = [f"Respondent {index}"]
+    for demographic in survey.DEMOGRAPHICS:
+        if rng.random() < BLANK:
+            fields.append("")
+        elif demographic["type"] == "range":
+            low, high = demographic["ranges"][rng.integers(len(demographic["ranges"]))]
+            fields.append(str(rng.integers(low, (high if high is not None else low + 20) + 1)))
+        else:
+            fields.append(demographic["options"][rng.integers(len(demographic["options"]))])
+    fields += [f"Answer {index} to question {q + 1}, variant {rng.integers(1000)}" for q in range(len(survey.QUESTIONS))]
+    return fields
+
+# Median time of calling function on every item of items, in seconds
+def median_time(function, items):
+    took = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        took.append(time.perf_counter() - start)
+    return statistics.median(took)
+
+
+# Runs in a fresh process with ANALYSIS_DATA pointing at an empty folder. Returns {name: seconds}.
+def run_size(count, dim, seed=0):
+    import analysis
+    import survey
+    import charts
+    import generation
+    analysis.use_embedder(RandomEmbedder(dim, seed))
+    analysis.use_llm(generation.FakeLLM())
+    rng = np.random.default_rng(seed)
+    singles = min(SAMPLES, count // 10)
+    users = [synthetic_user(i, rng) for i in range(count)]
+    results = {}
+
+    chatgpt = ["ChatGPT"] + [""] * len(survey.DEMOGRAPHICS) + [f"ChatGPT answer to question {q + 1}" for q in range(len(survey.QUESTIONS))]
+    analysis.add_users([chatgpt], compare=False)
+    start = time.perf_counter()
+    for i in range(0, count - singles, CHUNK):
+        analysis.add_users(users[i:min(i + CHUNK, count - singles)])
+    results["ingest_bulk_per_respondent"] = (time.perf_counter() - start) / max(1, count - singles)
+    results["add_user"] = median_time(lambda user: analysis.add_user(*user), users[count - singles:])
+
+    uids = [int(uid) for uid in rng.choice(analysis.get_store().uids[1:], SAMPLES, replace=False)]
+    results["compare_all"] = median_time(lambda uid: analysis.compare_all(analysis.CHATGPT_UID, uid, True), uids)
+    results["compare_every"] = median_time(lambda uid: analysis.compare_every(analysis.CHATGPT_UID, uid), uids)
+
+    # Cold means the demographic index has to be built from the logs first
+    analysis._demo_index = None
+    start = time.perf_counter()
+    demos = analysis.create_graph_data()
+    results["create_graph_data_cold"] = time.perf_counter() - start
+    start = time.perf_counter()
+    demos = analysis.create_graph_data()
+    results["create_graph_data_warm"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for groups in demos:
+        for uids_in_group in groups:
+            analysis.average_dem(uids_in_group, "rtc")
+    results["average_dem_every_group"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    breakdown = analysis.question_breakdown()
+    for k in range(len(breakdown["scores"])):
+        for chart in charts.CHARTS:
+            charts.chart_values(chart, breakdown["means"][k])
+    results["chart_data"] = time.perf_counter() - start
+    return results
+
+def run_child(count, dim):
+    with tempfile.TemporaryDirectory() as folder:
+        env = dict(os.environ, ANALYSIS_DATA=folder, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "offline"))
+        env.pop("ANALYSIS_PROFILE", None)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(count), "--dim", str(dim)],
+                                cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# Timings in results more than tolerance slower than in baseline, as (size, name, baseline, now)
+def regressions(results, baseline, tolerance):
+    slower = []
+    for size, timings in results.items():
+        for name, took in timings.items():
+            before = baseline.get(size, {}).get(name)
+            if before is not None and took > before * (1 + tolerance):
+                slower.append((size, name, before, took))
+    return slower
+
+# Timings in FLAT more than growth times slower at the largest size than at the smallest, as
+# (name, smallest size, largest size, time then, time now)
+def growing(results, growth):
+    sizes = sorted(results, key=int)
+    if len(sizes) < 2:
+        return []
+    smallest, largest = sizes[0], sizes[-1]
+    grown = []
+    for name in FLAT:
+        before = results[smallest].get(name)
+        after = results[largest].get(name)
+        if before is not None and after is not None and after > before * growth:
+            grown.append((name, smallest, largest, before, after))
+    return grown
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the analysis pipeline on synthetic surveys, offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="respondents per synthetic survey")
+    parser.add_argument("--dim", type=int, default=DIM, help="embedding dimensions")
+    parser.add_argument("--baseline", default=None, help="JSON file with earlier results to check against")
+    parser.add_argument("--save", action="store_true", help="write these results to --baseline instead of checking")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="how much slower than the baseline is still fine")
+    parser.add_argument("--growth", type=float, default=2.0,
+                        help="how many times slower the timings in FLAT may get from the smallest to the largest size")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, args.dim)))
+        return
+
+    results = {}
+    for count in args.sizes:
+        start = time.perf_counter()
+        results[str(count)] = run_child(count, args.dim)
+        print(f"{count} respondents ({time.perf_counter() - start:.0f} s in total)")
+        for name, took in results[str(count)].items():
+            print(f"  {name:<28}{took * 1000:>12.3f} ms")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+    grown = growing(results, args.growth)
+    for name, smallest, largest, before, after in grown:
+        print(f"GROWS WITH SIZE {name}: {before * 1000:.3f} ms at {smallest} respondents -> "
+              f"{after * 1000:.3f} ms at {largest}")
+    if args.baseline is None:
+        if grown:
+            sys.exit(1)
+        return
+    if args.save or not os.path.exists(args.baseline):
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=4)
+        print(f"Saved as the baseline in {args.baseline}")
+        if grown:
+            sys.exit(1)
+        return
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    slower = regressions(results, baseline, args.tolerance)
+    for size, name, before, took in slower:
+        print(f"REGRESSION {size} respondents, {name}: {before * 1000:.3f} ms -> {took * 1000:.3f} ms")
+    if slower or grown:
+        sys.exit(1)
+    print(f"No timing more than {args.tolerance:.0%} slower than {args.baseline}")
+
+if __name__ == "__main__":
+    main()
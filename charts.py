@@ -0,0 +1,163 @@
+# The demographic bar charts. Each chart is described once here and drawn the same way by the Tk
+# page and anything else that wants them.
+# There is one chart per demographic in survey.py. "demographic" and "buckets" index into
+# analysis.demographic_means, the same layout as create_graph_data.
+
+import survey
+
+LENGTH, WIDTH, DPI = 8, 6, 100
+HEATMAP_SIZE = (LENGTH * 2, WIDTH * 3)
+
+# How the demographics of the built in survey are drawn. With a survey from ANALYSIS_SURVEY every
+# chart shows every bucket except the unlisted one, with labels and titles made up from the survey.
+STYLES = {
+    "age": {
+        "buckets": [0, 1, 2, 3, 4, 5],
+        "labels": ['18-24', '25-34', '35-44', '45-54', '55-64', '65+'],
+        "title": "Response similarity to ChatGPT responses across age groups",
+        "xlabel": "Age ranges",
+        "ylabel": "Average similarity score across all questions",
+        "size": (LENGTH, WIDTH),
+        "rotation": 0
+    },
+    "gender": {
+        "buckets": [0, 1, 2],
+        "labels": ['Male', 'Female', 'Non-Binary'],
+        "title": "Response similarity to ChatGPT responses across gender groups",
+        "xlabel": "Genders ranges",
+        "ylabel": "Average similarity score across all responses within given gender groups",
+        "size": (LENGTH, WIDTH),
+        "rotation": 0
+    },
+    "ethnicity": {
+        "buckets": [0, 1, 2, 3, 4, 5],
+        "labels": ['White/Caucasian', 'Asian - Eastern', 'Asian - Indian', 'Hispanic', 'Black', 'Native American'],
+        "title": "Response similarity to ChatGPT responses across ethnicity groups",
+        "xlabel": "Ethnicity ranges",
+        "ylabel": "Average similarity score across all responses within given ethnicity groups",
+        "size": (LENGTH, WIDTH),
+        "rotation": 15
+    },
+    "education": {
+        "buckets": [4, 0, 1, 2],
+        "labels": ["Lower than highschool degree", 'Highschool Diploma', "Bachelor's Degree", "Master's Degree"],
+        "title": "Average response similarity to ChatGPT responses across education groups",
+        "xlabel": "Education levels",
+        "ylabel": "Average similarity score across all responses within given education groups",
+        "size": (LENGTH, WIDTH),
+        "rotation": 12
+    },
+    "income": {
+        "buckets": list(range(16)),
+        "labels": ["$0 - $4,999", '$5,000 - $7,499', '$7,500 - $9,999', '$10,000 - $12,499', '$12,500 - $14,999', '$15,000 - $19,999',
+                   '$20,000 - $24,999', '$25,000 - $29,999', '$30,000 - $34,999', '$35,000 - $39,999', '$40,000 - $49,999', '$50,000 - $59,999',
+                   '$60,000 - $74,999', '$75,000 - $99,999', '$100,000 - $149,999', '$150,000+'],
+        "title": "Average response similarity to ChatGPT responses across income groups",
+        "xlabel": "Household income",
+        "ylabel": "Average similarity score across all responses within given income groups",
+        "size": (LENGTH * 2, WIDTH),
+        "rotation": 15
+    }
+}
+
+
+def make_chart(index, demographic):
+    name = demographic["name"]
+    chart = None if survey.SURVEY_FILE else STYLES.get(name)
+    if chart is None:
+        labels = survey.bucket_labels(demographic)[:-1]
+        chart = {
+            "buckets": list(range(len(labels))),
+            "labels": labels,
+            "title": f"Response similarity to ChatGPT responses across {name} groups",
+            "xlabel": name.capitalize(),
+            "ylabel": f"Average similarity score across all responses within given {name} groups",
+            "size": (LENGTH * 2 if len(labels) > 8 else LENGTH, WIDTH),
+            "rotation": 15 if len(labels) > 4 else 0
+        }
+    return dict(chart, name=name, demographic=index)
+
+CHARTS = [make_chart(index, demographic) for index, demographic in enumerate(survey.DEMOGRAPHICS)]
+
+
+# What a score column (r1c..r8c, rtc) is called in titles, menus and file names
+def score_label(key):
+    return "all questions" if key == "rtc" else f"question {key[1:-1]}"
+
+# The chart description for one score column, the plain one is for the overall score
+def chart_for(chart, key):
+    chart = dict(chart)
+    if key != "rtc":
+        chart["title"] = f"{chart['title']} ({score_label(key)})"
+        chart["ylabel"] = f"Average similarity score on {score_label(key)}"
+    return chart
+
+# Bar heights for a chart out of the full means table
+def chart_values(chart, means):
+    return [float(means[chart["demographic"]][bucket]) for bucket in chart["buckets"]]
+
+# Error bar lengths below and above each bar out of the interval tables from
+# analysis.demographic_intervals. Buckets without an interval get no error bar.
+def chart_errors(chart, values, intervals):
+    low = [float(intervals["low"][chart["demographic"]][bucket]) for bucket in chart["buckets"]]
+    high = [float(intervals["high"][chart["demographic"]][bucket]) for bucket in chart["buckets"]]
+    below = [value - end if end == end else 0.0 for value, end in zip(values, low)]
+    above = [end - value if end == end else 0.0 for value, end in zip(values, high)]
+    return [max(0.0, error) for error in below], [max(0.0, error) for error in above]
+
+# matplotlib reads text between two $ signs as maths, which mangles the income labels
+def tick_labels(labels):
+    return [label.replace("$", r"\$") for label in labels]
+
+# Draws a chart onto an empty matplotlib Figure and returns its bars so their heights can be
+# changed later without drawing everything again
+def draw_chart(fig, chart, values):
+    ax = fig.add_subplot(111)
+    bars = ax.bar(tick_labels(chart["labels"]), values)
+    ax.set_ylim(0, 1)
+    if chart["rotation"]:
+        ax.tick_params(axis="x", labelrotation=chart["rotation"])
+    ax.set_title(chart["title"])
+    ax.set_xlabel(chart["xlabel"])
+    ax.set_ylabel(chart["ylabel"])
+    return bars
+
+# Moves the bars of a drawn chart to new values
+def update_chart(bars, values):
+    for bar, value in zip(bars, values):
+        bar.set_height(value)
+
+# Draws error bars on top of bars. errors is (below, above) from chart_errors. The error bars drawn
+# last time (previous) are taken off first. Returns the new ones to pass in next time.
+def draw_errors(bars, errors, previous=None):
+    if previous is not None:
+        previous.remove()
+    ax = bars[0].axes
+    centres = [bar.get_x() + bar.get_width() / 2 for bar in bars]
+    heights = [bar.get_height() for bar in bars]
+    return ax.errorbar(centres, heights, yerr=errors, fmt="none", ecolor="black", capsize=4)
+
+# Rows are score columns, columns the chart's buckets. means is shaped (score columns, demographics,
+# buckets) like analysis.question_breakdown()["means"].
+def chart_matrix(chart, means):
+    return means[:, chart["demographic"], chart["buckets"]]
+
+# Draws one heatmap per chart onto an empty Figure, questions down and groups across, all on the same
+# colour scale. keys names the rows. Returns the images so update_heatmap can change them in place.
+def draw_heatmap(fig, means, keys):
+    images = []
+    axes = fig.subplots(len(CHARTS), 1)
+    for ax, chart in zip(axes, CHARTS):
+        image = ax.imshow(chart_matrix(chart, means), aspect="auto", cmap="viridis", vmin=0, vmax=1)
+        ax.set_yticks(range(len(keys)))
+        ax.set_yticklabels(["All" if key == "rtc" else f"Q{key[1:-1]}" for key in keys])
+        ax.set_xticks(range(len(chart["labels"])))
+        ax.set_xticklabels(tick_labels(chart["labels"]), rotation=chart["rotation"] or 0, fontsize=8)
+        ax.set_title(f"Average similarity by question and {chart['name']}")
+        images.append(image)
+    fig.colorbar(images[0], ax=list(axes))
+    return images
+
+def update_heatmap(images, means):
+    for image, chart in zip(images, CHARTS):
+        image.set_data(chart_matrix(chart, means))
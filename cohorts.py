@@ -0,0 +1,138 @@
+# Ad hoc cohorts and cross-tabs over the demographic index.
+# For every demographic and bucket there is a precomputed boolean mask over the index rows, so a
+# combined filter like women aged 25-34 with a Bachelor's is a handful of vectorized ORs (several values
+# of one demographic) and ANDs (several demographics) instead of nested list scans. Cross-tabs of two
+# demographics (gender x education, age x income) put both codes into one cell number and total every
+# cell with a single np.bincount, optionally only over the rows a filter selects.
+#
+# Usage: python cohorts.py [--filter gender=Female --filter age=25-34 ...] [--by gender education] [--question 5]
+
+import argparse
+import numpy as np
+import survey
+from demographics import DEMOGRAPHICS, SCORE_KEYS, BUCKET_COUNTS, filter_code
+import profiling
+
+
+def position(name):
+    if name not in DEMOGRAPHICS:
+        raise ValueError(f"Unknown demographic {name}, expected one of {', '.join(DEMOGRAPHICS)}")
+    return DEMOGRAPHICS.index(name)
+
+
+class CohortIndex:
+    # codes (rows, demographics) and scores (rows, score columns) as held by demographics.DemoIndex
+    def __init__(self, uids, codes, scores, lowbar=0):
+        self.uids = np.asarray(uids)
+        self.codes = codes
+        self.scores = scores
+        self.lowbar = lowbar
+        # masks[d] is shaped (buckets, rows), masks[d][b] is True for the rows in bucket b of demographic d
+        self.masks = [codes[:, d][np.newaxis, :] == np.arange(count)[:, np.newaxis]
+                      for d, count in enumerate(BUCKET_COUNTS)]
+
+    # Snapshot of a DemoIndex, later changes to the index don't show up in it
+    @classmethod
+    def from_index(cls, index, lowbar=0):
+        count = len(index)
+        return cls(list(index.uids), index.codes[:count].copy(), index.scores[:count].copy(), lowbar)
+
+    def __len__(self):
+        return len(self.uids)
+
+    # Boolean mask of the rows matching filters, a dict of demographic -> one value or a list of values
+    # (any of them matches). Values are anything demographics.filter_code takes.
+    def select(self, filters=None):
+        selected = np.ones(len(self.uids), dtype=bool)
+        for name, values in (filters or {}).items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            masks = self.masks[position(name)]
+            codes = [filter_code(name, value) for value in values]
+            selected &= np.logical_or.reduce(masks[codes], axis=0)
+        return selected
+
+    def members(self, filters=None):
+        return self.uids[self.select(filters)].tolist()
+
+    # Scores of the matching rows for score column key, only the ones above lowbar
+    def values(self, filters=None, key="rtc"):
+        values = self.scores[self.select(filters), SCORE_KEYS.index(key)]
+        return values[values > self.lowbar]
+
+    # (respondents matching, respondents with a score, mean score) for a filter
+    def summary(self, filters=None, key="rtc"):
+        selected = self.select(filters)
+        values = self.scores[selected, SCORE_KEYS.index(key)]
+        values = values[values > self.lowbar]
+        return int(selected.sum()), len(values), float(values.mean()) if len(values) else 0
+
+    # Cross-tab of two demographics for score column key over the rows matching filters.
+    # Returns a dict with the bucket labels of both ("rows", "columns"), "respondents" (everyone in
+    # each cell) and "counts" and "means" of the scores above lowbar, all shaped (row buckets, column buckets).
+    # Empty cells have a mean of 0.
+    def crosstab(self, rows, columns, key="rtc", filters=None):
+        a = position(rows)
+        b = position(columns)
+        selected = self.select(filters)
+        cells = self.codes[selected, a].astype(np.int64) * BUCKET_COUNTS[b] + self.codes[selected, b]
+        values = self.scores[selected, SCORE_KEYS.index(key)]
+        keep = values > self.lowbar  # NaN compares False, unscored rows only count as respondents
+        size = BUCKET_COUNTS[a] * BUCKET_COUNTS[b]
+        shape = (BUCKET_COUNTS[a], BUCKET_COUNTS[b])
+        respondents = np.bincount(cells, minlength=size).reshape(shape)
+        counts = np.bincount(cells[keep], minlength=size).reshape(shape)
+        sums = np.bincount(cells[keep], weights=values[keep], minlength=size).reshape(shape)
+        return {
+            "rows": survey.bucket_labels(survey.DEMOGRAPHICS[a]),
+            "columns": survey.bucket_labels(survey.DEMOGRAPHICS[b]),
+            "respondents": respondents,
+            "counts": counts,
+            "means": np.divide(sums, counts, out=np.zeros(shape), where=counts > 0)
+        }
+
+
+def print_crosstab(table, rows, columns, key):
+    width = max(len(label) for label in table["rows"]) + 2
+    print(f"Average {key} (respondents with a score) by {rows} and {columns}")
+    for j, label in enumerate(table["columns"]):
+        print(f"{'':<{width}}{j:>3}: {label}")
+    print(f"{rows:<{width}}" + "".join(f"{j:>14}" for j in range(len(table["columns"]))))
+    for i, label in enumerate(table["rows"]):
+        cells = "".join(f"{'-':>14}" if table["counts"][i, j] == 0
+                        else f"{table['means'][i, j]:>8.4f} ({table['counts'][i, j]:>3})"
+                        for j in range(len(table["columns"])))
+        print(f"{label:<{width}}{cells}")
+
+
+# "age=25-34" -> ("age", "25-34")
+def parse_filter(text):
+    name, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Filters look like demographic=value, got {text}")
+    return name.strip(), value.strip()
+
+def main():
+    parser = argparse.ArgumentParser(description="Averages for any combination of demographic groups")
+    parser.add_argument("--filter", type=parse_filter, action="append", default=[],
+                        help="demographic=value, repeat for more. Repeating a demographic matches any of its values")
+    parser.add_argument("--by", nargs=2, default=None, metavar=("ROWS", "COLUMNS"), help="cross-tab two demographics")
+    parser.add_argument("--question", type=int, default=None, help="question number, the overall score if left out")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    import analysis
+    filters = {}
+    for name, value in args.filter:
+        filters.setdefault(name, []).append(value)
+    key = "rtc" if args.question is None else f"r{args.question}c"
+    cohorts = analysis.get_cohorts()
+    if args.by:
+        print_crosstab(cohorts.crosstab(args.by[0], args.by[1], key, filters), args.by[0], args.by[1], key)
+    else:
+        respondents, scored, mean = cohorts.summary(filters, key)
+        print(f"{respondents} respondents, {scored} with a score, average {key} {mean:.4f}")
+
+if __name__ == "__main__":
+    main()
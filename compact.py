@@ -0,0 +1,195 @@
+# Compact formats for stored embeddings.
+# A mode is a number format, optionally followed by a dimension count: "float32" (the default, exact),
+# "float16", "int8", "float32:512", "int8:256" and so on.
+# float16 halves the size. int8 quarters it; every vector is scaled so its largest entry becomes 127,
+# and the scale is kept next to it. A dimension count keeps only the first dims entries and
+# renormalises, which works for Matryoshka trained models like text-embedding-3-small and cuts the
+# size by 1536 / dims on top.
+# Only cosine similarity is ever asked of the store, so scores can be worked out on the codes
+# directly: the scale cancels out and only the length of each code vector is needed.
+#
+# Usage: python compact.py report [store base] [--modes float16 int8 float32:512 ...] [--sample 500]
+#        python compact.py convert <source store base> <target store base> --mode int8:512
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from similarity import normalize, SimilarityEngine
+import profiling
+
+FORMATS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+REPORT_MODES = ["float16", "int8", "float32:512", "float32:256", "float16:512", "int8:512", "int8:256"]
+
+
+# "int8:256" -> ("int8", 256), "float16" -> ("float16", None)
+def parse_mode(mode):
+    name, _, dims = mode.partition(":")
+    if name not in FORMATS:
+        raise ValueError(f"Unknown embedding format {name}, expected one of {', '.join(FORMATS)}")
+    return name, int(dims) if dims else None
+
+# Layout of one stored row: codes shaped (questions, dim), plus one scale per question for int8
+def record_dtype(name, questions, dim):
+    fields = [("codes", FORMATS[name], (questions, dim))]
+    if name == "int8":
+        fields.append(("scale", np.float32, (questions,)))
+    return np.dtype(fields)
+
+# Full precision (..., source dim) vectors ready for a store in format name with dim dimensions.
+# Truncated vectors are renormalised. Every lossy format stores unit vectors so the codes use their
+# whole range.
+def prepare(vectors, name, dim):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dim < vectors.shape[-1]:
+        return normalize(vectors[..., :dim])
+    if name != "float32":
+        return normalize(vectors)
+    return vectors
+
+# Codes (and scales, None unless int8) for prepared vectors
+def encode(vectors, name):
+    if name == "int8":
+        scale = np.abs(vectors).max(axis=-1) / 127
+        scale[scale == 0] = 1
+        codes = np.clip(np.rint(vectors / scale[..., np.newaxis]), -127, 127).astype(np.int8)
+        return codes, scale.astype(np.float32)
+    return vectors.astype(FORMATS[name]), None
+
+# Back to float32 vectors
+def decode(codes, scales=None):
+    vectors = codes.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[..., np.newaxis]
+    return vectors
+
+
+# Rank of every value along the last axis, ties broken by position
+def _ranks(values):
+    return np.argsort(np.argsort(values, axis=-1), axis=-1).astype(np.float64)
+
+# Spearman rank correlation between matching rows of a and b
+def rank_agreement(a, b):
+    a = _ranks(a)
+    b = _ranks(b)
+    a -= a.mean(axis=-1, keepdims=True)
+    b -= b.mean(axis=-1, keepdims=True)
+    return (a * b).sum(axis=-1) / np.sqrt((a * a).sum(axis=-1) * (b * b).sum(axis=-1))
+
+# Share of the k nearest neighbours of each row in full that are also among its k nearest in other.
+# Both are (rows, rows) similarity matrices, a row's own column is ignored.
+def neighbour_overlap(full, other, k=10):
+    full = full.copy()
+    other = other.copy()
+    np.fill_diagonal(full, -np.inf)
+    np.fill_diagonal(other, -np.inf)
+    k = min(k, len(full) - 1)
+    a = np.argpartition(-full, k - 1, axis=1)[:, :k]
+    b = np.argpartition(-other, k - 1, axis=1)[:, :k]
+    return float(np.mean([len(np.intersect1d(x, y)) / k for x, y in zip(a, b)]))
+
+
+# Measures every mode against full precision on the rows of an existing store. Each mode is written
+# into a temporary store and scored through SimilarityEngine, the same way the program would use it.
+# Returns one dict per mode with size and accuracy figures.
+def accuracy_report(store, modes=REPORT_MODES, sample=500, reference=None, seed=0):
+    from embed_store import EmbedStore
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(store), min(sample, len(store)), replace=False))
+    uids = [store.uids[row] for row in rows]
+    if reference is None or reference not in store:
+        reference = uids[0]
+    if reference not in uids:
+        uids = [reference] + uids
+        rows = np.concatenate([[store.rows[reference]], rows])
+    block = store.decode(rows)
+
+    def scores(engine):
+        against = engine.against(reference)
+        pairwise = engine.pairwise()
+        return against, pairwise
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        baseline = None
+        for mode in ["float32"] + list(modes):
+            copy = EmbedStore(os.path.join(folder, mode.replace(":", "_")), store.questions, mode=mode)
+            copy.append_many(uids, block)
+            start = time.perf_counter()
+            engine = SimilarityEngine(copy)
+            against, pairwise = scores(engine)
+            took = time.perf_counter() - start
+            if baseline is None:
+                baseline = (against, pairwise)
+            full_against, full_pairwise = baseline
+            error = np.abs(pairwise - full_pairwise)
+            results.append({
+                "mode": mode,
+                "dim": copy.dim,
+                "bytes_per_respondent": copy.row_bytes,
+                "smaller_by": store.row_bytes / copy.row_bytes,
+                "mean_abs_error": float(error.mean()),
+                "max_abs_error": float(error.max()),
+                # How well the order of respondents by similarity to the reference survives, per question
+                "rank_agreement": float(rank_agreement(against.T, full_against.T).mean()),
+                "top10_overlap": float(np.mean([neighbour_overlap(full_pairwise[:, :, q], pairwise[:, :, q])
+                                                for q in range(pairwise.shape[2])])),
+                "seconds": took
+            })
+    return results
+
+def print_report(results):
+    print(f"{'mode':<13}{'dim':>6}{'bytes/resp':>12}{'smaller':>9}{'mean err':>11}{'max err':>10}{'rank agr':>10}{'top10':>8}")
+    for r in results:
+        print(f"{r['mode']:<13}{r['dim']:>6}{r['bytes_per_respondent']:>12}{r['smaller_by']:>8.1f}x"
+              f"{r['mean_abs_error']:>11.5f}{r['max_abs_error']:>10.5f}{r['rank_agreement']:>10.4f}{r['top10_overlap']:>8.3f}")
+
+
+# Copies every row of one store into a new store with another mode
+def convert(source, target, mode, chunk=1024):
+    from embed_store import EmbedStore
+    if isinstance(source, str):
+        source = EmbedStore(source)
+    target = EmbedStore(target, source.questions, mode=mode)
+    if len(target):
+        raise ValueError(f"{target.path} already has embeddings in it")
+    for start in range(0, len(source), chunk):
+        end = min(start + chunk, len(source))
+        target.append_many(source.uids[start:end], source.decode(slice(start, end)))
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact embedding formats: accuracy report and conversion")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="compare every mode against full precision")
+    report.add_argument("store", nargs="?", default=None, help="store base path, Data/embeds by default")
+    report.add_argument("--modes", nargs="+", default=REPORT_MODES)
+    report.add_argument("--sample", type=int, default=500, help="respondents compared with each other")
+    report.add_argument("--reference", type=int, default=1, help="uid the rank agreement is measured against")
+    conversion = commands.add_parser("convert", help="copy a store into a new one with another mode")
+    conversion.add_argument("source")
+    conversion.add_argument("target")
+    conversion.add_argument("--mode", required=True)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    from embed_store import EmbedStore
+    if args.command == "report":
+        if args.store is None:
+            import analysis
+            store = analysis.get_store()
+        else:
+            store = EmbedStore(args.store)
+        if len(store) < 2:
+            print("The store needs at least two respondents to compare")
+            return
+        print_report(accuracy_report(store, args.modes, args.sample, args.reference))
+    else:
+        target = convert(args.source, args.target, args.mode)
+        print(f"Copied {len(target)} rows into {args.target} as {args.mode}, {target.row_bytes} bytes a row")
+
+if __name__ == "__main__":
+    main()
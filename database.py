@@ -0,0 +1,249 @@
+# Optional SQLite copy of everything the analysis stores: responses, embeddings, compared scores and
+# custom questions, one table each, joined on uid. Every demographic gets a column with its bucket code
+# (the same codes demographics.encode gives) and an index on it, so cohort queries like "women 25-34
+# with a Bachelor's, question 5" are answered by SQLite from the indexes instead of reloading and
+# scanning the JSONL logs. Embeddings are float32 BLOBs, one per uid and question, holding the vectors
+# as the embedding store decodes them (EmbedStore.row). Their dimension is the store's, which is less
+# than the embedder's for a truncated mode like int8:256.
+# The database runs in WAL mode, so other processes can keep querying it while an import writes to it.
+# The logs and the embedding store stay the source of truth. With ANALYSIS_BACKEND=sqlite analysis writes
+# every new record here as well, and sync() catches the database up with anything added without it.
+#
+# Usage: python database.py sync
+#        python database.py query --filter gender=Female --filter age=25-34 --filter "education=Bachelor's Degree" --question 5
+
+import os
+import time
+import sqlite3
+import argparse
+import threading
+import numpy as np
+import survey
+from demographics import SCORE_KEYS, encode, filter_code
+from cohorts import parse_filter
+import profiling
+
+
+# Column name made safe to put in a statement, whatever a custom survey calls its fields
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SurveyDatabase:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent after a crash with NORMAL, only the very last commits can be lost
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create()
+
+    def _create(self):
+        demographics = "".join(f", {quote(name)} TEXT, {quote(name + '_code')} INTEGER NOT NULL"
+                               for name in survey.DEMOGRAPHIC_NAMES)
+        answers = "".join(f", {quote(field)} TEXT" for field in survey.QUESTION_FIELDS)
+        scores = "".join(f", {quote(key)} REAL" for key in SCORE_KEYS)
+        with self._lock:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS responses (uid INTEGER PRIMARY KEY, name TEXT{demographics}{answers})")
+            for name in survey.DEMOGRAPHIC_NAMES:
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS {quote('responses_' + name)} ON responses ({quote(name + '_code')})")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (uid INTEGER NOT NULL, question INTEGER NOT NULL, "
+                             "vector BLOB NOT NULL, PRIMARY KEY (uid, question)) WITHOUT ROWID")
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS compared (uid INTEGER PRIMARY KEY{scores})")
+            self._db.execute("CREATE TABLE IF NOT EXISTS custom_questions (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                             "question TEXT, human_response TEXT, chatgpt_response TEXT, similarity REAL)")
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    # uids with embeddings stored
+    def embedded(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(DISTINCT uid) FROM embeddings").fetchone()[0]
+
+    # Responses as stored in responses.jsonl, a response for a uid already here replaces it
+    def add_responses(self, responses):
+        columns = ["uid", "name"] + [column for name in survey.DEMOGRAPHIC_NAMES for column in (name, name + "_code")] \
+            + survey.QUESTION_FIELDS
+        rows = []
+        for response in responses:
+            codes = encode(response)
+            row = [response["uid"], response.get("name")]
+            for name, code in zip(survey.DEMOGRAPHIC_NAMES, codes):
+                value = response.get(name)
+                row += [None if value is None else str(value), code]
+            rows.append(row + [response.get(field) for field in survey.QUESTION_FIELDS])
+        with self._lock:
+            self._db.executemany(f"INSERT OR REPLACE INTO responses ({', '.join(map(quote, columns))}) "
+                                 f"VALUES ({', '.join('?' * len(columns))})", rows)
+            self._db.commit()
+
+    # block is shaped (len(uids), questions, dim) like EmbedStore.append_many takes it
+    def add_embeddings(self, uids, block):
+        block = np.asarray(block, dtype=np.float32)
+        rows = [(int(uid), q, block[i, q].tobytes()) for i, uid in enumerate(uids) for q in range(block.shape[1])]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (uid, question, vector) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    # Records as stored in compared.jsonl, the newest record for a uid wins
+    def set_compared(self, records):
+        columns = ["uid"] + SCORE_KEYS
+        with self._lock:
+            self._db.executemany(f"INSERT OR REPLACE INTO compared ({', '.join(map(quote, columns))}) "
+                                 f"VALUES ({', '.join('?' * len(columns))})",
+                                 [[record["uid"]] + [record.get(key) for key in SCORE_KEYS] for record in records])
+            self._db.commit()
+
+    def add_custom(self, record):
+        with self._lock:
+            self._db.execute("INSERT INTO custom_questions (question, human_response, chatgpt_response, similarity) "
+                             "VALUES (?, ?, ?, ?)", (record["Question"], record["Human Response"],
+                                                     record["ChatGPT Response"], record["Similarity"]))
+            self._db.commit()
+
+    # Copies in whatever the logs and the embedding store have that the database doesn't yet.
+    # responses, compared and custom are iterables of records, store an EmbedStore. Returns how many rows were added.
+    def sync(self, responses, compared, store, custom=(), chunk=1024):
+        with self._lock:
+            known = {row[0] for row in self._db.execute("SELECT uid FROM responses")}
+            embedded = {row[0] for row in self._db.execute("SELECT DISTINCT uid FROM embeddings")}
+            customs = self._db.execute("SELECT COUNT(*) FROM custom_questions").fetchone()[0]
+        added = 0
+        batch = []
+        for response in responses:
+            if response.get("uid") not in known:
+                batch.append(response)
+        self.add_responses(batch)
+        added += len(batch)
+        # compared.jsonl can hold several records for a uid, rewriting them all keeps the newest
+        records = list(compared)
+        self.set_compared(records)
+        added += len(records)
+        rows = [row for row, uid in enumerate(store.uids) if uid not in embedded]
+        for start in range(0, len(rows), chunk):
+            part = rows[start:start + chunk]
+            uids = [store.uids[row] for row in part]
+            self.add_embeddings(uids, np.stack([store.row(uid) for uid in uids]))
+            added += len(part) * len(store.questions)
+        # Custom questions are only ever appended, the ones past what is here are new
+        for record in list(custom)[customs:]:
+            self.add_custom(record)
+            added += 1
+        return added
+
+    # WHERE clause for filters, a dict of demographic -> one value or a list of values (any of them
+    # matches), values given any way filter_code takes them
+    def _where(self, filters):
+        clauses = []
+        params = []
+        for name, values in (filters or {}).items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            codes = sorted({filter_code(name, value) for value in values})
+            clauses.append(f"r.{quote(name + '_code')} IN ({', '.join('?' * len(codes))})")
+            params += codes
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # uids of the respondents matching filters
+    def cohort(self, filters):
+        where, params = self._where(filters)
+        with self._lock:
+            return [row[0] for row in self._db.execute(f"SELECT r.uid FROM responses r{where} ORDER BY r.uid", params)]
+
+    # uids and scores of the matching respondents for one score column (like "r5c" or "rtc"), only
+    # scores above lowbar, the same rule the charts use
+    def cohort_scores(self, filters, key="rtc", lowbar=0):
+        where, params = self._where(filters)
+        column = f"c.{quote(key)}"
+        where += (" AND " if where else " WHERE ") + f"{column} > ?"
+        with self._lock:
+            rows = self._db.execute(f"SELECT r.uid, {column} FROM responses r JOIN compared c ON c.uid = r.uid"
+                                    f"{where} ORDER BY r.uid", params + [lowbar]).fetchall()
+        return [row[0] for row in rows], np.array([row[1] for row in rows], dtype=np.float64)
+
+    # (count, mean) of one score column over the matching respondents, worked out by SQLite
+    def cohort_mean(self, filters, key="rtc", lowbar=0):
+        where, params = self._where(filters)
+        column = f"c.{quote(key)}"
+        where += (" AND " if where else " WHERE ") + f"{column} > ?"
+        with self._lock:
+            count, mean = self._db.execute(f"SELECT COUNT(*), AVG({column}) FROM responses r JOIN compared c ON c.uid = r.uid"
+                                           f"{where}", params + [lowbar]).fetchone()
+        return count, 0 if mean is None else mean
+
+    # uids and embeddings of the matching respondents for question q (0 based), as a (rows, dim) array
+    def cohort_embeddings(self, filters, q):
+        where, params = self._where(filters)
+        where += (" AND " if where else " WHERE ") + "e.question = ?"
+        with self._lock:
+            rows = self._db.execute(f"SELECT r.uid, e.vector FROM responses r JOIN embeddings e ON e.uid = r.uid"
+                                    f"{where} ORDER BY r.uid", params + [q]).fetchall()
+        if not rows:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return [row[0] for row in rows], np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+    # Mean and count of a score column for every bucket of one demographic, grouped by SQLite.
+    # Returns {bucket label: (count, mean)} for the buckets that have any scores.
+    def breakdown(self, demographic, key="rtc", filters=None, lowbar=0):
+        where, params = self._where(filters)
+        column = f"c.{quote(key)}"
+        where += (" AND " if where else " WHERE ") + f"{column} > ?"
+        code = quote(demographic + "_code")
+        labels = survey.bucket_labels(survey.DEMOGRAPHICS[survey.DEMOGRAPHIC_NAMES.index(demographic)])
+        with self._lock:
+            rows = self._db.execute(f"SELECT r.{code}, COUNT(*), AVG({column}) FROM responses r JOIN compared c ON c.uid = r.uid"
+                                    f"{where} GROUP BY r.{code} ORDER BY r.{code}", params + [lowbar]).fetchall()
+        return {labels[code]: (count, mean) for code, count, mean in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite copy of the survey data and cohort queries against it")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync", help="copy in everything the logs and embedding store have that the database doesn't")
+    query = commands.add_parser("query", help="count and average score of a cohort")
+    query.add_argument("--filter", type=parse_filter, action="append", default=[],
+                       help="demographic=value, repeat for more. Repeating a demographic matches any of its values")
+    query.add_argument("--question", type=int, default=None, help="question number, the overall score if left out")
+    query.add_argument("--by", default=None, help="break the cohort down by this demographic")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    import analysis
+    if args.command == "sync":
+        # Always a full pass, compared scores and custom questions can be missing even when the counts match
+        database = SurveyDatabase(analysis.DATABASE)
+        database.sync(analysis.get_log(analysis.RESPONSES), analysis.get_log(analysis.COMPARED),
+                      analysis.get_store(), analysis.get_log(analysis.CUSTOMQS))
+        print(f"{len(database)} responses and {database.embedded()} respondents' embeddings in {database.path}")
+        return
+    database = SurveyDatabase(analysis.DATABASE)
+    filters = {}
+    for name, value in args.filter:
+        filters.setdefault(name, []).append(value)
+    key = "rtc" if args.question is None else f"r{args.question}c"
+    start = time.perf_counter()
+    if args.by:
+        results = database.breakdown(args.by, key, filters, analysis.LOWBAR)
+        took = time.perf_counter() - start
+        for label, (count, mean) in results.items():
+            print(f"{label}: {count} respondents, average {key} {mean:.4f}")
+    else:
+        count, mean = database.cohort_mean(filters, key, analysis.LOWBAR)
+        took = time.perf_counter() - start
+        print(f"{count} respondents, average {key} {mean:.4f}")
+    print(f"({took * 1000:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# Demographic index over all responses.
+# Every response is turned into one small integer code per demographic with table lookups, and the
+# compared scores sit next to the codes in a float array. Grouped means for every demographic, bucket
+# and question then come out of a single np.bincount instead of one file reload per bar.
+
+import numpy as np
+import survey
+
+DEMOGRAPHICS = survey.DEMOGRAPHIC_NAMES
+# Columns of a compared record, one per question and the overall score last
+SCORE_KEYS = survey.SCORE_KEYS
+
+# Value -> bucket for the demographics picked from a list, aliases included. Anything not in here
+# goes to the last "unlisted" bucket.
+CATEGORIES = {}
+for demographic in survey.DEMOGRAPHICS:
+    if demographic["type"] == "choice":
+        codes = {value: code for code, value in enumerate(survey.buckets(demographic))}
+        for alias, value in demographic.get("aliases", {}).items():
+            codes[alias] = codes[value]
+        CATEGORIES[demographic["name"]] = codes
+# Buckets per demographic, including the unlisted one
+BUCKET_COUNTS = [len(survey.buckets(demographic)) + 1 for demographic in survey.DEMOGRAPHICS]
+MAX_BUCKETS = max(BUCKET_COUNTS)
+
+
+# Bucket of a number among (low, high) ranges, len(ranges) (unlisted) if it isn't a whole number
+# or falls in none of them
+def range_code(value, ranges):
+    try:
+        value = int(value)
+    except (ValueError, TypeError):
+        return len(ranges)
+    for code, (low, high) in enumerate(ranges):
+        if low <= value and (high is None or value <= high):
+            return code
+    return len(ranges)
+
+# One bucket code per demographic for a response
+def encode(response):
+    codes = []
+    for demographic, count in zip(survey.DEMOGRAPHICS, BUCKET_COUNTS):
+        value = response.get(demographic["name"])
+        if demographic["type"] == "range":
+            codes.append(range_code(value, demographic["ranges"]))
+        else:
+            codes.append(CATEGORIES[demographic["name"]].get(value, count - 1) if isinstance(value, str) else count - 1)
+    return codes
+
+# Bucket code of one filter value for a demographic. Takes a bucket label from survey.bucket_labels
+# ("25-34", "Unlisted"), an option or alias ("Female", "Lower than highschool degree") or, for range
+# demographics, a number (29).
+def filter_code(name, value):
+    if name not in DEMOGRAPHICS:
+        raise ValueError(f"Unknown demographic {name}, expected one of {', '.join(DEMOGRAPHICS)}")
+    demographic = survey.DEMOGRAPHICS[DEMOGRAPHICS.index(name)]
+    labels = survey.bucket_labels(demographic)
+    if value in labels:
+        return labels.index(value)
+    if demographic["type"] == "range":
+        code = range_code(value, demographic["ranges"])
+    else:
+        code = CATEGORIES[name].get(value, len(labels) - 1)
+    if code == len(labels) - 1:
+        raise ValueError(f"{value!r} is not one of the {name} groups: {', '.join(labels)}")
+    return code
+
+
+# Running totals per (demographic, bucket, score column): how many scores above lowbar there are,
+# their sum and their sum of squares. Adding or removing one respondent touches one cell per
+# demographic, so keeping them current costs the same no matter how big the survey gets.
+class Aggregates:
+    def __init__(self, lowbar=0):
+        self.lowbar = lowbar
+        shape = (len(DEMOGRAPHICS), MAX_BUCKETS, len(SCORE_KEYS))
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.sums = np.zeros(shape)
+        self.sumsq = np.zeros(shape)
+
+    # Full recomputation from arrays of codes (rows, demographics) and scores (rows, score columns)
+    @classmethod
+    def from_arrays(cls, codes, scores, lowbar=0):
+        aggregates = cls(lowbar)
+        keep = scores > lowbar  # NaN compares False so unscored rows drop out here
+        values = np.where(keep, scores, 0.0)
+        width = MAX_BUCKETS * len(SCORE_KEYS)
+        # Flat slot for (demographic, bucket, score column) so one bincount covers everything
+        slots = (np.arange(len(DEMOGRAPHICS))[np.newaxis, :, np.newaxis] * width
+                 + codes[:, :, np.newaxis].astype(np.int64) * len(SCORE_KEYS)
+                 + np.arange(len(SCORE_KEYS))[np.newaxis, np.newaxis, :]).ravel()
+        size = len(DEMOGRAPHICS) * width
+        shape = aggregates.counts.shape
+
+        def total(weights):
+            spread = np.broadcast_to(weights[:, np.newaxis, :], (len(codes), len(DEMOGRAPHICS), len(SCORE_KEYS)))
+            return np.bincount(slots, weights=spread.ravel(), minlength=size).reshape(shape)
+
+        aggregates.counts = np.rint(total(keep.astype(np.float64))).astype(np.int64)
+        aggregates.sums = total(values)
+        aggregates.sumsq = total(values * values)
+        return aggregates
+
+    # sign is 1 to add a respondent and -1 to take one back out
+    def update(self, codes, scores, sign=1):
+        keep = scores > self.lowbar
+        if not keep.any():
+            return
+        values = np.where(keep, scores, 0.0)
+        demographics = np.arange(len(DEMOGRAPHICS))
+        self.counts[demographics, codes] += sign * keep
+        self.sums[demographics, codes] += sign * values
+        self.sumsq[demographics, codes] += sign * values * values
+
+    # Empty buckets have a mean of 0
+    def means(self):
+        return np.divide(self.sums, self.counts, out=np.zeros(self.sums.shape), where=self.counts > 0)
+
+    # Sample variance, 0 where a bucket has fewer than two scores
+    def variances(self):
+        counts = self.counts
+        spread = np.maximum(self.sumsq - self.sums * self.sums / np.maximum(counts, 1), 0.0)
+        return np.divide(spread, counts - 1, out=np.zeros(self.sums.shape), where=counts > 1)
+
+
+class DemoIndex:
+    def __init__(self, capacity=1024, lowbar=0):
+        self.uids = []
+        self.rows = {}
+        self.codes = np.zeros((capacity, len(DEMOGRAPHICS)), dtype=np.int16)
+        # NaN until a compared record for the uid shows up
+        self.scores = np.full((capacity, len(SCORE_KEYS)), np.nan)
+        self.aggregates = Aggregates(lowbar)
+        # Goes up on every change, so anything drawn from the index can tell when it is out of date
+        self.version = 0
+
+    # Builds the index in one pass over the responses and compared records (lists or any iterable)
+    @classmethod
+    def build(cls, responses, compared, lowbar=0):
+        index = cls(lowbar=lowbar)
+        for response in responses:
+            index._place(response)
+        for record in compared:
+            row = index.rows.get(record.get("uid"))
+            if row is not None:
+                index.scores[row] = [record.get(key, np.nan) for key in SCORE_KEYS]
+        index.rebuild(lowbar)
+        return index
+
+    def __len__(self):
+        return len(self.uids)
+
+    def _grow(self):
+        capacity = 2 * self.codes.shape[0]
+        codes = np.zeros((capacity, len(DEMOGRAPHICS)), dtype=np.int16)
+        codes[:len(self.uids)] = self.codes[:len(self.uids)]
+        scores = np.full((capacity, len(SCORE_KEYS)), np.nan)
+        scores[:len(self.uids)] = self.scores[:len(self.uids)]
+        self.codes = codes
+        self.scores = scores
+
+    # Row for a response with its codes filled in, without touching the aggregates
+    def _place(self, response):
+        uid = response["uid"]
+        if uid not in self.rows:
+            if len(self.uids) == self.codes.shape[0]:
+                self._grow()
+            self.rows[uid] = len(self.uids)
+            self.uids.append(uid)
+        row = self.rows[uid]
+        self.codes[row] = encode(response)
+        return row
+
+    # Adds a response, or re-codes it if the uid is already indexed
+    def add(self, response):
+        row = self.rows.get(response["uid"])
+        if row is not None:
+            self.aggregates.update(self.codes[row], self.scores[row], -1)
+        row = self._place(response)
+        self.aggregates.update(self.codes[row], self.scores[row])
+        self.version += 1
+
+    # Takes a compared record. Records for uids without a response are ignored.
+    def set_scores(self, record):
+        row = self.rows.get(record.get("uid"))
+        if row is not None:
+            self.aggregates.update(self.codes[row], self.scores[row], -1)
+            self.scores[row] = [record.get(key, np.nan) for key in SCORE_KEYS]
+            self.aggregates.update(self.codes[row], self.scores[row])
+            self.version += 1
+
+    # Recomputes the aggregates from scratch, needed when lowbar changes
+    def rebuild(self, lowbar=None):
+        if lowbar is None:
+            lowbar = self.aggregates.lowbar
+        count = len(self.uids)
+        self.aggregates = Aggregates.from_arrays(self.codes[:count], self.scores[:count], lowbar)
+        self.version += 1
+
+    # uids in one bucket of one demographic, for example uids_in("age", 1) for 25-34
+    def uids_in(self, demographic, bucket):
+        column = self.codes[:len(self.uids), DEMOGRAPHICS.index(demographic)]
+        return [self.uids[row] for row in np.flatnonzero(column == bucket)]
+
+    # The old create_graph_data layout: demos[demographic][bucket] is a list of uids
+    def uid_lists(self):
+        demos = [[[] for _ in range(count)] for count in BUCKET_COUNTS]
+        codes = self.codes[:len(self.uids)]
+        for row, uid in enumerate(self.uids):
+            for d, code in enumerate(codes[row]):
+                demos[d][code].append(uid)
+        return demos
+
+    # Mean and count of every score column for every demographic bucket, only counting scores above
+    # lowbar. Both arrays are shaped (demographics, MAX_BUCKETS, len(SCORE_KEYS)), empty buckets have
+    # a mean of 0. Read straight from the running aggregates unless lowbar changed.
+    def group_means(self, lowbar=0):
+        if lowbar != self.aggregates.lowbar:
+            self.rebuild(lowbar)
+        return self.aggregates.means(), self.aggregates.counts
+
+    # Mean of one score column over a list of uids, the way average_dem always worked
+    def mean_of(self, uids, key, lowbar=0):
+        rows = [self.rows[uid] for uid in uids if uid in self.rows]
+        if not rows:
+            return 0
+        values = self.scores[rows, SCORE_KEYS.index(key)]
+        values = values[values > lowbar]
+        return float(values.mean()) if len(values) else 0
@@ -0,0 +1,225 @@
+# Columnar embedding store that replaces the big indented Data/embeds.json file.
+# Every uid gets one row of shape (questions, dim) inside a flat float32 file. Reads go through a
+# memory map so a lookup is a dict hit plus a view into the file, and writes only ever append bytes.
+# The uid -> row mapping lives in a tiny sidecar with one uid per line.
+# New stores can be made in a compact mode (see compact.py), rows then hold float16 or int8 codes
+# and possibly fewer dimensions. A float32 store is laid out exactly like it always was.
+
+import os
+import json
+import numpy as np
+from storage import file_lock
+from jsonstream import iter_vector_blocks
+import compact
+import survey
+import profiling
+
+# One embedding per survey question, q1e, q2e, ...
+QUESTION_KEYS = survey.EMBED_KEYS
+DTYPE = np.float32
+
+
+class EmbedStore:
+    # path is the base name of the store, "Data/embeds" gives embeds.f32, embeds.idx and embeds.meta.json.
+    # mode only matters for a new store, an existing one keeps the mode it was made with.
+    def __init__(self, path, questions=QUESTION_KEYS, mode="float32"):
+        self.path = path
+        self.data_path = path + ".f32"
+        self.index_path = path + ".idx"
+        self.meta_path = path + ".meta.json"
+        self.questions = list(questions)
+        self.format, self.max_dim = compact.parse_mode(mode)
+        self.dim = None
+        # Dimensions of the embeddings coming in, more than dim when they get truncated
+        self.source_dim = None
+        self._map = None
+        self._mapped_rows = 0
+        self._load()
+
+    def _load(self):
+        self.uids = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as file:
+                meta = json.load(file)
+            self.questions = meta["questions"]
+            self.dim = meta["dim"]
+            self.format = meta.get("dtype", "float32")
+            self.source_dim = meta.get("source_dim", self.dim)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as file:
+                lines = file.read().split("\n")
+            # The last piece is either empty or a line that is still being written
+            self.uids = [int(line) for line in lines[:-1] if line.strip()]
+        # A crash between writing the data and the index can leave either file a little ahead.
+        # Only rows that made it into both files count.
+        if self.dim is not None and os.path.exists(self.data_path):
+            complete = os.path.getsize(self.data_path) // self.row_bytes
+        else:
+            complete = 0
+        if len(self.uids) > complete:
+            del self.uids[complete:]
+            with open(self.index_path, "w") as file:
+                file.write("".join(f"{uid}\n" for uid in self.uids))
+        self.rows = {uid: row for row, uid in enumerate(self.uids)}
+        self._index_size = self._current_index_size()
+
+    def _current_index_size(self):
+        return os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+
+    @property
+    def record(self):
+        return compact.record_dtype(self.format, len(self.questions), self.dim)
+
+    @property
+    def row_bytes(self):
+        return self.record.itemsize
+
+    @property
+    def mode(self):
+        return self.format if self.dim == self.source_dim else f"{self.format}:{self.dim}"
+
+    # True when the stored vectors are not the exact embeddings that came in
+    @property
+    def lossy(self):
+        return self.format != "float32" or self.dim != self.source_dim
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __contains__(self, uid):
+        return uid in self.rows
+
+    # Every stored row as a memory map of records with "codes" and, for int8, "scale" fields
+    def records(self):
+        count = len(self.uids)
+        if count == 0:
+            return np.empty(0, dtype=self.record if self.dim else compact.record_dtype("float32", len(self.questions), 0))
+        if self._map is None or self._mapped_rows != count:
+            self._map = np.memmap(self.data_path, dtype=self.record, mode="r", shape=(count,))
+            self._mapped_rows = count
+        return self._map
+
+    # Stored codes shaped (rows, questions, dim) and the int8 scales shaped (rows, questions), None
+    # for the float formats. Both are memory maps.
+    def codes(self):
+        return self.records()["codes"]
+
+    def scales(self):
+        return self.records()["scale"] if self.format == "int8" else None
+
+    # Stored rows (an index, list or slice of row positions) as float32, shaped (..., questions, dim).
+    # Only those rows are decoded, a slice of a float32 store is a view of the memory map.
+    def decode(self, rows):
+        if self.format == "float32":
+            return self.codes()[rows]
+        scales = self.scales()
+        return compact.decode(self.codes()[rows], None if scales is None else scales[rows])
+
+    # The whole store as a (rows, questions, dim) float32 array. For a float32 store this is a
+    # memory map and nothing is copied, compact stores are decoded into a new array.
+    def matrix(self):
+        return self.decode(slice(None))
+
+    # All question embeddings for a uid as a (questions, dim) float32 array
+    def row(self, uid):
+        return self.decode(self.rows[uid])
+
+    # Full precision vectors (any shape ending in the source dimension) in the form this store keeps
+    # them, as float32. Queries have to go through this before being compared with stored rows.
+    def prepare(self, vectors):
+        return compact.prepare(vectors, self.format, self.dim)
+
+    # One embedding, key is a question key like "q1e"
+    def get(self, uid, key):
+        return self.row(uid)[self.questions.index(key)]
+
+    # Rebuilds the old embeds.json style dict for a uid
+    def to_record(self, uid):
+        record = {"uid": uid}
+        row = self.row(uid)
+        for i, key in enumerate(self.questions):
+            record[key] = row[i].tolist()
+        return record
+
+    # vectors can be a dict keyed by question key, or anything shaped (questions, dim)
+    def append(self, uid, vectors):
+        if isinstance(vectors, dict):
+            vectors = [vectors[key] for key in self.questions]
+        self.append_many([uid], np.asarray(vectors, dtype=DTYPE)[np.newaxis])
+
+    # Appends a (count, questions, dim) block of full precision embeddings in one write, encoded in
+    # the store's mode. Several processes can append to the same store, the file lock keeps their
+    # rows apart and rows added by others are picked up first.
+    def append_many(self, uids, block):
+        block = np.ascontiguousarray(block, dtype=DTYPE)
+        if block.ndim != 3 or block.shape[0] != len(uids) or block.shape[1] != len(self.questions):
+            raise ValueError(f"Expected a block of shape ({len(uids)}, {len(self.questions)}, dim), got {block.shape}")
+        with file_lock(self.data_path):
+            if self._current_index_size() != self._index_size:
+                self._load()
+            self._append_locked(uids, block)
+
+    def _append_locked(self, uids, block):
+        for uid in uids:
+            if uid in self.rows:
+                raise ValueError(f"uid {uid} already has embeddings stored")
+        if self.dim is None:
+            self.source_dim = block.shape[2]
+            self.dim = min(self.max_dim or self.source_dim, self.source_dim)
+            self._write_meta()
+        elif block.shape[2] != self.source_dim:
+            raise ValueError(f"Expected embeddings with {self.source_dim} dimensions, got {block.shape[2]}")
+        rows = np.empty(len(uids), dtype=self.record)
+        codes, scales = compact.encode(compact.prepare(block, self.format, self.dim), self.format)
+        rows["codes"] = codes
+        if scales is not None:
+            rows["scale"] = scales
+
+        with open(self.data_path, "ab") as file:
+            # Throw away any half written row left behind by a crash before adding new ones
+            expected = len(self.uids) * self.row_bytes
+            if file.tell() != expected:
+                file.truncate(expected)
+                file.seek(expected)
+            file.write(rows.tobytes())
+        profiling.count("embed_store.bytes_written", rows.nbytes)
+        with open(self.index_path, "a") as file:
+            file.write("".join(f"{uid}\n" for uid in uids))
+        self._index_size = self._current_index_size()
+        for uid in uids:
+            self.rows[uid] = len(self.uids)
+            self.uids.append(uid)
+
+    def _write_meta(self):
+        folder = os.path.dirname(self.meta_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(self.meta_path, "w") as file:
+            json.dump({"questions": self.questions, "dim": self.dim, "dtype": self.format, "source_dim": self.source_dim}, file, indent=4)
+
+
+# One shot migration from the old embeds.json layout. uids that are already in the store are skipped,
+# so running it twice is harmless. The file is streamed a block of respondents at a time, so a big
+# embeds.json never has to fit in memory.
+def migrate_json(json_path, store):
+    if isinstance(store, str):
+        store = EmbedStore(store)
+    seen = set()
+    for uids, block in iter_vector_blocks(json_path, store.questions):
+        rows = []
+        for row, uid in enumerate(uids):
+            if uid in store or uid in seen:
+                continue
+            seen.add(uid)
+            rows.append(row)
+        if rows:
+            store.append_many([uids[row] for row in rows], block[rows] if len(rows) < len(uids) else block)
+    return store
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python embed_store.py <embeds.json> <store base path>")
+        sys.exit(1)
+    migrated = migrate_json(sys.argv[1], sys.argv[2])
+    print(f"Store at {sys.argv[2]} now holds {len(migrated)} rows")
@@ -0,0 +1,235 @@
+# Everything between a piece of text and its embedding.
+# Embedders are the backends that actually produce vectors (OpenAI, or a local fake for tests and
+# offline runs). Any object with a model name and an embed(texts) method that returns one vector per
+# text in order can be used as one. EmbeddingCache sits in front of an embedder so the same text is
+# never sent twice, and EmbeddingBatcher groups the texts that do need sending into few requests.
+
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+import profiling
+
+EMBED_MODEL = "text-embedding-3-small"
+# Limits of a single embeddings request
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_TOKENS = 300000
+# Keys per SELECT in EmbeddingCache.lookup_many, under SQLite's limit on bound parameters
+LOOKUP_CHUNK = 500
+
+
+# Two answers count as the same text if they only differ in case or whitespace
+def normalize_text(text):
+    return " ".join(str(text).split()).lower()
+
+# Content address for a piece of text under a given model
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+_client = None
+
+# One OpenAI client for the whole program. Importing openai and setting up the client is slow, so
+# it only happens the first time something actually talks to the API.
+def openai_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI()
+    return _client
+
+
+# Rough token count, about four characters a token for English text. Only used to size batches.
+def estimate_tokens(text):
+    return len(str(text)) // 4 + 1
+
+
+# Real backend. Takes a list of texts and gives back one embedding per text, in order.
+class OpenAIEmbedder:
+    def __init__(self, client=None, model=EMBED_MODEL):
+        self.client = client
+        self.model = model
+
+    def embed(self, texts):
+        if self.client is None:
+            self.client = openai_client()
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+# Deterministic local backend. The same text always gets the same unit vector, different texts get
+# (near) orthogonal ones. calls and texts_embedded make it easy to check what reached the backend.
+class HashEmbedder:
+    def __init__(self, dim=1536, model="hash-embedder"):
+        self.dim = dim
+        self.model = model
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def embed(self, texts):
+        texts = list(texts)
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        vectors = []
+        for text in texts:
+            seed = int(hashlib.sha256(str(text).encode("utf-8")).hexdigest()[:16], 16)
+            vector = np.random.default_rng(seed).standard_normal(self.dim)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+
+# Disk backed cache keyed by cache_key(model, text). Lookups go through the sqlite primary key so they
+# do not depend on how many answers are stored. Once more than max_entries are held the least
+# recently used ones are dropped.
+class EmbeddingCache:
+    def __init__(self, path, embedder, max_entries=200000):
+        self.path = path
+        self.embedder = embedder
+        self.model = embedder.model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._clock = self._db.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    # Cached vector for text, or None. Counts towards hits/misses.
+    def lookup(self, text):
+        return self.lookup_many([text])[0]
+
+    # Cached vectors for several texts, None for the ones that aren't cached. Counts towards hits/misses.
+    # The keys are read with a few IN queries and every hit gets its last_used bumped in one
+    # executemany, so looking up a whole batch is one transaction instead of one per text.
+    def lookup_many(self, texts):
+        keys = [cache_key(self.model, text) for text in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), LOOKUP_CHUNK):
+                part = unique[start:start + LOOKUP_CHUNK]
+                found.update(self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' * len(part))})",
+                                              part))
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            profiling.count("embedding_cache.hits", hits)
+            profiling.count("embedding_cache.misses", len(keys) - hits)
+            if found:
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                     [(self._tick(), key) for key in unique if key in found])
+                self._db.commit()
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    # Stores vectors for several texts in one transaction
+    def put_many(self, texts, vectors):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(cache_key(self.model, text), np.asarray(vector, dtype=np.float32).tobytes(), self._tick())
+                 for text, vector in zip(texts, vectors)])
+            self._evict()
+            self._db.commit()
+
+    def put(self, text, vector):
+        self.put_many([text], [vector])
+
+    def _evict(self):
+        extra = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if extra > 0:
+            self._db.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (extra,))
+
+    # Embedding for text, only asking the backend when it is not cached yet
+    def get(self, text):
+        vector = self.lookup(text)
+        if vector is None:
+            with profiling.timer("api.embeddings", histogram=True):
+                vector = np.asarray(self.embedder.embed([text])[0], dtype=np.float32)
+            profiling.count("embeddings.texts_sent")
+            self.put(text, vector)
+        return vector
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Collects texts from any number of questions and respondents and embeds them with as few requests as
+# possible. Each text is added under a slot, for example (uid, "q3e"), and flush() hands back a dict
+# of slot -> vector. Texts that are cached or repeated are only looked up once, everything else is
+# sent in batches that stay under max_items texts and max_tokens estimated tokens.
+class EmbeddingBatcher:
+    def __init__(self, cache, max_items=MAX_BATCH_ITEMS, max_tokens=MAX_BATCH_TOKENS):
+        self.cache = cache
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.requests = 0
+        self._slots = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, slot, text):
+        self._slots.append((slot, text))
+
+    # Splits texts into request sized groups
+    def batches(self, texts):
+        batch = []
+        tokens = 0
+        for text in texts:
+            size = estimate_tokens(text)
+            if batch and (len(batch) == self.max_items or tokens + size > self.max_tokens):
+                yield batch
+                batch = []
+                tokens = 0
+            batch.append(text)
+            tokens += size
+        if batch:
+            yield batch
+
+    def flush(self):
+        slots, self._slots = self._slots, []
+        unique = {}
+        for slot, text in slots:
+            unique.setdefault(cache_key(self.cache.model, text), text)
+
+        vectors = {}
+        missing = []
+        for (key, text), vector in zip(unique.items(), self.cache.lookup_many(list(unique.values()))):
+            if vector is None:
+                missing.append(text)
+            else:
+                vectors[key] = vector
+        for batch in self.batches(missing):
+            with profiling.timer("api.embeddings", histogram=True):
+                embedded = [np.asarray(vector, dtype=np.float32) for vector in self.cache.embedder.embed(batch)]
+            self.requests += 1
+            profiling.count("embeddings.texts_sent", len(batch))
+            self.cache.put_many(batch, embedded)
+            for text, vector in zip(batch, embedded):
+                vectors[cache_key(self.cache.model, text)] = vector
+
+        return {slot: vectors[cache_key(self.cache.model, text)] for slot, text in slots}
@@ -0,0 +1,193 @@
+# Generating LLM answers to the survey (and custom) questions, many at once.
+# A job is one prompt sent to one model at one temperature and seed. Jobs run on a pool of worker
+# threads that share one client, so its connection pool is reused. Two token buckets keep requests
+# and tokens per minute under the account limits. Failed calls are retried with exponential backoff.
+# Identical jobs only run once, and every answer is kept in a log so a rerun skips everything that
+# already has one.
+# Backends are any object with complete(prompt, model, temperature, max_tokens, seed) returning the
+# answer text. OpenAIChat talks to the API, or to any server with the same API through base_url
+# (a local fake server for example). FakeLLM answers in process without a network.
+
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from embeddings import openai_client, estimate_tokens
+import profiling
+
+CHAT_MODEL = "gpt-4o-mini-2024-07-18"
+SYSTEM_PROMPT = "You are a helpful assistant."
+MAX_TOKENS = 100
+WORKERS = 8
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200000
+RETRIES = 5
+# Seconds before the first retry, doubled every retry after that
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+class OpenAIChat:
+    # With base_url set a separate client is made for that server, otherwise the shared one is used
+    def __init__(self, client=None, base_url=None, api_key=None):
+        self.client = client
+        self.base_url = base_url
+        self.api_key = api_key
+
+    def complete(self, prompt, model=CHAT_MODEL, temperature=0, max_tokens=MAX_TOKENS, seed=None):
+        if self.client is None:
+            if self.base_url is not None:
+                from openai import OpenAI
+                self.client = OpenAI(base_url=self.base_url, api_key=self.api_key or "local")
+            else:
+                self.client = openai_client()
+        options = {"seed": seed} if seed is not None else {}
+        completion = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "developer", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options
+        )
+        return completion.choices[0].message.content
+
+
+# Deterministic local backend. The same job always gets the same answer. latency is slept on every
+# call and fail_every makes every n-th call raise, to try out concurrency and retries.
+class FakeLLM:
+    def __init__(self, latency=0.0, fail_every=0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self, prompt, model=CHAT_MODEL, temperature=0, max_tokens=MAX_TOKENS, seed=None):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_every and calls % self.fail_every == 0:
+            raise ConnectionError("fake LLM dropped the request")
+        digest = hashlib.sha256(f"{model}\0{temperature}\0{seed}\0{prompt}".encode("utf-8")).hexdigest()
+        return f"{model} answer {digest[:12]} to: {prompt}"
+
+
+# Allows rate units a second on average and bursts of up to capacity. Safe to share between threads.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Blocks until amount units are available and takes them
+    def take(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Rate limits, timeouts, dropped connections and server errors are worth another try.
+# Other 4xx errors (bad request, bad key) would only fail again, and so would bugs like a TypeError.
+def retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # openai is only imported once a call has failed, it is already loaded by then for the API backend
+    from openai import APIConnectionError, APIStatusError
+    if isinstance(error, APIConnectionError):  # APITimeoutError is one too
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+# The fields that make two jobs the same
+def job_key(job):
+    return (job["model"], float(job["temperature"]), job.get("seed"), job.get("max_tokens", MAX_TOKENS), job["prompt"])
+
+def make_job(prompt, model=CHAT_MODEL, temperature=0, seed=None, max_tokens=MAX_TOKENS):
+    return {"model": model, "temperature": temperature, "seed": seed, "max_tokens": max_tokens, "prompt": prompt}
+
+
+class Generator:
+    # log is an optional storage.RecordLog of finished jobs, used to skip work done in earlier runs
+    def __init__(self, backend, workers=WORKERS, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, retries=RETRIES, backoff=BACKOFF, log=None):
+        self.backend = backend
+        self.workers = workers
+        self.requests = TokenBucket(requests_per_minute / 60, max(1, requests_per_minute // 60))
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1, tokens_per_minute // 60))
+        self.retries = retries
+        self.backoff = backoff
+        self.log = log
+        self.done = {}
+        if log is not None:
+            for record in log:
+                self.done[job_key(record)] = record["text"]
+
+    # Runs on a worker thread
+    def _call(self, job):
+        for attempt in range(self.retries + 1):
+            with profiling.timer("generation.rate_limit_wait"):
+                self.requests.take()
+                self.tokens.take(estimate_tokens(job["prompt"]) + job.get("max_tokens", MAX_TOKENS))
+            try:
+                with profiling.timer("api.chat", histogram=True):
+                    return self.backend.complete(job["prompt"], model=job["model"], temperature=job["temperature"],
+                                                 max_tokens=job.get("max_tokens", MAX_TOKENS), seed=job.get("seed"))
+            except Exception as error:
+                if attempt == self.retries or not retryable(error):
+                    profiling.count("generation.failures")
+                    raise
+                profiling.count("generation.retries")
+                # Full jitter so workers that failed together don't all come back together
+                time.sleep(random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt)))
+
+    # Answers every job. Returns (answers, failures): answers maps job_key(job) to the answer text and
+    # failures maps job_key(job) to the exception of jobs that ran out of retries.
+    # progress(finished, total) is called after every job that had to be sent.
+    def run(self, jobs, progress=None):
+        jobs = list(jobs)
+        answers = {}
+        pending = {}
+        for job in jobs:
+            key = job_key(job)
+            if key in self.done:
+                answers[key] = self.done[key]
+            else:
+                pending.setdefault(key, job)
+        # Hits are jobs answered in an earlier run or repeated, misses the ones that have to be sent
+        profiling.count("generation.hits", len(jobs) - len(pending))
+        profiling.count("generation.misses", len(pending))
+        failures = {}
+        if not pending:
+            return answers, failures
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._call, job): key for key, job in pending.items()}
+            for finished, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                try:
+                    text = future.result()
+                except Exception as error:
+                    failures[key] = error
+                else:
+                    answers[key] = self.done[key] = text
+                    if self.log is not None:
+                        self.log.append(dict(pending[key], text=text))
+                if progress:
+                    progress(finished, len(pending))
+        return answers, failures
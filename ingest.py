@@ -0,0 +1,201 @@
+# Bulk import of survey exports.
+# Rows are streamed out of a CSV or JSONL file, checked against the options in survey.py and added in
+# chunks through analysis.add_users, so embeddings go out in large batches. Similarity scores for
+# everything that was imported are worked out once at the end.
+# Progress is checkpointed after every chunk, running the same import again picks up where it stopped.
+# Before a chunk is stored the checkpoint records its rows and the uids reserved for them, so a run
+# killed half way through a chunk finishes exactly that chunk next time instead of importing it twice.
+#
+# Usage: python ingest.py <export.csv|export.jsonl> [--chunk 500] [--offline] [--restart]
+
+import os
+import csv
+import json
+import logging
+import argparse
+from itertools import islice
+import analysis
+import survey
+from storage import write_atomic
+from jsonstream import iter_records
+import profiling
+
+CHUNK = 500
+# read_rows hands back a JSONL line it can't parse as {UNREADABLE: problem, "line": text} so it gets
+# rejected with its row number instead of stopping the import
+UNREADABLE = "_unreadable"
+
+log = logging.getLogger(__name__)
+
+
+# Yields each row of a CSV (with a header row), JSONL or old style .json list export as a dict
+def read_rows(path):
+    if path.lower().endswith(".csv"):
+        with open(path, "r", newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                yield row
+    elif path.lower().endswith(".json"):
+        yield from iter_records(path, fields=survey.FIELDS)
+    else:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    row = {UNREADABLE: f"not valid JSON: {error}", "line": line}
+                if not isinstance(row, dict):
+                    row = {UNREADABLE: "not a JSON object", "line": line}
+                yield row
+
+# Returns a list of problems with a row, empty if it can be imported
+def validate(row):
+    if UNREADABLE in row:
+        return [row[UNREADABLE]]
+    errors = []
+    for field in survey.FIELDS:
+        if field not in row or row[field] is None:
+            errors.append(f"missing {field}")
+    if errors:
+        return errors
+    for demographic in survey.DEMOGRAPHICS:
+        value = str(row[demographic["name"]]).strip()
+        if demographic["type"] == "range" and value:
+            try:
+                int(value)
+            except ValueError:
+                errors.append(f"{demographic['name']} is not a whole number: {value}")
+    # Demographics may be left blank like on the form, but anything given has to be one of the options
+    for field, options in survey.OPTIONS.items():
+        if row[field] != "" and row[field] not in options:
+            errors.append(f"unknown {field}: {row[field]}")
+    for field in survey.QUESTION_FIELDS:
+        if not str(row[field]).strip():
+            errors.append(f"empty answer for {field}")
+    return errors
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"rows_done": 0, "imported": 0, "rejected": 0}
+    with open(path, "r") as file:
+        return json.load(file)
+
+# Written atomically so an interrupted write never leaves a broken checkpoint behind
+def save_checkpoint(path, checkpoint):
+    write_atomic(path, json.dumps(checkpoint))
+
+def print_progress(checkpoint):
+    print(f"{checkpoint['rows_done']} rows read, {checkpoint['imported']} imported, {checkpoint['rejected']} rejected")
+
+# Splits a chunk of rows into users to import (tuples in survey.FIELDS order) and rejections, with
+# rows numbered on from line
+def split_rows(block, line):
+    users = []
+    rejections = []
+    for row in block:
+        line += 1
+        errors = validate(row)
+        if errors:
+            rejections.append({"row": line, "errors": errors, "data": row})
+        else:
+            users.append(tuple(str(row[field]) for field in survey.FIELDS))
+    return users, rejections
+
+# Finishes the chunk an earlier run was in the middle of when it stopped, checkpoint["pending"].
+# Users whose embeddings made it into the store are done. Responses that were written without their
+# embeddings are taken out of the log again, and everybody else in the chunk is added under the uid
+# reserved for them. Rejections the earlier run wrote for the chunk are cut off and written again.
+def finish_pending(path, checkpoint, rejected_path):
+    pending = checkpoint["pending"]
+    if os.path.exists(rejected_path):
+        os.truncate(rejected_path, min(pending["rejected_size"], os.path.getsize(rejected_path)))
+    block = list(islice(read_rows(path), checkpoint["rows_done"], pending["rows_done"]))
+    users, rejections = split_rows(block, checkpoint["rows_done"])
+    uids = list(range(pending["first_uid"], pending["first_uid"] + len(users)))
+    store = analysis.get_store()
+    todo = [i for i, uid in enumerate(uids) if uid not in store]
+    if todo:
+        unstored = {uids[i] for i in todo}
+        analysis.get_log(analysis.RESPONSES).remove(lambda response: response.get("uid") in unstored)
+        analysis.add_users([users[i] for i in todo], compare=False, uids=[uids[i] for i in todo])
+    with open(rejected_path, "a", encoding="utf-8") as rejected:
+        for rejection in rejections:
+            rejected.write(json.dumps(rejection) + "\n")
+    log.info("Finished the interrupted chunk up to row %s, %s users were still missing", pending["rows_done"], len(todo))
+    del checkpoint["pending"]
+    checkpoint["rows_done"] = pending["rows_done"]
+    checkpoint["imported"] += len(users)
+    checkpoint["rejected"] += len(rejections)
+
+# Imports every row of path. Rows that fail validation are written to <path>.rejected.jsonl together
+# with the reasons. progress is called with the checkpoint dict after each chunk.
+def import_file(path, chunk=CHUNK, restart=False, progress=print_progress):
+    checkpoint_path = path + ".progress.json"
+    rejected_path = path + ".rejected.jsonl"
+    if restart:
+        for old in (checkpoint_path, rejected_path):
+            if os.path.exists(old):
+                os.remove(old)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if "pending" in checkpoint:
+        finish_pending(path, checkpoint, rejected_path)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    rows = islice(read_rows(path), checkpoint["rows_done"], None)
+    with open(rejected_path, "a", encoding="utf-8") as rejected:
+        while True:
+            block = list(islice(rows, chunk))
+            if not block:
+                break
+            users, rejections = split_rows(block, checkpoint["rows_done"])
+            uids = analysis.get_allocator().reserve(len(users)) if users else range(0)
+            rejected.flush()
+            checkpoint["pending"] = {
+                "rows_done": checkpoint["rows_done"] + len(block),
+                "first_uid": uids[0] if users else 0,
+                "rejected_size": os.path.getsize(rejected_path)
+            }
+            save_checkpoint(checkpoint_path, checkpoint)
+            for rejection in rejections:
+                rejected.write(json.dumps(rejection) + "\n")
+            if users:
+                analysis.add_users(users, compare=False, uids=uids)
+            rejected.flush()
+            pending = checkpoint.pop("pending")
+            checkpoint["rows_done"] = pending["rows_done"]
+            checkpoint["imported"] += len(users)
+            checkpoint["rejected"] += len(rejections)
+            save_checkpoint(checkpoint_path, checkpoint)
+            if progress:
+                progress(checkpoint)
+
+    # Scores for the whole import in one pass. This also covers chunks from an earlier run that was
+    # interrupted before it got here.
+    missing = analysis.uncompared_uids()
+    if missing:
+        analysis.store_comparisons(analysis.CHATGPT_UID, missing)
+    analysis.update_references()
+    analysis.compact_logs()
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import survey responses from a CSV or JSONL export")
+    parser.add_argument("path")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="rows embedded and stored together")
+    parser.add_argument("--offline", action="store_true", help="use the local hash embedder instead of the API")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved progress and start from the first row")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+    if args.offline:
+        from embeddings import HashEmbedder
+        analysis.use_embedder(HashEmbedder())
+    checkpoint = import_file(args.path, chunk=args.chunk, restart=args.restart)
+    print("Done.")
+    print_progress(checkpoint)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Streaming reader for the old style .json files, one big indented array of records.
+# json.load turns a whole file into Python objects at once, and every embedding value becomes a float
+# object in a list, which for a big embeds.json adds up to far more memory than the file itself.
+# Here the file is read in chunks and records come out one at a time, so memory only ever holds the
+# current chunk and record. A regular expression jumps over everything but strings and brackets to find
+# where each record and each array in it ends. Arrays of numbers that are asked for as vectors are
+# parsed straight into float32 with np.fromstring and never become Python floats, and fields that
+# aren't asked for at all are cut out before the rest of the record goes through json.loads.
+
+import json
+import re
+import warnings
+import numpy as np
+import profiling
+
+CHUNK = 1 << 20
+# A string (group 1 is its closing quote, missing if the string runs past the end of what has been
+# read so far) or a bracket. Numbers, whitespace, commas and colons are skipped over.
+TOKENS = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(")?|[{}\[\]]')
+
+
+# Parses the text between the brackets of a JSON array of numbers into a float32 array
+def parse_vector(text):
+    with warnings.catch_warnings():
+        # Older numpy only warns and stops early when it hits something that isn't a number
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=np.float32, sep=",")
+        except (ValueError, DeprecationWarning):
+            raise ValueError(f"Expected an array of numbers, got [{text[:80]}...]") from None
+
+# Yields each record (object) of the top level array in a .json file as a dict.
+# fields limits the dicts to those keys, everything else in a record is skipped without being parsed.
+# vectors names keys holding arrays of numbers, those come out as float32 numpy arrays.
+def iter_records(path, fields=None, vectors=(), chunk=CHUNK):
+    vectors = set(vectors)
+    wanted = None if fields is None else set(fields) | vectors
+    with open(path, "r", encoding="utf-8") as file:
+        buffer = ""
+        # Where scanning carries on from, and where the current record started
+        position = 0
+        start = None
+        depth = 0
+        key = None
+        # (key, start, end) of the arrays in the current record that get parsed separately or skipped
+        cuts = []
+        array_start = None
+        while True:
+            match = TOKENS.search(buffer, position)
+            if match is None or (match.group(0)[0] == '"' and match.group(1) is None):
+                # Ran out of text, or a string is cut off at the end of it: read on
+                more = file.read(chunk)
+                profiling.count("jsonstream.chars_read", len(more))
+                if not more:
+                    if depth != 0:
+                        raise ValueError(f"{path} ends in the middle of a record")
+                    return
+                # Nothing before the current record is needed any more
+                resume = match.start() if match else len(buffer)
+                keep = resume if start is None else start
+                buffer = buffer[keep:] + more
+                position = resume - keep
+                if start is not None:
+                    cuts = [(name, begin - keep, end - keep) for name, begin, end in cuts]
+                    if array_start is not None:
+                        array_start -= keep
+                    start = 0
+                continue
+            token = match.group(0)
+            position = match.end()
+            if token[0] == '"':
+                if depth == 2:
+                    key = token
+            elif token in "{[":
+                depth += 1
+                if depth == 2:
+                    if token != "{":
+                        raise ValueError(f"{path} should be an array of objects")
+                    start = match.start()
+                    cuts = []
+                elif depth == 3 and token == "[":
+                    array_start = match.start()
+            else:
+                depth -= 1
+                if depth == 2 and token == "]" and array_start is not None:
+                    name = json.loads(key)
+                    if name in vectors or (wanted is not None and name not in wanted):
+                        cuts.append((name, array_start, match.end()))
+                    array_start = None
+                elif depth == 1:
+                    yield _record(buffer, start, match.end(), cuts, wanted, vectors)
+                    start = None
+                elif depth < 0:
+                    raise ValueError(f"{path} has a closing bracket too many")
+
+# Builds one record from its text with the cut out arrays replaced by null
+def _record(buffer, start, end, cuts, wanted, vectors):
+    pieces = []
+    at = start
+    parsed = {}
+    for name, begin, stop in cuts:
+        pieces.append(buffer[at:begin])
+        pieces.append("null")
+        at = stop
+        if name in vectors:
+            parsed[name] = parse_vector(buffer[begin + 1:stop - 1])
+    pieces.append(buffer[at:end])
+    record = json.loads("".join(pieces))
+    if wanted is not None:
+        record = {name: value for name, value in record.items() if name in wanted}
+    record.update(parsed)
+    return record
+
+
+# Reads the embeddings of an embeds.json in blocks. Yields (uids, block) where block is a float32 array
+# shaped (len(uids), len(keys), dim). Every block is written into the same preallocated array of rows
+# rows, so only a block's worth of embeddings is ever in memory and a block has to be used up before
+# asking for the next one.
+def iter_vector_blocks(path, keys, rows=1024, chunk=CHUNK):
+    keys = list(keys)
+    block = None
+    uids = []
+    for record in iter_records(path, fields=["uid"], vectors=keys, chunk=chunk):
+        if block is None:
+            block = np.empty((rows, len(keys), len(record[keys[0]])), dtype=np.float32)
+        for q, key in enumerate(keys):
+            if len(record[key]) != block.shape[2]:
+                raise ValueError(f"uid {record['uid']} has {len(record[key])} values for {key}, expected {block.shape[2]}")
+            block[len(uids), q] = record[key]
+        uids.append(record["uid"])
+        if len(uids) == rows:
+            yield uids, block
+            uids = []
+    if uids:
+        yield uids, block[:len(uids)]
@@ -1,14 +1,19 @@
+import logging
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 import analysis as analy
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import survey
+from background import TaskRunner, POLL_MS
+import charts
+import profiling
 
 MFONT = "Helvetica"
 BIGSIZE = 24
 BODYSIZE = 14
 
+log = logging.getLogger(__name__)
+
 
 
 class App(tk.Tk):
@@ -16,6 +21,16 @@ class App(tk.Tk):
         super().__init__()
         self.title("Analyzing Semantic Similarities")
         self.geometry("800x600")
+
+        # Status bar for work running in the background
+        self.status = tk.Frame(self)
+        self.status.pack(side="bottom", fill="x")
+        self.status_label = ttk.Label(self.status, text="Ready", font=(MFONT, BODYSIZE))
+        self.status_label.pack(side="left", padx=10, pady=5)
+        self.cancel_button = ttk.Button(self.status, text="Cancel queued", command=lambda: self.tasks.cancel_all())
+        self.progress = ttk.Progressbar(self.status, mode="indeterminate", length=150)
+        self.tasks = TaskRunner(self, on_change=self.update_status)
+        self.protocol("WM_DELETE_WINDOW", self.close)
         
         # Container frame to hold all pages
         self.container = tk.Frame(self)
@@ -39,6 +54,33 @@ class App(tk.Tk):
         """Show a frame for the given page class"""
         frame = self.frames[cont]
         frame.tkraise()
+        if hasattr(frame, "on_show"):
+            frame.on_show()
+
+    def update_status(self, running, queued):
+        """Show what the background worker is doing"""
+        if running is None and queued == 0:
+            self.status_label.configure(text="Ready")
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.cancel_button.pack_forget()
+            return
+        text = running or "Waiting"
+        if queued:
+            text += f" ({queued} queued)"
+        self.status_label.configure(text=text)
+        if not self.progress.winfo_ismapped():
+            self.cancel_button.pack(side="right", padx=10, pady=5)
+            self.progress.pack(side="right", padx=10, pady=5)
+            self.progress.start(POLL_MS)
+        if queued:
+            self.cancel_button.state(["!disabled"])
+        else:
+            self.cancel_button.state(["disabled"])
+
+    def close(self):
+        self.tasks.shutdown()
+        self.destroy()
 
 class MainPage(tk.Frame):
     def __init__(self, parent, controller):
@@ -119,23 +161,14 @@ class Page1(PageTemplate):
         self.canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
-        # Form fields configuration
-        self.fields = [
-            {"label": "What is your name?", "type": "text", "height": 1},
-            {"label": "What is your age?", "type": "text", "height": 1},
-            {"label": "What is your gender identity?", "type": "radio", "options": ["Male", "Female", "Non-binary", "Prefer not to say/Other"],"height": 1},
-            {"label": "What is your ethnicity?", "type": "radio", "options": ["White/Caucasian", "Asian - Eastern", "Asian - Indian", "Hispanic", "Black", "Native American", "Prefer not to answer"], "height": 1},
-            {"label": "What is the highest level of education you've completed?", "type": "radio", "options": ["Lower than highschool degree", "Highschool Diploma", "Bachelor's Degree", "Master's Degree", "Prefer not to answer"], "height": 1},
-            {"label": "How much total gross income did all members of your household earn in the past fiscal year?", "type": "radio", "options": ["$0 - $4,999", "$5,000 - $7,499", "$7,500 - $9,999", "$10,000 - $12,499", "$12,500 - $14,999", "$15,000 - $19,999", "$20,000 - $24,999", "$25,000 - $29,999", "$30,000 - $34,999", "$35,000 - $39,999", "$40,000 - $49,999", "$50,000 - $59,999", "$60,000 - $74,999", "$75,000 - $99,999", "$100,000 - $149,999", "$150,000+", "Prefer not to answer"], "height": 1},
-            {"label": "What does the phrase: \"Actions speak louder than words\" mean?", "type": "text", "height": 5},
-            {"label": "What makes someone a good leader?", "type": "text", "height": 5},
-            {"label": "What are some red flags that indicate someone is untrustworthy?", "type": "text", "height": 5},
-            {"label": "What does it mean to be successful?", "type": "text", "height": 5},
-            {"label": "What does it mean to be happy?", "type": "text", "height": 5},
-            {"label": "Imagine you lost something valuable to you. What would you do?", "type": "text", "height": 5},
-            {"label": "Complete the prompt: The electrician was...", "type": "text", "height": 5},
-            {"label": "Billy walked into his kitchen and saw a broken glass on the floor. What do you think happened?", "type": "text", "height": 5}
-            ]
+        # Form fields configuration, in survey.FIELDS order
+        self.fields = [{"label": survey.NAME_PROMPT, "type": "text", "height": 1}]
+        for demographic in survey.DEMOGRAPHICS:
+            if demographic["type"] == "choice":
+                self.fields.append({"label": demographic["prompt"], "type": "radio", "options": demographic["options"], "height": 1})
+            else:
+                self.fields.append({"label": demographic["prompt"], "type": "text", "height": 1})
+        self.fields += [{"label": question, "type": "text", "height": 5} for question in survey.QUESTIONS]
 
         # Store all input widgets
         self.input_widgets = []
@@ -189,33 +222,32 @@ class Page1(PageTemplate):
         submit_btn.grid(row=len(self.fields), column=0, columnspan=3, pady=20)
 
     def submit_form(self):
-        results = {}
+        a = []
         widget_index = 0
         
         for field in self.fields:
             if field["type"] == "text":
                 widget = self.input_widgets[widget_index]
                 if field["height"] > 1:
-                    results[field["label"]] = widget.get("1.0", "end-1c")
+                    a.append(widget.get("1.0", "end-1c"))
                 else:
-                    results[field["label"]] = widget.get()
+                    a.append(widget.get())
                 widget_index += 1
             elif field["type"] == "radio":
                 frame, var = self.input_widgets[widget_index]
-                results[field["label"]] = var.get()
+                a.append(var.get())
                 widget_index += 1
         
-        # My brain is fried and this works
-        variable = 0
-        a = ["", "", "", "", "", "", "", "", "", "", "", "", "", ""]
-        print("\nForm Results:")
-        for question, answer in results.items():
-            print(f"{question}: {answer}")
-            a[variable] = answer
-            variable += 1
-
-        analy.add_user(a[0], a[1], a[2], a[3], a[4], a[5], a[6], a[7], a[8], a[9], a[10], a[11], a[12], a[13])
-        self.controller.frames[Page4].update_graph()
+        log.debug("Form results:")
+        for field, answer in zip(self.fields, a):
+            log.debug("%s: %s", field["label"], answer)
+
+        # Embedding and comparing happens in the background, the form is free again straight away
+        self.controller.tasks.submit(
+            f"Adding the entry for {a[0] or 'an unnamed respondent'}",
+            analy.add_user, *a,
+            on_done=lambda uid: self.controller.frames[Page4].update_graph(),
+            on_error=lambda error: messagebox.showerror("Submission Failed", f"The entry for {a[0]} could not be added:\n{error}"))
         
         widget_index = 0
         for field in self.fields:
@@ -231,7 +263,7 @@ class Page1(PageTemplate):
             widget_index += 1
         
 
-        messagebox.showinfo("Submission Complete", "Thank you for your responses!")
+        messagebox.showinfo("Submission Complete", "Thank you for your responses! They are being processed in the background.")
         self.controller.show_frame(MainPage)
 
 
@@ -296,6 +328,12 @@ class Page3(PageTemplate):
         )
         submit_btn.grid(row=len(self.fields), column=0, columnspan=3, pady=20)
 
+        # Filled in once ChatGPT has answered
+        self.response_label = ttk.Label(self.scrollable_frame, text="", wraplength=400, font=(MFONT, BODYSIZE))
+        self.response_label.grid(row=3, column=0, padx=10, pady=(10, 0), sticky="w")
+        self.score_label = ttk.Label(self.scrollable_frame, text="", font=(MFONT, BODYSIZE))
+        self.score_label.grid(row=3, column=1, padx=10, pady=(10, 0), sticky="w")
+
     def submit_form(self):
         results = {}
         widget_index = 0
@@ -316,18 +354,23 @@ class Page3(PageTemplate):
         # My brain is fried and this works
         variable = 0
         a = ["", ""]
-        print("\nForm Results:")
+        log.debug("Form results:")
         for question, answer in results.items():
-            print(f"{question}: {answer}")
+            log.debug("%s: %s", question, answer)
             a[variable] = answer
             variable += 1
-        chatgpt_response = ""
-        chatgpt_response, similarity = analy.bonus_questions(a[0], a[1])
-        
-        label = ttk.Label(self.scrollable_frame, text=chatgpt_response, wraplength=400, font=(MFONT, BODYSIZE))
-        label.grid(row=3, column=0, padx=10, pady=(10, 0), sticky="w")
-        label = ttk.Label(self.scrollable_frame, text=f"Similarity Score: {similarity:.4f}", font=(MFONT, BODYSIZE))
-        label.grid(row=3, column=1, padx=10, pady=(10, 0), sticky="w")
+        self.response_label.configure(text="Asking ChatGPT...")
+        self.score_label.configure(text="")
+        self.controller.tasks.submit(
+            "Asking ChatGPT a custom question",
+            analy.bonus_questions, a[0], a[1],
+            on_done=self.show_result,
+            on_error=lambda error: self.response_label.configure(text=f"Something went wrong: {error}"))
+
+    def show_result(self, result):
+        chatgpt_response, similarity = result
+        self.response_label.configure(text=chatgpt_response)
+        self.score_label.configure(text=f"Similarity Score: {similarity:.4f}")
 
 class Page2(PageTemplate):
     def __init__(self, parent, controller):
@@ -349,10 +392,11 @@ class Page2(PageTemplate):
         self.canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
-        # Form fields configuration
+        # Form fields configuration, both lists offer the same entries so they are only loaded once
+        names = analy.get_names_with_uids()
         self.fields = [
-            {"label": "What is the first entry?", "type": "radio", "options": analy.get_names_with_uids(), "height": 1},
-            {"label": "What is the second entry?", "type": "radio", "options": analy.get_names_with_uids(), "height": 1}
+            {"label": "What is the first entry?", "type": "radio", "options": names, "height": 1},
+            {"label": "What is the second entry?", "type": "radio", "options": names, "height": 1}
         ]
         
         # Store all input widgets
@@ -389,6 +433,12 @@ class Page2(PageTemplate):
         )
         submit_btn.grid(row=len(self.fields), column=0, columnspan=3, pady=20)
 
+        # Filled in once the comparison is done
+        self.scores_label = ttk.Label(self.scrollable_frame, text="", wraplength=400, font=(MFONT, BODYSIZE))
+        self.scores_label.grid(row=3, column=0, padx=10, pady=(10, 0), sticky="w")
+        self.total_label = ttk.Label(self.scrollable_frame, text="", font=(MFONT, BODYSIZE))
+        self.total_label.grid(row=3, column=1, padx=10, pady=(10, 0), sticky="w")
+
     def submit_form(self):
         results = {}
         widget_index = 0
@@ -410,20 +460,25 @@ class Page2(PageTemplate):
         variable = 0
         a = ["", ""]
 
-        print("\nForm Results:")
+        log.debug("Form results:")
         for question, answer in results.items():
-            print(f"{question}: {answer}")
+            log.debug("%s: %s", question, answer)
             a[variable] = answer
             variable += 1
         
         # Compare the two UIDs (converted to integers)
-        q1sim, q2sim, q3sim, q4sim, q5sim, q6sim, q7sim, q8sim, qtsim = analy.compare_every(int(a[0]), int(a[1]))
-        
-        label = ttk.Label(self.scrollable_frame, text=f"Question 1 similarity: {q1sim:3f}\nQuestion 2 similarity: {q2sim:3f}\nQuestion 3 similarity: {q3sim:3f}\nQuestion 4 similarity: {q4sim:3f}\nQuestion 5 similarity: {q5sim:3f}\nQuestion 6 similarity: {q6sim:3f}\nQuestion 7 similarity: {q7sim:3f}\nQuestion 8 similarity: {q8sim:3f}\n", wraplength=400, font=(MFONT, BODYSIZE))
-        label.grid(row=3, column=0, padx=10, pady=(10, 0), sticky="w")
-        
-        label = ttk.Label(self.scrollable_frame, text=f"Total Similarity: {qtsim:.4f}", font=(MFONT, BODYSIZE))
-        label.grid(row=3, column=1, padx=10, pady=(10, 0), sticky="w")
+        self.scores_label.configure(text="Comparing...")
+        self.total_label.configure(text="")
+        self.controller.tasks.submit(
+            "Comparing two entries",
+            analy.compare_every, int(a[0]), int(a[1]),
+            on_done=self.show_result,
+            on_error=lambda error: self.scores_label.configure(text=f"Something went wrong: {error}"))
+
+    def show_result(self, result):
+        *sims, qtsim = result
+        self.scores_label.configure(text="".join(f"Question {q + 1} similarity: {sim:3f}\n" for q, sim in enumerate(sims)))
+        self.total_label.configure(text=f"Total Similarity: {qtsim:.4f}")
 
 
 class Page4(PageTemplate):
@@ -446,156 +501,120 @@ class Page4(PageTemplate):
         self.canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
-        self.figures = []
-        self.canvases = []
+        # Which score the bar charts show. Every question's numbers are already loaded, so switching
+        # only moves bars around.
+        self.key = "rtc"
+        self.key_names = {charts.score_label(key).capitalize(): key for key in ["rtc"] + analy.SCORE_KEYS[:-1]}
+        self.selector = ttk.Combobox(self.scrollable_frame, values=list(self.key_names), state="readonly")
+        self.selector.set(charts.score_label(self.key).capitalize())
+        self.selector.bind("<<ComboboxSelected>>", self.select_question)
+        self.selector.pack(pady=(20, 0))
+
+        # Charts are only drawn once the page is first shown. After that the same figures are kept
+        # and only their bar heights change.
+        self.charts = []
+        self.shown = False
+        self.drawn_version = None
+        # Error bars currently drawn on each chart
+        self.errorbars = []
+        # Means and counts of every question from analysis.question_breakdown
+        self.breakdown = None
+        self.heatmap = None
+        # The interval task that was submitted last, cancelled when a newer one replaces it
+        self.errors_task = None
+
+    def on_show(self):
+        self.shown = True
         self.update_graph()
 
-    
+    @profiling.timed("charts.draw")
     def update_graph(self):
-        LENGTH, WIDTH, DPI = 8, 6, 100
-        # Destroy the old
-        for canvas in self.canvases:
-            canvas.get_tk_widget().destroy()
-        self.figures.clear()
-        self.canvases.clear()
+        # Nothing to do until someone looks at the page, or if nothing changed since the last draw
+        if not self.shown:
+            return
+        version = analy.data_version()
+        if version == self.drawn_version:
+            return
 
         # From darkness emerges light.
+        # Every average of every question in one go, means[k][d][b] follows the layout of create_graph_data
+        self.breakdown = analy.question_breakdown()
+        means = self.breakdown["means"][self.breakdown["scores"].index(self.key)]
+        if not self.charts:
+            # matplotlib is slow to import, so it waits until the first chart is drawn
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            for chart in charts.CHARTS:
+                fig = Figure(figsize=chart["size"], dpi=charts.DPI)
+                bars = charts.draw_chart(fig, charts.chart_for(chart, self.key), charts.chart_values(chart, means))
+                # Embed the chart in the scrollable_frame
+                canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
+                canvas.draw()
+                canvas.get_tk_widget().pack(pady=20)
+                self.charts.append((chart, canvas, bars))
+                self.errorbars.append(None)
+            # Every question against every group, below the bar charts
+            fig = Figure(figsize=charts.HEATMAP_SIZE, dpi=charts.DPI, layout="constrained")
+            images = charts.draw_heatmap(fig, self.breakdown["means"], self.breakdown["scores"])
+            canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
+            canvas.draw()
+            canvas.get_tk_widget().pack(pady=20)
+            self.heatmap = (canvas, images)
+        else:
+            self.show_bars()
+            canvas, images = self.heatmap
+            charts.update_heatmap(images, self.breakdown["means"])
+            canvas.draw_idle()
+        self.drawn_version = version
+        self.request_errors()
+
+    # Moves the bars to the selected question's averages, from the numbers already loaded
+    @profiling.timed("charts.update")
+    def show_bars(self):
+        means = self.breakdown["means"][self.breakdown["scores"].index(self.key)]
+        for i, (chart, canvas, bars) in enumerate(self.charts):
+            # The old error bars belong to other numbers, new ones follow from request_errors
+            if self.errorbars[i] is not None:
+                self.errorbars[i].remove()
+                self.errorbars[i] = None
+            charts.update_chart(bars, charts.chart_values(chart, means))
+            bars[0].axes.set_title(charts.chart_for(chart, self.key)["title"])
+            bars[0].axes.set_ylabel(charts.chart_for(chart, self.key)["ylabel"])
+            canvas.draw_idle()
+
+    def select_question(self, event=None):
+        key = self.key_names[self.selector.get()]
+        if key == self.key:
+            return
+        self.key = key
+        if self.charts:
+            self.show_bars()
+            self.request_errors()
+
+    def request_errors(self):
+        # Bootstrapping the confidence intervals takes a moment, so it runs in the background and the
+        # error bars follow the bars once it is done. An older request that hasn't started yet is dropped,
+        # one that is already running finishes without drawing.
+        if self.errors_task is not None:
+            self.errors_task.cancel()
+        version, key = self.drawn_version, self.key
+        self.errors_task = self.controller.tasks.submit(
+            f"Working out confidence intervals for {charts.score_label(key)}",
+            analy.demographic_intervals, key,
+            on_done=lambda intervals: self.show_errors(intervals, version, key)
+        )
+
+    def show_errors(self, intervals, version, key):
+        # A newer update or another question is on its way with its own intervals
+        if version != self.drawn_version or key != self.key:
+            return
+        for i, (chart, canvas, bars) in enumerate(self.charts):
+            values = [bar.get_height() for bar in bars]
+            self.errorbars[i] = charts.draw_errors(bars, charts.chart_errors(chart, values, intervals), self.errorbars[i])
+            canvas.draw_idle()
 
-        # Graph 1. Age values.
-        demographics = analy.create_graph_data()
-        # Ages data + labels
-        ages_labels = ['18-24', '25-34', '35-44', '45-54', '55-64', '65+']
-        ages_values = [
-            analy.average_dem(demographics[0][0], "rtc"), 
-            analy.average_dem(demographics[0][1], "rtc"), 
-            analy.average_dem(demographics[0][2], "rtc"), 
-            analy.average_dem(demographics[0][3], "rtc"), 
-            analy.average_dem(demographics[0][4], "rtc"), 
-            analy.average_dem(demographics[0][5], "rtc")]
-
-        # Create a matplotlib Figure
-        fig = Figure(figsize=(LENGTH, WIDTH), dpi=DPI)
-        ax = fig.add_subplot(111)
-        ax.bar(ages_labels, ages_values)
-        ax.set_ylim(0, 1)
-        ax.set_title("Response similarity to ChatGPT responses across age groups")
-        ax.set_xlabel("Age ranges")
-        ax.set_ylabel("Average similarity score across all questions")
-
-        # Embed the chart in the scrollable_frame
-        canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(pady=20)
-    # Graph 2. Gender values.
-        gender_labels = ['Male', 'Female', 'Non-Binary']
-        gender_values = [
-            analy.average_dem(demographics[1][0], "rtc"), 
-            analy.average_dem(demographics[1][1], "rtc"), 
-            analy.average_dem(demographics[1][2], "rtc")]
-
-        # Create a matplotlib Figure
-        fig = Figure(figsize=(LENGTH, WIDTH), dpi=DPI)
-        ax = fig.add_subplot(111)
-        ax.bar(gender_labels, gender_values)
-        ax.set_ylim(0, 1)
-        ax.set_title("Response similarity to ChatGPT responses across gender groups")
-        ax.set_xlabel("Genders ranges")
-        ax.set_ylabel("Average similarity score across all responses within given gender groups")
-
-        # Embed the chart in the scrollable_frame
-        canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(pady=20)
-    # Graph 3. Ethnicity values.
-        ethnicity_labels = ['White/Caucasian', 'Asian - Eastern', 'Asian - Indian', 'Hispanic', 'Black', 'Native American']
-        ethnicity_values = [
-            analy.average_dem(demographics[2][0], "rtc"), 
-            analy.average_dem(demographics[2][1], "rtc"), 
-            analy.average_dem(demographics[2][2], "rtc"),
-            analy.average_dem(demographics[2][3], "rtc"),
-            analy.average_dem(demographics[2][4], "rtc"),
-            analy.average_dem(demographics[2][5], "rtc")]
-
-        # Create a matplotlib Figure
-        fig = Figure(figsize=(LENGTH, WIDTH), dpi=DPI)
-        ax = fig.add_subplot(111)
-        ax.bar(ethnicity_labels, ethnicity_values)
-        ax.set_ylim(0, 1)
-        ax.set_xticklabels(ethnicity_labels, rotation=15, ha='center')  # or rotation=45, etc.
-        ax.set_title("Response similarity to ChatGPT responses across ethnicity groups")
-        ax.set_xlabel("Ethnicity ranges")
-        ax.set_ylabel("Average similarity score across all responses within given ethnicity groups")
-
-        # Embed the chart in the scrollable_frame
-        canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(pady=20)
-    # Graph 4. Education values.
-        # Education 0: Highschool Diploma, 1: Bachelor's Degree, 2: Master's Degree, 3: Prefer not to answer, 4: Lower than highschool level education, 5: unlisted
-        education_labels = ["Lower than highschool degree", 'Highschool Diploma', "Bachelor's Degree", "Master's Degree"]
-        education_values = [
-            analy.average_dem(demographics[3][4], "rtc"), 
-            analy.average_dem(demographics[3][0], "rtc"), 
-            analy.average_dem(demographics[3][1], "rtc"),
-            analy.average_dem(demographics[3][2], "rtc")]
-
-        # Create a matplotlib Figure
-        fig = Figure(figsize=(LENGTH, WIDTH), dpi=DPI)
-        ax = fig.add_subplot(111)
-        ax.bar(education_labels, education_values)
-        ax.set_ylim(0, 1)
-        ax.set_xticklabels(education_labels, rotation=12, ha='center')
-        ax.set_title("Average response similarity to ChatGPT responses across education groups")
-        ax.set_xlabel("Education levels")
-        ax.set_ylabel("Average similarity score across all responses within given education groups")
-
-        # Embed the chart in the scrollable_frame
-        canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(pady=20)
-
-        # Income 0: $0 - $4,999, 1: $5,000 - $7,499, 2: $7,500 - $9,999, 3: $10,000 - $12,499, 4: $12,500 - $14,999, 5: $15,000 - $19,999
-        # 6: $20,000 - $24,999, 7: $25,000 - $29,999, 8: $30,000 - $34,999, 9: $35,000 - $39,999, 10: $40,000 - $49,999, 11: $50,000 - $59,999 
-        # 12: $60,000 - $74,999, 13: $75,000 - $99,999, 14: $100,000 - $149,999, 15: $150,000+, 16: Prefer not to answer, 17: unlisted
-        education_labels = ["$0 - $4,999", '$5,000 - $7,499', '$7,500 - $9,999', '$10,000 - $12,499', '$12,500 - $14,999', '$15,000 - $19,999',
-                                '$20,000 - $24,999', '$25,000 - $29,999', '$30,000 - $34,999', '$35,000 - $39,999', '$40,000 - $49,999', '$50,000 - $59,999',
-                                '$60,000 - $74,999', '$75,000 - $99,999', '$100,000 - $149,999', '$150,000+']
-        education_values = [
-            analy.average_dem(demographics[4][0], "rtc"), 
-            analy.average_dem(demographics[4][1], "rtc"), 
-            analy.average_dem(demographics[4][2], "rtc"),
-            analy.average_dem(demographics[4][3], "rtc"),
-            analy.average_dem(demographics[4][4], "rtc"),
-            analy.average_dem(demographics[4][5], "rtc"), 
-            analy.average_dem(demographics[4][6], "rtc"), 
-            analy.average_dem(demographics[4][7], "rtc"),
-            analy.average_dem(demographics[4][8], "rtc"),
-            analy.average_dem(demographics[4][9], "rtc"),
-            analy.average_dem(demographics[4][10], "rtc"), 
-            analy.average_dem(demographics[4][11], "rtc"), 
-            analy.average_dem(demographics[4][12], "rtc"),
-            analy.average_dem(demographics[4][13], "rtc"),
-            analy.average_dem(demographics[4][14], "rtc"),
-            analy.average_dem(demographics[4][15], "rtc")]
-
-        # Create a matplotlib Figure
-        fig = Figure(figsize=(LENGTH * 2, WIDTH), dpi=DPI)
-        ax = fig.add_subplot(111)
-        ax.bar(education_labels, education_values)
-        ax.set_ylim(0, 1)
-        ax.set_xticklabels(education_labels, rotation=15, ha='center')
-        ax.set_title("Average response similarity to ChatGPT responses across education groups")
-        ax.set_xlabel("Education levels")
-        ax.set_ylabel("Average similarity score across all responses within given education groups")
-
-        # Embed the chart in the scrollable_frame
-        canvas = FigureCanvasTkAgg(fig, master=self.scrollable_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(pady=20)
-        
-    
-        
 
 if __name__ == "__main__":
+    profiling.setup()
     app = App()
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,162 @@
+# Where the time goes. Timers, counters and latency histograms for the slow parts of the pipeline
+# (file reads and writes, embedding and chat API calls, comparisons, averages, chart drawing),
+# collected into one JSON report.
+# Nothing is recorded unless profiling is switched on, with --profile report.json on any of the command
+# line tools, ANALYSIS_PROFILE=report.json for anything else (the GUI included) or enable() from code.
+# While it is off every timer and counter returns straight away.
+# Logging is set up here too: the modules log through logging.getLogger(__name__) and only messages
+# at or above --log-level / ANALYSIS_LOG_LEVEL (WARNING by default) are formatted and shown.
+
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+import functools
+
+# Upper edges in seconds of the latency histogram buckets, anything slower lands in a last bucket
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+enabled = False
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+_histograms = {}
+_report_path = None
+
+
+# Starts recording. With a path the report is written there when the program exits.
+def enable(path=None):
+    global enabled, _report_path
+    enabled = True
+    if path and _report_path is None:
+        atexit.register(lambda: write_report(_report_path))
+    _report_path = path or _report_path
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _histograms.clear()
+
+
+def count(name, amount=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+# Adds one duration to a timer. histogram=True also files it into the latency histogram of that name.
+def record(name, seconds, histogram=False):
+    if not enabled:
+        return
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = _timers[name] = {"calls": 0, "total": 0.0, "max": 0.0}
+        timer["calls"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+        if histogram:
+            buckets = _histograms.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1))
+            buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+# Times a with block
+class timer:
+    def __init__(self, name, histogram=False):
+        self.name = name
+        self.histogram = histogram
+        self._start = None
+
+    def __enter__(self):
+        if enabled:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            record(self.name, time.perf_counter() - self._start, self.histogram)
+            self._start = None
+        return False
+
+# Decorator version of timer, named after the function unless a name is given
+def timed(name=None, histogram=False):
+    def wrap(function):
+        label = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start, histogram)
+        return wrapper
+    return wrap
+
+
+# Quantile estimated from histogram buckets, as the upper edge of the bucket it falls in. None when
+# it falls in the open ended last bucket.
+def _quantile(buckets, fraction):
+    target = fraction * sum(buckets)
+    seen = 0
+    for edge, amount in zip(LATENCY_BUCKETS, buckets):
+        seen += amount
+        if seen >= target:
+            return edge
+    return None
+
+# Everything recorded so far. Hit rates are worked out for every pair of "<name>.hits" and "<name>.misses" counters.
+def report():
+    with _lock:
+        timers = {name: dict(timer, mean=timer["total"] / timer["calls"]) for name, timer in sorted(_timers.items())}
+        counters = dict(sorted(_counters.items()))
+        histograms = {name: {
+            "buckets": [f"<={edge}s" for edge in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"],
+            "counts": list(buckets),
+            "p50": _quantile(buckets, 0.5),
+            "p95": _quantile(buckets, 0.95)
+        } for name, buckets in sorted(_histograms.items())}
+    hit_rates = {}
+    for name in counters:
+        base, _, kind = name.rpartition(".")
+        if kind in ("hits", "misses") and base not in hit_rates:
+            hits = counters.get(base + ".hits", 0)
+            total = hits + counters.get(base + ".misses", 0)
+            hit_rates[base] = hits / total if total else 0.0
+    return {"timers": timers, "counters": counters, "hit_rates": hit_rates, "latency": histograms}
+
+def write_report(path):
+    from storage import write_atomic
+    write_atomic(path, json.dumps(report(), indent=4))
+
+
+def setup_logging(level=None):
+    level = level or os.environ.get("ANALYSIS_LOG_LEVEL", "WARNING")
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.WARNING), format=LOG_FORMAT)
+
+# Adds --profile and --log-level to a command line tool's parser
+def add_arguments(parser):
+    parser.add_argument("--profile", metavar="REPORT", default=None,
+                        help="record timings and counters and write them to this JSON file on exit")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING (default) or ERROR")
+
+# Applies the flags from add_arguments, falling back to ANALYSIS_PROFILE and ANALYSIS_LOG_LEVEL
+def setup(args=None):
+    setup_logging(getattr(args, "log_level", None))
+    path = getattr(args, "profile", None) or os.environ.get("ANALYSIS_PROFILE")
+    if path:
+        enable(path)
+
+
+if os.environ.get("ANALYSIS_PROFILE"):
+    enable(os.environ["ANALYSIS_PROFILE"])
@@ -0,0 +1,127 @@
+# Similarity of every respondent to every registered reference response.
+# A reference is any uid in the embedding store whose answers others get compared against, for
+# example ChatGPT (uid 1), another model, or the same model at another temperature or prompt.
+# Scores are kept per reference in a flat float32 file of shape (rows, questions), in the same row
+# order as the embedding store. New respondents only append rows to each file and a new reference
+# only writes its own file, so nothing already scored is ever computed again. scores() puts the
+# files side by side as one (respondents, references, questions) array.
+
+import os
+import json
+import numpy as np
+from storage import file_lock, save_atomic
+
+DTYPE = np.float32
+
+
+class ReferenceScores:
+    # folder holds references.json (the registry) and one ref_<uid>.f32 file per reference
+    def __init__(self, folder, questions):
+        self.folder = folder
+        self.questions = list(questions)
+        self.registry_path = os.path.join(folder, "references.json")
+        self.references = []
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.registry_path):
+            with open(self.registry_path, "r") as file:
+                self.references = json.load(file)
+
+    def _save(self):
+        save_atomic(self.references, self.registry_path)
+
+    def __len__(self):
+        return len(self.references)
+
+    def __contains__(self, uid):
+        return any(reference["uid"] == uid for reference in self.references)
+
+    @property
+    def uids(self):
+        return [reference["uid"] for reference in self.references]
+
+    @property
+    def labels(self):
+        return [reference["label"] for reference in self.references]
+
+    def _path(self, uid):
+        return os.path.join(self.folder, f"ref_{uid}.f32")
+
+    @property
+    def _row_bytes(self):
+        return len(self.questions) * np.dtype(DTYPE).itemsize
+
+    # Rows already scored against a reference. A torn write at the end doesn't count.
+    def scored(self, uid):
+        path = self._path(uid)
+        return os.path.getsize(path) // self._row_bytes if os.path.exists(path) else 0
+
+    # Registers a reference and scores everybody against it. Registering a uid again only changes its label.
+    def add(self, uid, label, engine):
+        with file_lock(self.registry_path):
+            self._load()
+            for reference in self.references:
+                if reference["uid"] == uid:
+                    reference["label"] = label
+                    break
+            else:
+                if uid not in engine.rows:
+                    raise KeyError(f"uid {uid} has no stored embeddings to compare against")
+                self.references.append({"uid": uid, "label": label})
+            self._save()
+        self.update(engine, [uid])
+
+    # Forgets a reference and deletes its scores
+    def remove(self, uid):
+        with file_lock(self.registry_path):
+            self._load()
+            self.references = [reference for reference in self.references if reference["uid"] != uid]
+            self._save()
+            if os.path.exists(self._path(uid)):
+                os.remove(self._path(uid))
+
+    # Scores the rows each reference hasn't seen yet. References that are behind by the same number
+    # of rows are done together in one batched pass over (new rows, references, questions).
+    # Returns how many scores were written.
+    def update(self, engine, uids=None):
+        uids = self.uids if uids is None else uids
+        count = len(engine.uids)
+        written = 0
+        with file_lock(self.registry_path):
+            behind = {}
+            for uid in uids:
+                start = self.scored(uid)
+                if start < count and uid in engine.rows:
+                    behind.setdefault(start, []).append(uid)
+            for start, group in behind.items():
+                references = engine.vectors([engine.rows[uid] for uid in group])
+                scores = engine.against_vectors(references, start)
+                for r, uid in enumerate(group):
+                    self._append(uid, start, scores[:, r])
+                written += scores.size
+        return written
+
+    def _append(self, uid, start, scores):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self._path(uid), "ab") as file:
+            file.truncate(start * self._row_bytes)
+            file.write(np.ascontiguousarray(scores, dtype=DTYPE).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    # Scores of one reference as a (rows, questions) memory map
+    def column(self, uid):
+        rows = self.scored(uid)
+        if rows == 0:
+            return np.empty((0, len(self.questions)), dtype=DTYPE)
+        return np.memmap(self._path(uid), dtype=DTYPE, mode="r", shape=(rows, len(self.questions)))
+
+    # Every reference side by side, shaped (rows, references, questions). Only rows that every
+    # reference has scored are included, call update first to bring them all up to date.
+    def scores(self):
+        columns = [self.column(uid) for uid in self.uids]
+        if not columns:
+            return np.empty((0, 0, len(self.questions)), dtype=DTYPE)
+        rows = min(len(column) for column in columns)
+        return np.stack([column[:rows] for column in columns], axis=1)
@@ -0,0 +1,132 @@
+# Headless report of the demographic charts, for servers without a display (cron, CI).
+# The numbers come from analysis in one go: averages and counts from the demographic aggregates
+# and bootstrap confidence intervals from stats.py. Every chart is then drawn once for the overall
+# score and once per question with matplotlib's Agg backend, in a pool of worker processes, and
+# saved as PNG and/or SVG, along with a heatmap of every question against every group. summary.csv and summary.json hold the same numbers as the charts.
+#
+# Usage: python report.py [--out reports] [--formats png svg] [--workers N] [--resamples 2000]
+
+import os
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import analysis
+import charts
+from demographics import SCORE_KEYS
+from storage import write_atomic
+import profiling
+
+OUT = "reports"
+FORMATS = ["png", "svg"]
+RESAMPLES = 2000
+
+
+# Runs in a worker process. job is (chart, values, errors, paths), plain data only.
+def render(job):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    chart, values, errors, paths = job
+    fig = Figure(figsize=chart["size"], dpi=charts.DPI)
+    bars = charts.draw_chart(fig, chart, values)
+    if errors is not None:
+        charts.draw_errors(bars, errors)
+    fig.tight_layout()
+    for path in paths:
+        fig.savefig(path)
+    return paths
+
+# Runs in a worker process. The question by group heatmap of every chart in one figure.
+def render_heatmap(means, paths):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=charts.HEATMAP_SIZE, dpi=charts.DPI, layout="constrained")
+    charts.draw_heatmap(fig, means, SCORE_KEYS)
+    for path in paths:
+        fig.savefig(path)
+    return paths
+
+
+# Everything the charts show, one entry per (chart, score column)
+def collect(resamples=RESAMPLES):
+    breakdown = analysis.question_breakdown()
+    entries = []
+    for k, key in enumerate(breakdown["scores"]):
+        intervals = analysis.demographic_intervals(key, resamples) if resamples else None
+        for chart in charts.CHARTS:
+            values = charts.chart_values(chart, breakdown["means"][k])
+            entries.append({
+                "chart": chart["name"],
+                "score": key,
+                "labels": chart["labels"],
+                "means": values,
+                "counts": [int(count) for count in charts.chart_values(chart, breakdown["counts"][k])],
+                "low": None if intervals is None else charts.chart_values(chart, intervals["low"]),
+                "high": None if intervals is None else charts.chart_values(chart, intervals["high"]),
+                "errors": None if intervals is None else charts.chart_errors(chart, values, intervals)
+            })
+    return entries, breakdown["means"]
+
+def write_summary(entries, out):
+    with open(os.path.join(out, "summary.csv"), "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["chart", "score", "group", "mean", "count", "low", "high"])
+        for entry in entries:
+            for i, label in enumerate(entry["labels"]):
+                low = entry["low"][i] if entry["low"] is not None else None
+                high = entry["high"][i] if entry["high"] is not None else None
+                writer.writerow([entry["chart"], entry["score"], label, entry["means"][i], entry["counts"][i],
+                                 "" if low is None or low != low else low, "" if high is None or high != high else high])
+    # NaN isn't valid JSON, buckets without an interval get null
+    clean = [{key: value for key, value in entry.items() if key != "errors"} for entry in entries]
+    for entry in clean:
+        for key in ("low", "high"):
+            if entry[key] is not None:
+                entry[key] = [None if value != value else value for value in entry[key]]
+    write_atomic(os.path.join(out, "summary.json"), json.dumps({
+        "respondents": len(analysis.get_demo_index()),
+        "charts": clean
+    }, indent=4))
+
+
+# Writes the whole report to out and returns the paths of the chart files
+def build_report(out=OUT, formats=FORMATS, workers=None, resamples=RESAMPLES):
+    os.makedirs(out, exist_ok=True)
+    with profiling.timer("report.collect"):
+        entries, means = collect(resamples)
+    write_summary(entries, out)
+    jobs = []
+    for entry in entries:
+        chart = next(chart for chart in charts.CHARTS if chart["name"] == entry["chart"])
+        name = f"{entry['chart']}_{entry['score']}"
+        jobs.append((charts.chart_for(chart, entry["score"]), entry["means"], entry["errors"],
+                     [os.path.join(out, f"{name}.{extension}") for extension in formats]))
+    heatmap = [os.path.join(out, f"heatmap.{extension}") for extension in formats]
+    # The charts are drawn in other processes, so only the time for all of them together is recorded here
+    with profiling.timer("report.render"):
+        if workers == 1:
+            done = [render(job) for job in jobs] + [render_heatmap(means, heatmap)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = pool.submit(render_heatmap, means, heatmap)
+                done = list(pool.map(render, jobs)) + [pending.result()]
+    profiling.count("report.charts", len(jobs) + 1)
+    return [path for paths in done for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the demographic charts and a summary without a display")
+    parser.add_argument("--out", default=OUT, help="folder the report is written to")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=["png", "svg", "pdf"])
+    parser.add_argument("--workers", type=int, default=None, help="processes drawing charts, 1 draws them here")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES, help="bootstrap resamples for the error bars, 0 for none")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+    paths = build_report(args.out, args.formats, args.workers, args.resamples)
+    print(f"Wrote {len(paths)} chart files and summary.csv/summary.json to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Batch cosine similarity over the embedding store.
+# The stored codes are read once and kept in memory in the store's own format (float32, float16 or
+# int8, see compact.py), together with one 1 / length factor per vector. Every similarity is then a
+# dot product of codes times the two factors, so one uid against everybody is a few batched matrix
+# products over blocks of rows, and the store never has to be decoded into float32 as a whole.
+
+import numpy as np
+import profiling
+
+BLOCK = 1024
+
+
+# Scales every vector in the last axis to unit length. All zero vectors are left as zeros.
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class SimilarityEngine:
+    def __init__(self, store):
+        self.store = store
+        self.questions = store.questions
+        self.uids = []
+        self.rows = {}
+        self._codes = np.empty((0, len(self.questions), store.dim or 0), dtype=np.float32)
+        self._factors = np.empty((0, len(self.questions)), dtype=np.float32)
+        self.refresh()
+
+    # Pulls in rows that were appended to the store since the last call. Only the new rows are read,
+    # the buffers grow by doubling so repeated single adds stay cheap.
+    def refresh(self):
+        start = len(self.uids)
+        end = len(self.store)
+        if end == start:
+            return
+        new = np.asarray(self.store.codes()[start:end])
+        if start == 0 or self._codes.shape[0] < end or self._codes.shape[2] != new.shape[2]:
+            capacity = max(end, 2 * start)
+            codes = np.empty((capacity, len(self.questions), new.shape[2]), dtype=new.dtype)
+            codes[:start] = self._codes[:start]
+            factors = np.empty((capacity, len(self.questions)), dtype=np.float32)
+            factors[:start] = self._factors[:start]
+            self._codes, self._factors = codes, factors
+        self._codes[start:end] = new
+        norms = np.linalg.norm(new.astype(np.float32), axis=-1)
+        self._factors[start:end] = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+        for uid in self.store.uids[start:end]:
+            self.rows[uid] = len(self.uids)
+            self.uids.append(uid)
+
+    # Unit vectors for the given rows (an index, list or slice), float32 shaped (..., questions, dim)
+    def vectors(self, rows):
+        count = len(self.uids)
+        return self._codes[:count][rows].astype(np.float32) * self._factors[:count][rows][..., np.newaxis]
+
+    # Unit vectors for every stored row, shaped (rows, questions, dim). This decodes everything, the
+    # methods below work block by block instead.
+    @property
+    def unit(self):
+        return self.vectors(slice(None))
+
+    # Unit vectors of the given rows (every row by default) for one question (by position in
+    # self.questions), shaped (rows, dim)
+    def question(self, q, rows=slice(None)):
+        count = len(self.uids)
+        return self._codes[:count][rows, q].astype(np.float32) * self._factors[:count][rows, q, np.newaxis]
+
+    # Per question similarity between two uids, shape (questions,)
+    def pair(self, uid1, uid2):
+        first, second = self.vectors([self.rows[uid1], self.rows[uid2]])
+        return np.einsum("qd,qd->q", first, second)
+
+    # Rows from start on against reference unit vectors shaped (references, questions, dim).
+    # Returns (rows, references, questions) in self.uids order.
+    @profiling.timed("similarity.against_vectors")
+    def against_vectors(self, references, start=0, block=BLOCK):
+        count = len(self.uids)
+        references = np.asarray(references, dtype=np.float32).transpose(1, 2, 0)
+        out = np.empty((count - start, references.shape[2], len(self.questions)), dtype=np.float32)
+        for i in range(start, count, block):
+            end = min(i + block, count)
+            codes = self._codes[i:end].astype(np.float32, copy=False).transpose(1, 0, 2)
+            # (questions, rows, dim) @ (questions, dim, references) is one batched product over all questions
+            scores = np.matmul(codes, references) * self._factors[i:end].T[:, :, np.newaxis]
+            out[i - start:end - start] = scores.transpose(1, 2, 0)
+        return out
+
+    # One uid against every stored row on every question, shape (rows, questions).
+    # Row order follows self.uids.
+    def against(self, uid):
+        return self.against_vectors(self.vectors([self.rows[uid]]))[:, 0]
+
+    # Yields (row_start, col_start, block) where block holds the similarities of rows
+    # row_start.. against col_start.. shaped (block rows, block cols, questions)
+    def iter_pairwise(self, block=BLOCK):
+        count = len(self.uids)
+        for i in range(0, count, block):
+            left = self.vectors(slice(i, i + block)).transpose(1, 0, 2)
+            for j in range(0, count, block):
+                right = self.vectors(slice(j, j + block)).transpose(1, 0, 2)
+                yield i, j, np.matmul(left, right.transpose(0, 2, 1)).transpose(1, 2, 0)
+
+    # The full (rows, rows, questions) similarity tensor. For big surveys pass a np.memmap as out
+    # so the result never has to fit in memory.
+    @profiling.timed("similarity.pairwise")
+    def pairwise(self, block=BLOCK, out=None):
+        count = len(self.uids)
+        if out is None:
+            out = np.empty((count, count, len(self.questions)), dtype=np.float32)
+        for i, j, scores in self.iter_pairwise(block):
+            out[i:i + scores.shape[0], j:j + scores.shape[1]] = scores
+        return out
@@ -0,0 +1,99 @@
+# Uncertainty and significance for the demographic averages.
+# Everything works on the arrays behind demographics.DemoIndex: codes (rows, demographics) and scores
+# (rows, score columns), where only scores above lowbar count, the same rule the plain averages use.
+# Resampling is done with whole index matrices at once (resamples x group size) instead of one
+# Python loop turn per resample, in chunks so memory stays bounded for big groups.
+# scipy is only imported by group_tests, it is slow to import and nothing else here needs it.
+
+import numpy as np
+from demographics import DEMOGRAPHICS, MAX_BUCKETS, BUCKET_COUNTS
+
+RESAMPLES = 10000
+CONFIDENCE = 0.95
+# Most values gathered at once while resampling
+CHUNK = 1 << 22
+
+
+# Splits the kept scores of one column by bucket. Returns one array per bucket.
+def bucket_values(bucket_codes, values, lowbar=0, buckets=MAX_BUCKETS):
+    keep = values > lowbar
+    bucket_codes = bucket_codes[keep]
+    values = values[keep]
+    order = np.argsort(bucket_codes, kind="stable")
+    counts = np.bincount(bucket_codes, minlength=buckets)
+    return np.split(values[order], np.cumsum(counts)[:-1])
+
+# Means of resamples bootstrap resamples of values, shape (resamples,)
+def bootstrap_means(values, resamples=RESAMPLES, rng=None):
+    rng = np.random.default_rng(rng)
+    count = len(values)
+    means = np.empty(resamples)
+    step = max(1, CHUNK // max(count, 1))
+    for start in range(0, resamples, step):
+        rows = min(step, resamples - start)
+        means[start:start + rows] = values[rng.integers(0, count, (rows, count))].mean(axis=1)
+    return means
+
+
+# Percentile bootstrap interval of the mean for every (demographic, bucket, score column).
+# Returns a dict of arrays shaped (demographics, MAX_BUCKETS, score columns): "low" and "high" are
+# the interval ends and "stderr" the bootstrap standard error. Buckets with fewer than two scores
+# get NaN everywhere.
+def bootstrap_intervals(codes, scores, lowbar=0, resamples=RESAMPLES, confidence=CONFIDENCE, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (len(DEMOGRAPHICS), MAX_BUCKETS, scores.shape[1])
+    low = np.full(shape, np.nan)
+    high = np.full(shape, np.nan)
+    stderr = np.full(shape, np.nan)
+    tail = (1 - confidence) / 2 * 100
+    for d in range(len(DEMOGRAPHICS)):
+        for k in range(scores.shape[1]):
+            for b, values in enumerate(bucket_values(codes[:, d], scores[:, k], lowbar)):
+                if len(values) < 2:
+                    continue
+                means = bootstrap_means(values, resamples, rng)
+                low[d, b, k], high[d, b, k] = np.percentile(means, [tail, 100 - tail])
+                stderr[d, b, k] = means.std(ddof=1)
+    return {"low": low, "high": high, "stderr": stderr}
+
+
+# Two sided permutation test for a difference in means between the score arrays a and b.
+# Returns (mean of a - mean of b, p value).
+def permutation_test(a, b, resamples=RESAMPLES, seed=0):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if len(a) == 0 or len(b) == 0:
+        return float("nan"), float("nan")
+    rng = np.random.default_rng(seed)
+    pooled = np.concatenate([a, b])
+    observed = a.mean() - b.mean()
+    extreme = 0
+    step = max(1, CHUNK // len(pooled))
+    for start in range(0, resamples, step):
+        rows = min(step, resamples - start)
+        # Every row of the index matrix is an independent shuffle of the pooled scores
+        shuffled = pooled[rng.random((rows, len(pooled))).argsort(axis=1)]
+        diffs = shuffled[:, :len(a)].mean(axis=1) - shuffled[:, len(a):].mean(axis=1)
+        extreme += int(np.count_nonzero(np.abs(diffs) >= abs(observed) - 1e-12))
+    return float(observed), (extreme + 1) / (resamples + 1)
+
+
+# One way ANOVA and Kruskal-Wallis across the buckets of every demographic, for every score column.
+# Only buckets with at least two scores take part. Returns a dict of arrays shaped
+# (demographics, score columns): "anova_f", "anova_p", "kruskal_h" and "kruskal_p", NaN where fewer
+# than two buckets qualify.
+def group_tests(codes, scores, lowbar=0):
+    from scipy.stats import f_oneway, kruskal
+    shape = (len(DEMOGRAPHICS), scores.shape[1])
+    results = {name: np.full(shape, np.nan) for name in ("anova_f", "anova_p", "kruskal_h", "kruskal_p")}
+    for d in range(len(DEMOGRAPHICS)):
+        for k in range(scores.shape[1]):
+            groups = [values for values in bucket_values(codes[:, d], scores[:, k], lowbar, BUCKET_COUNTS[d])
+                      if len(values) >= 2]
+            if len(groups) < 2:
+                continue
+            results["anova_f"][d, k], results["anova_p"][d, k] = f_oneway(*groups)
+            # kruskal refuses groups where every score is the same
+            if len(np.unique(np.concatenate(groups))) > 1:
+                results["kruskal_h"][d, k], results["kruskal_p"][d, k] = kruskal(*groups)
+    return results
@@ -0,0 +1,189 @@
+# Crash safe storage for responses, compared scores and custom questions.
+# Each dataset is a JSONL file with one record per line. Adding records only appends their lines and
+# fsyncs, so the cost of a write depends on the record and not on how much is already stored, and a
+# crash can at worst leave half a line at the end. That half line is ignored when reading and cut
+# off before the next append. Whole file rewrites (compaction, save_atomic) go through a temp file
+# and os.replace so the old file stays intact until the new one is complete.
+
+import os
+import json
+import threading
+from jsonstream import iter_records
+import profiling
+
+
+# Writes text to path by writing a temp file next to it and swapping it in
+def write_atomic(path, text):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp = path + ".tmp"
+    profiling.count("storage.bytes_written", len(text))
+    with open(temp, "w", encoding="utf-8") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp, path)
+
+# Crash safe replacement for json.dump(data, file, indent=4)
+def save_atomic(data, path):
+    write_atomic(path, json.dumps(data, indent=4))
+
+
+class RecordLog:
+    # key names the field that identifies a record, for example "uid". When it is set, compact()
+    # keeps only the newest record for each key.
+    def __init__(self, path, key=None):
+        self.path = path
+        self.key = key
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        read = 0
+        try:
+            with open(self.path, "rb") as file:
+                for line in file:
+                    read += len(line)
+                    if not line.endswith(b"\n"):
+                        # Torn write from a crash, the record never finished
+                        break
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+        finally:
+            profiling.count("storage.bytes_read", read)
+
+    # Every record as a list, the same thing load_json gives for the old .json files
+    def load(self):
+        return list(self)
+
+    def append(self, record):
+        self.extend([record])
+
+    # Appends records with a single write and fsync. The file lock keeps appends from other
+    # processes from interleaving with ours.
+    def extend(self, records):
+        text = "".join(json.dumps(record) + "\n" for record in records)
+        if not text:
+            return
+        data = text.encode("utf-8")
+        profiling.count("storage.bytes_written", len(data))
+        with self._lock, file_lock(self.path):
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(self.path, "ab") as file:
+                self._drop_torn_tail(file)
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+    # file is open for appending. If the last line has no newline it is the remains of an interrupted
+    # write and gets truncated away.
+    def _drop_torn_tail(self, file):
+        size = file.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        with open(self.path, "rb") as reader:
+            reader.seek(size - 1)
+            if reader.read(1) == b"\n":
+                return
+            # Walk back to the end of the last complete line
+            end = size
+            while end > 0:
+                start = max(0, end - 4096)
+                reader.seek(start)
+                chunk = reader.read(end - start)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+        file.truncate(end)
+
+    # Replaces the whole log with records in one atomic step
+    def rewrite(self, records):
+        with self._lock, file_lock(self.path):
+            self._rewrite_locked(records)
+
+    # Only call with self._lock and the file lock held
+    def _rewrite_locked(self, records):
+        write_atomic(self.path, "".join(json.dumps(record) + "\n" for record in records))
+
+    # Drops every record predicate(record) is true for, reading and rewriting under the file lock like
+    # compact. Returns how many were dropped. The log is only rewritten when something matched.
+    def remove(self, predicate):
+        with self._lock, file_lock(self.path):
+            records = self.load()
+            kept = [record for record in records if not predicate(record)]
+            if len(kept) != len(records):
+                self._rewrite_locked(kept)
+        return len(records) - len(kept)
+
+    # Drops records that were superseded by a newer one with the same key. Returns how many were dropped.
+    # Reading and rewriting happen under the file lock, so records another process appends meanwhile
+    # wait for the rewrite instead of getting lost in it.
+    def compact(self):
+        with self._lock, file_lock(self.path):
+            records = self.load()
+            if self.key is None:
+                kept = records
+            else:
+                newest = {}
+                for i, record in enumerate(records):
+                    newest[record.get(self.key)] = i
+                kept = [record for i, record in enumerate(records) if newest[record.get(self.key)] == i]
+            self._rewrite_locked(kept)
+        return len(records) - len(kept)
+
+
+# Opens a log, first copying in the records of an old style .json list if the log doesn't exist yet.
+# The old file is streamed a record at a time instead of being loaded whole.
+def open_log(path, legacy=None, key=None):
+    log = RecordLog(path, key)
+    if legacy and not os.path.exists(path) and os.path.exists(legacy):
+        log.rewrite(iter_records(legacy))
+    return log
+
+
+# Holds an exclusive lock on path + ".lock" for the duration of a with block. Other processes
+# asking for the same lock wait until it is released.
+class file_lock:
+    def __init__(self, path):
+        self.path = path + ".lock"
+        self._file = None
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(self.path, "a+b")
+        if os.name == "nt":
+            import msvcrt
+            import time
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after about ten seconds, keep waiting
+                    time.sleep(0.1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if os.name == "nt":
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        return False
@@ -0,0 +1,94 @@
+# The survey itself: the questions we ask, the demographics we ask about and how answers to those
+# are grouped. Everything else (the GUI form, manual_ask, the bulk importer, the embedding store
+# layout, the score columns and the demographic charts) is built from what is defined here.
+# The built in survey below can be swapped for another one by pointing ANALYSIS_SURVEY at a JSON file
+# with "questions" and "demographics" laid out the same way, with ranges given as [low, high] lists.
+
+import os
+import json
+
+QUESTIONS = [
+    "What does the phrase: \"Actions speak louder than words\" mean?",
+    "What makes someone a good leader?",
+    "What are some red flags that indicate someone is untrustworthy?",
+    "What does it mean to be successful?",
+    "What does it mean to be happy?",
+    "Imagine you lost something valuable to you. What would you do?",
+    "Complete the prompt: The electrician was...",
+    "Billy walked into his kitchen and saw a broken glass on the floor. What do you think happened?"
+]
+
+GENDERS = ["Male", "Female", "Non-binary", "Prefer not to say/Other"]
+ETHNICITIES = ["White/Caucasian", "Asian - Eastern", "Asian - Indian", "Hispanic", "Black", "Native American", "Prefer not to answer"]
+EDUCATIONS = ["Lower than highschool degree", "Highschool Diploma", "Bachelor's Degree", "Master's Degree", "Prefer not to answer"]
+INCOMES = ["$0 - $4,999", "$5,000 - $7,499", "$7,500 - $9,999", "$10,000 - $12,499", "$12,500 - $14,999", "$15,000 - $19,999",
+           "$20,000 - $24,999", "$25,000 - $29,999", "$30,000 - $34,999", "$35,000 - $39,999", "$40,000 - $49,999", "$50,000 - $59,999",
+           "$60,000 - $74,999", "$75,000 - $99,999", "$100,000 - $149,999", "$150,000+", "Prefer not to answer"]
+
+# Demographics in the order the form asks them.
+# "choice" demographics are picked from options. Each option is its own bucket, in option order
+# unless buckets gives another order, and aliases maps other spellings onto a bucket.
+# "range" demographics are whole numbers grouped into ranges, a high of None means no upper end.
+# Anything that doesn't land in a bucket goes to one extra "unlisted" bucket at the end.
+DEMOGRAPHICS = [
+    {"name": "age", "prompt": "What is your age?", "type": "range",
+     "ranges": [(18, 24), (25, 34), (35, 44), (45, 54), (55, 64), (65, None)]},
+    {"name": "gender", "prompt": "What is your gender identity?", "type": "choice", "options": GENDERS},
+    {"name": "ethnicity", "prompt": "What is your ethnicity?", "type": "choice", "options": ETHNICITIES},
+    # Education buckets keep the order the charts have always used
+    {"name": "education", "prompt": "What is the highest level of education you've completed?", "type": "choice",
+     "options": EDUCATIONS,
+     "buckets": ["Highschool Diploma", "Bachelor's Degree", "Master's Degree", "Prefer not to answer",
+                 "Lower than highschool level education"],
+     # The form has always called this one "Lower than highschool degree"
+     "aliases": {"Lower than highschool degree": "Lower than highschool level education"}},
+    {"name": "income", "prompt": "How much total gross income did all members of your household earn in the past fiscal year?",
+     "type": "choice", "options": INCOMES}
+]
+
+NAME_PROMPT = "What is your name?"
+
+SURVEY_FILE = os.environ.get("ANALYSIS_SURVEY")
+if SURVEY_FILE:
+    with open(SURVEY_FILE, "r", encoding="utf-8") as file:
+        _custom = json.load(file)
+    QUESTIONS = _custom["questions"]
+    DEMOGRAPHICS = _custom["demographics"]
+    for _demographic in DEMOGRAPHICS:
+        if "ranges" in _demographic:
+            _demographic["ranges"] = [tuple(bounds) for bounds in _demographic["ranges"]]
+
+
+# Field names used in responses (q1), the embedding store (q1e) and compared scores (r1c, rtc overall)
+QUESTION_FIELDS = [f"q{i + 1}" for i in range(len(QUESTIONS))]
+EMBED_KEYS = [f"{field}e" for field in QUESTION_FIELDS]
+SCORE_KEYS = [f"r{i + 1}c" for i in range(len(QUESTIONS))] + ["rtc"]
+DEMOGRAPHIC_NAMES = [demographic["name"] for demographic in DEMOGRAPHICS]
+
+# Field name -> allowed values, for the demographics that are picked from a list
+OPTIONS = {demographic["name"]: demographic["options"] for demographic in DEMOGRAPHICS if demographic["type"] == "choice"}
+
+# Column order of a response, the same order add_user takes its arguments in
+FIELDS = ["name"] + DEMOGRAPHIC_NAMES + QUESTION_FIELDS
+
+
+# The buckets of a demographic in code order, without the unlisted one: values for a choice, (low, high) for a range
+def buckets(demographic):
+    if demographic["type"] == "range":
+        return list(demographic["ranges"])
+    return list(demographic.get("buckets", demographic["options"]))
+
+# Readable name of every bucket of a demographic, unlisted included
+def bucket_labels(demographic):
+    if demographic["type"] == "range":
+        labels = [f"{low}+" if high is None else f"{low}-{high}" for low, high in demographic["ranges"]]
+    else:
+        labels = buckets(demographic)
+    return labels + ["Unlisted"]
+
+# A response as a dict keyed by FIELDS. Takes a tuple or list in FIELDS order, or a dict.
+# Missing fields are left blank.
+def as_response(user):
+    if not isinstance(user, dict):
+        user = dict(zip(FIELDS, user))
+    return {field: user.get(field, "") for field in FIELDS}
@@ -0,0 +1,9 @@
+# The modules live at the top of the repo. analysis reads ANALYSIS_DATA when it is imported, so it is
+# pointed at a throwaway folder before any test gets to import it, and the real Data folder is never touched.
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["ANALYSIS_DATA"] = tempfile.mkdtemp(prefix="analysis-tests-")
+os.environ.setdefault("OPENAI_API_KEY", "offline")
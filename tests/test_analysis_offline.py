@@ -0,0 +1,52 @@
+# The whole add/compare path offline, with HashEmbedder and FakeLLM in a temporary ANALYSIS_DATA
+# folder (see conftest.py).
+import numpy as np
+import pytest
+import analysis
+import survey
+from embeddings import HashEmbedder
+from generation import FakeLLM
+
+
+@pytest.fixture(autouse=True, scope="module")
+def offline():
+    analysis.use_embedder(HashEmbedder(dim=32))
+    analysis.use_llm(FakeLLM())
+    if analysis.CHATGPT_UID not in analysis.get_store():
+        analysis.add_users([user("ChatGPT")], compare=False)
+
+
+def user(name):
+    return [name] + [""] * len(survey.DEMOGRAPHICS) + [f"{name} answers question {q + 1}" for q in range(len(survey.QUESTIONS))]
+
+
+def test_added_users_are_compared():
+    uids = analysis.add_users([user("Ada"), user("Grace")])
+    compared = {record["uid"]: record for record in analysis.load_json(analysis.COMPARED)}
+    for uid in uids:
+        stored = [compared[uid][key] for key in survey.SCORE_KEYS]
+        np.testing.assert_allclose(stored, analysis.compare_scores(analysis.CHATGPT_UID, uid), atol=1e-6)
+
+
+def test_torn_response_is_ignored_and_overwritten():
+    with open(analysis.RESPONSES, "a") as file:
+        file.write('{"uid": 999999, "name": "Torn')
+    assert "Torn" not in [name for uid, name in analysis.get_names_with_uids()]
+    uid = analysis.add_user(*user("After the crash"))
+    names = dict(analysis.get_names_with_uids())
+    assert names[uid] == "After the crash"
+    assert 999999 not in names
+
+
+def test_bonus_question_uses_the_llm_backend():
+    response, similarity = analysis.bonus_questions("What is your favourite colour?", "Blue")
+    assert "What is your favourite colour?" in response
+    assert -1 <= similarity <= 1
+    assert analysis.load_json(analysis.CUSTOMQS)[-1]["Human Response"] == "Blue"
+
+
+def test_find_similar_never_returns_the_uid_itself():
+    uids = analysis.get_store().uids
+    results = analysis.find_similar(uid=uids[1], k=len(uids) + 5)
+    assert [uid for uid, score in results] and uids[1] not in [uid for uid, score in results]
+    assert len(results) == len(uids) - 1
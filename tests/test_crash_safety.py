@@ -0,0 +1,90 @@
+# What is left on disk after a crash in the middle of a write: a torn last line in a record log, and an
+# embedding index that got ahead of the data file.
+import json
+import numpy as np
+from storage import RecordLog
+from embed_store import EmbedStore
+
+QUESTIONS = ["q1e", "q2e"]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_text(json.dumps({"uid": 1}) + "\n" + json.dumps({"uid": 2}) + "\n" + '{"uid": 3, "na')
+    log = RecordLog(str(path), "uid")
+    assert [record["uid"] for record in log] == [1, 2]
+
+
+def test_append_after_torn_line_drops_it(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_text(json.dumps({"uid": 1}) + "\n" + '{"uid": 2, "na')
+    log = RecordLog(str(path), "uid")
+    log.append({"uid": 3})
+    assert [record["uid"] for record in log] == [1, 3]
+    assert path.read_text().endswith("\n")
+
+
+def test_index_ahead_of_data_is_truncated(tmp_path):
+    base = str(tmp_path / "embeds")
+    store = EmbedStore(base, QUESTIONS)
+    block = np.random.default_rng(0).standard_normal((3, len(QUESTIONS), 8)).astype(np.float32)
+    store.append_many([1, 2, 3], block)
+    # uids written to the index whose rows never reached the data file, plus a half written line
+    with open(store.index_path, "a") as file:
+        file.write("4\n5\n6")
+
+    reopened = EmbedStore(base, QUESTIONS)
+    assert reopened.uids == [1, 2, 3]
+    with open(reopened.index_path) as file:
+        assert file.read() == "1\n2\n3\n"
+    np.testing.assert_allclose(reopened.row(3), block[2])
+    reopened.append_many([4], block[:1])
+    assert EmbedStore(base, QUESTIONS).uids == [1, 2, 3, 4]
+
+
+def test_half_written_row_is_dropped_on_append(tmp_path):
+    base = str(tmp_path / "embeds")
+    store = EmbedStore(base, QUESTIONS)
+    block = np.random.default_rng(1).standard_normal((2, len(QUESTIONS), 8)).astype(np.float32)
+    store.append_many([1], block[:1])
+    with open(store.data_path, "ab") as file:
+        file.write(b"\0" * (store.row_bytes // 2))
+
+    reopened = EmbedStore(base, QUESTIONS)
+    assert reopened.uids == [1]
+    reopened.append_many([2], block[1:])
+    again = EmbedStore(base, QUESTIONS)
+    assert again.uids == [1, 2]
+    np.testing.assert_allclose(again.row(2), block[1])
+
+
+def test_compact_keeps_records_appended_meanwhile(tmp_path, monkeypatch):
+    path = tmp_path / "log.jsonl"
+    log = RecordLog(str(path), "uid")
+    log.extend([{"uid": 1, "v": 1}, {"uid": 1, "v": 2}])
+    other = RecordLog(str(path), "uid")
+    load = RecordLog.load
+
+    # Another worker tries to append while compact has read the log but not written it back yet
+    def load_then_append(self):
+        records = load(self)
+        import threading
+        appender = threading.Thread(target=other.append, args=({"uid": 2, "v": 1},))
+        appender.start()
+        appender.join(0.2)
+        self.appender = appender
+        return records
+
+    monkeypatch.setattr(RecordLog, "load", load_then_append)
+    assert log.compact() == 1
+    monkeypatch.setattr(RecordLog, "load", load)
+    log.appender.join()
+    assert [(record["uid"], record["v"]) for record in log] == [(1, 2), (2, 1)]
+
+
+def test_remove(tmp_path):
+    log = RecordLog(str(tmp_path / "log.jsonl"), "uid")
+    log.extend([{"uid": uid} for uid in range(5)])
+    assert log.remove(lambda record: record["uid"] in (1, 3)) == 2
+    assert log.remove(lambda record: record["uid"] == 9) == 0
+    assert [record["uid"] for record in log] == [0, 2, 4]
@@ -0,0 +1,50 @@
+# iter_records has to give the same records as json.load however the file is cut into chunks,
+# including strings with escaped quotes and brackets in them.
+import json
+import numpy as np
+import pytest
+from jsonstream import iter_records, iter_vector_blocks
+
+RECORDS = [
+    {"uid": 1, "name": "Plain", "q1": "An answer", "q1e": [0.5, -1.25, 3e-05]},
+    {"uid": 2, "name": "Quote \" and [brackets] {braces}", "q1": "Back\\slash \\\" ]}", "q1e": [1, 2, 3]},
+    {"uid": 3, "name": "Ünïcödé ✓", "q1": "", "nested": {"list": [[1, 2], {"a": "]"}]}, "q1e": [0.0, 0.0, -0.0]},
+    {"uid": 4, "name": None, "q1": "Last", "empty": [], "q1e": [7.5, 8.5, 9.5]}
+]
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(RECORDS, indent=4, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 7, 64, 1 << 20])
+def test_matches_json_load(export, chunk):
+    with open(export, encoding="utf-8") as file:
+        expected = json.load(file)
+    assert list(iter_records(export, chunk=chunk)) == expected
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 1 << 20])
+def test_fields_and_vectors(export, chunk):
+    records = list(iter_records(export, fields=["uid", "q1"], vectors=["q1e"], chunk=chunk))
+    assert [sorted(record) for record in records] == [["q1", "q1e", "uid"]] * len(RECORDS)
+    for record, original in zip(records, RECORDS):
+        assert record["uid"] == original["uid"] and record["q1"] == original["q1"]
+        assert record["q1e"].dtype == np.float32
+        np.testing.assert_array_equal(record["q1e"], np.array(original["q1e"], dtype=np.float32))
+
+
+def test_vector_blocks(export):
+    blocks = list(iter_vector_blocks(export, ["q1e"], rows=3, chunk=4))
+    assert [uids for uids, block in blocks] == [[1, 2, 3], [4]]
+    assert blocks[-1][1].shape == (1, 1, 3)
+
+
+def test_cut_off_file_is_an_error(tmp_path):
+    path = tmp_path / "cut.json"
+    path.write_text(json.dumps(RECORDS)[:-20])
+    with pytest.raises(ValueError):
+        list(iter_records(str(path), chunk=8))
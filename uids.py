@@ -0,0 +1,35 @@
+# uid allocation that is safe with several processes adding responses at once.
+# The last handed out uid is kept in a counter file that is only read and written while holding a
+# file lock. The first time a process uses the counter it is moved past the highest uid already in
+# the data, so a lost, stale or out of date counter file heals itself instead of reusing uids.
+
+from storage import file_lock, write_atomic
+
+
+class UidAllocator:
+    # floor is a function returning the highest uid already used anywhere in the data
+    def __init__(self, path, floor=None):
+        self.path = path
+        self.floor = floor
+        self._healed = False
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as file:
+                return int(file.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    # Hands out count consecutive uids as a range. Bulk and parallel imports reserve a whole block
+    # in one go so the lock is only taken once per block.
+    def reserve(self, count=1):
+        with file_lock(self.path):
+            last = self._read()
+            if not self._healed and self.floor is not None:
+                last = max(last, self.floor())
+                self._healed = True
+            write_atomic(self.path, str(last + count))
+        return range(last + 1, last + count + 1)
+
+    def next(self):
+        return self.reserve(1)[0]
@@ -0,0 +1,175 @@
+# Nearest neighbour search over embeddings.
+# ExactIndex compares a query against every stored vector in blocks and is the right choice for
+# small surveys. IVFIndex clusters the vectors with k-means and only searches the few clusters
+# closest to the query, which keeps queries in the low milliseconds for 100k+ responses at the cost
+# of sometimes missing a neighbour. Both take vectors of any length and normalise them, so scores
+# are cosine similarities, and both accept new vectors at any time.
+
+import numpy as np
+from similarity import normalize
+
+BLOCK = 65536
+# Below this many vectors an exact search is fast enough
+EXACT_LIMIT = 20000
+
+
+# Indices of the k largest values of scores, largest first
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+# Growable (rows, dim) float32 array with ids alongside
+class _Rows:
+    def __init__(self, dim, capacity=256):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.count = 0
+
+    def add(self, ids, vectors):
+        end = self.count + len(ids)
+        if end > len(self.ids):
+            capacity = max(end, 2 * len(self.ids))
+            grown = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_ids[:self.count] = self.ids[:self.count]
+            self.vectors, self.ids = grown, grown_ids
+        self.vectors[self.count:end] = vectors
+        self.ids[self.count:end] = ids
+        self.count = end
+
+
+class ExactIndex:
+    def __init__(self, dim):
+        self.dim = dim
+        self._rows = _Rows(dim)
+
+    def __len__(self):
+        return self._rows.count
+
+    def add(self, ids, vectors):
+        self._rows.add(ids, normalize(vectors))
+
+    # Returns (ids, scores) of the k most similar vectors, best first. exclude is an id to leave out,
+    # usually the one the query came from.
+    def search(self, query, k=10, exclude=None):
+        query = normalize(query)
+        rows = self._rows
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        # Keep the best k of every block and merge, so memory stays bounded for huge indexes
+        for start in range(0, rows.count, BLOCK):
+            end = min(start + BLOCK, rows.count)
+            scores = rows.vectors[start:end] @ query
+            ids = rows.ids[start:end]
+            if exclude is not None:
+                scores = np.where(ids == exclude, -np.inf, scores)
+            keep = top_k(scores, k)
+            best_ids = np.concatenate([best_ids, ids[keep]])
+            best_scores = np.concatenate([best_scores, scores[keep]])
+        keep = top_k(best_scores, k)
+        keep = keep[np.isfinite(best_scores[keep])]
+        return best_ids[keep], best_scores[keep]
+
+
+class IVFIndex:
+    # nlist is the number of clusters, nprobe how many of the closest clusters each query looks at
+    def __init__(self, dim, nlist=256, nprobe=16, seed=0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self._lists = []
+        # Vectors added before there was anything to train on
+        self._waiting = _Rows(dim)
+
+    def __len__(self):
+        return sum(rows.count for rows in self._lists) + self._waiting.count
+
+    # How many vectors train looks at, at most
+    @property
+    def sample_size(self):
+        return max(40 * self.nlist, 10000)
+
+    # Spherical k-means on (at most) sample vectors
+    def train(self, vectors, iterations=10, sample=None):
+        vectors = normalize(vectors)
+        rng = np.random.default_rng(self.seed)
+        if sample is None:
+            sample = self.sample_size
+        if len(vectors) > sample:
+            vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+        nlist = min(self.nlist, len(vectors))
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assigned = np.argmax(vectors @ centroids.T, axis=1)
+            order = np.argsort(assigned, kind="stable")
+            counts = np.bincount(assigned, minlength=nlist)
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums[~empty] = np.add.reduceat(vectors[order], starts[~empty], axis=0)
+            # Clusters that lost all their members restart from a random vector
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+            centroids = normalize(sums)
+        self.centroids = centroids
+        self._lists = [_Rows(self.dim, 16) for _ in range(nlist)]
+        waiting = self._waiting
+        self._waiting = _Rows(self.dim)
+        if waiting.count:
+            self._assign(waiting.ids[:waiting.count], waiting.vectors[:waiting.count])
+
+    def _assign(self, ids, vectors):
+        assigned = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assigned, kind="stable")
+        bounds = np.searchsorted(assigned[order], np.arange(len(self._lists) + 1))
+        for cluster in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[cluster]:bounds[cluster + 1]]
+            self._lists[cluster].add(ids[rows], vectors[rows])
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize(vectors)
+        if self.centroids is None:
+            self._waiting.add(ids, vectors)
+        else:
+            self._assign(ids, vectors)
+
+    def search(self, query, k=10, exclude=None, nprobe=None):
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self.centroids is None:
+            self.train(self._waiting.vectors[:self._waiting.count])
+        query = normalize(query)
+        probes = top_k(self.centroids @ query, nprobe or self.nprobe)
+        lists = [self._lists[cluster] for cluster in probes if self._lists[cluster].count]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate([rows.ids[:rows.count] for rows in lists])
+        scores = np.concatenate([rows.vectors[:rows.count] @ query for rows in lists])
+        if exclude is not None:
+            scores = np.where(ids == exclude, -np.inf, scores)
+        keep = top_k(scores, k)
+        keep = keep[np.isfinite(scores[keep])]
+        return ids[keep], scores[keep]
+
+
+# Empty index for count vectors: exact search for small sets and an IVF index for big ones.
+# The IVF index still has to be trained, or it trains on whatever was added at the first search.
+def make_index(dim, count, exact_limit=EXACT_LIMIT):
+    if count < exact_limit:
+        return ExactIndex(dim)
+    return IVFIndex(dim, nlist=int(np.sqrt(count)))
+
+def build_index(ids, vectors, exact_limit=EXACT_LIMIT):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = make_index(vectors.shape[1], len(ids), exact_limit)
+    if isinstance(index, IVFIndex):
+        index.train(vectors)
+    index.add(ids, vectors)
+    return index